@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import time
+
+import dfp_api
+
+AD_UNIT_CACHE_DIR = '.cache'
+AD_UNIT_CACHE_MAX_AGE = 24 * 60 * 60 # seconds, inventory trees rarely change within a day
+
+
+class AdUnitIndex():
+    """
+    In-memory index of a network's ad unit tree, resolves ids, paths and names of ad units to ids.
+
+    Targets can be given as
+        - id: 21812345678
+        - path of ad unit codes as used in gpt tags, with or without network code: sports/football or /1234/sports/football
+        - subtree wildcard: sports/* (all ad units below sports)
+        - name or code of a single ad unit: Football
+    """
+
+    network_code: str = ''
+    root_ad_unit_id: str = ''
+    from_cache: bool = False
+    fetched_at: float = 0 # unix time the ad units were read from google admanager
+
+    # indexes of this process by cache path, long-running processes (line-item-service.py) don't reread the cache file per run
+    _loaded: dict[str, 'AdUnitIndex'] = {}
+
+    def __init__(self, network_code: str, ad_units: list[dict], from_cache: bool = False, fetched_at: float = 0):
+        self.network_code = str(network_code)
+        self.from_cache = from_cache
+        self.fetched_at = fetched_at or time.time()
+        self.ad_units = {ad_unit['id']: ad_unit for ad_unit in ad_units}
+        self.children: dict[str, list[str]] = {}
+        self.ids_by_name: dict[str, list[str]] = {}
+
+        for ad_unit in ad_units:
+            if ad_unit['parentId']:
+                self.children.setdefault(ad_unit['parentId'], []).append(ad_unit['id'])
+            else:
+                self.root_ad_unit_id = ad_unit['id']
+            for name in {ad_unit['name'], ad_unit['adUnitCode']}:
+                if name:
+                    self.ids_by_name.setdefault(name.lower(), []).append(ad_unit['id'])
+
+        # paths of ad unit codes below the root, e.g. sports/football
+        self.ids_by_path: dict[str, str] = {}
+        stack = [(child_id, ad_unit_path) for child_id, ad_unit_path in self._child_paths(self.root_ad_unit_id, '')]
+        while stack:
+            ad_unit_id, ad_unit_path = stack.pop()
+            self.ids_by_path[ad_unit_path] = ad_unit_id
+            stack.extend(self._child_paths(ad_unit_id, ad_unit_path))
+
+    def _child_paths(self, parent_id: str, parent_path: str):
+        for child_id in self.children.get(parent_id, []):
+            child = self.ad_units[child_id]
+            yield child_id, f"{parent_path}/{child['adUnitCode'] or child['name']}".lstrip('/').lower()
+
+    def get_subtree_ids(self, ad_unit_id: str) -> list[str]:
+        """
+        Returns the ids of all ad units below the given ad unit (not including the ad unit itself).
+        """
+        subtree_ids = []
+        stack = list(self.children.get(ad_unit_id, []))
+        while stack:
+            child_id = stack.pop()
+            subtree_ids.append(child_id)
+            stack.extend(self.children.get(child_id, []))
+        return subtree_ids
+
+    def _resolve_single(self, target: str) -> list[str]:
+        """
+        Resolves one target to ad unit ids, raises ValueError with a readable message if it can't be resolved.
+        """
+        if target.isdigit():
+            if target not in self.ad_units:
+                raise ValueError(f'no ad unit with id {target}')
+            return [target]
+
+        cleaned_target = target.strip().strip('/').lower()
+        # strip network code of gpt ad unit paths, e.g. /1234/sports/football
+        if cleaned_target.startswith(f'{self.network_code}/'):
+            cleaned_target = cleaned_target[len(self.network_code) + 1:]
+
+        if cleaned_target.endswith('/*') or cleaned_target == '*':
+            parent_path = cleaned_target[:-2] if cleaned_target != '*' else ''
+            parent_id = self.ids_by_path.get(parent_path) if parent_path else self.root_ad_unit_id
+            if not parent_id:
+                raise ValueError(f'no ad unit with path {parent_path}')
+            # archived ad units can't be targeted, wildcards skip them
+            subtree_ids = [ad_unit_id for ad_unit_id in self.get_subtree_ids(parent_id) if self.ad_units[ad_unit_id]['status'] != 'ARCHIVED']
+            if not subtree_ids:
+                raise ValueError(f'ad unit {parent_path} has no active child ad units')
+            return subtree_ids
+
+        if '/' in cleaned_target:
+            if cleaned_target not in self.ids_by_path:
+                raise ValueError(f'no ad unit with path {cleaned_target}')
+            return [self.ids_by_path[cleaned_target]]
+
+        if cleaned_target in self.ids_by_path:
+            return [self.ids_by_path[cleaned_target]]
+        ad_unit_ids = self.ids_by_name.get(cleaned_target, [])
+        if not ad_unit_ids:
+            raise ValueError(f'no ad unit with name or code {target}')
+        if len(ad_unit_ids) > 1:
+            paths = [ad_unit_path for ad_unit_path, ad_unit_id in self.ids_by_path.items() if ad_unit_id in ad_unit_ids]
+            raise ValueError(f'name {target} is ambiguous, use one of the paths {paths}')
+        return ad_unit_ids
+
+    def resolve(self, targets: list[str]) -> list[str]:
+        """
+        Resolves ad unit ids, paths and names to ids, exits if a target can't be resolved or is archived.
+        :param targets: list of ad unit ids, paths or names
+        :return: list of unique ad unit ids in the order of the targets
+        """
+        ad_unit_ids = []
+        errors = []
+        for target in targets:
+            try:
+                target_ids = self._resolve_single(target)
+            except ValueError as e:
+                errors.append(f'{target}: {e}')
+                continue
+            if any(self.ad_units[ad_unit_id]['status'] == 'ARCHIVED' for ad_unit_id in target_ids):
+                errors.append(f'{target}: archived ad units can not be targeted')
+            ad_unit_ids.extend(target_ids)
+
+        if errors:
+            # report every invalid target at once instead of exiting on the first one
+            for error in errors:
+                logging.error(f'Invalid target ad unit {error}')
+            if self.from_cache:
+                logging.error('Ad units were loaded from the local cache, use --refresh-ad-unit-cache if they were changed recently.')
+            exit(1)
+
+        return list(dict.fromkeys(ad_unit_ids))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as cache_file:
+            json.dump({'network_code': self.network_code, 'fetched_at': self.fetched_at, 'ad_units': list(self.ad_units.values())}, cache_file)
+
+    @classmethod
+    def load(cls, dfp_client, cache_dir: str = AD_UNIT_CACHE_DIR, max_age: int = AD_UNIT_CACHE_MAX_AGE, refresh: bool = False) -> 'AdUnitIndex':
+        """
+        Loads the ad unit index from the local cache or, if it is missing, outdated or refresh is set, from google admanager.
+        """
+        cache_path = os.path.join(cache_dir, f'ad_units_{dfp_client.network_code}.json')
+        loaded_index = cls._loaded.get(cache_path)
+        if not refresh and loaded_index and time.time() - loaded_index.fetched_at < max_age:
+            return loaded_index
+
+        if not refresh and os.path.exists(cache_path):
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)
+            if time.time() - cached['fetched_at'] < max_age:
+                logging.info(f"Using {len(cached['ad_units'])} cached ad units from {cache_path}")
+                index = cls(cached['network_code'], cached['ad_units'], from_cache=True, fetched_at=cached['fetched_at'])
+                cls._loaded[cache_path] = index
+                return index
+
+        ad_units = dfp_api.get_all_ad_units(dfp_client)
+        logging.info(f'Fetched {len(ad_units)} ad units of network {dfp_client.network_code}')
+        index = cls(dfp_client.network_code, ad_units)
+        index.save(cache_path)
+        cls._loaded[cache_path] = index
+        return index
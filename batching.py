@@ -0,0 +1,178 @@
+import json
+import logging
+import time
+from collections import deque
+
+import httpx
+import requests
+from googleads.errors import GoogleAdsServerFault
+
+from locking import check_leases
+from payload_sink import archive
+from session import get_session
+from transport import TransportSettings
+
+# payload-size-aware batching of create calls
+# batches are filled up to a byte budget (estimated size of the soap request) and an item budget,
+# the item budget shrinks on request-size errors, timeouts and slow calls and grows back on fast calls
+
+SOAP_SIZE_FACTOR = 2 # soap xml repeats every field name in opening and closing tags, roughly twice the json size
+SOAP_ENVELOPE_BYTES = 2048 # headers and envelope of one request
+
+# errors which are caused by the size of a request rather than by its items
+BATCH_SIZE_ERROR_MARKERS = ['(413)', 'Request Entity Too Large', 'SIZE_LIMIT', 'DEADLINE_EXCEEDED', 'ServerError.SERVER_BUSY']
+
+# creates whose rejected batches are bisected to the offending items while the session isolates failures,
+# the other creates (orders, key-values) are needed by every item and still fail the run
+ISOLATED_OPERATIONS = ('createLineItems', 'createLineItemCreativeAssociations')
+
+
+def estimate_size(item) -> int:
+    """
+    Rough estimate of the serialized soap size of one item in bytes.
+    """
+    return len(json.dumps(item, default=str, separators=(',', ':'))) * SOAP_SIZE_FACTOR
+
+
+def is_batch_size_error(error: Exception) -> bool:
+    if isinstance(error, (requests.exceptions.Timeout, httpx.TimeoutException)):
+        return True
+    return any(marker in str(error) for marker in BATCH_SIZE_ERROR_MARKERS)
+
+
+def is_item_error(error: Exception) -> bool:
+    """
+    Api errors caused by the items of a batch (e.g. a missing value id or an invalid ad unit) rather than by its size.
+    """
+    return isinstance(error, GoogleAdsServerFault) and not is_batch_size_error(error)
+
+
+def isolates_failures(operation: str) -> bool:
+    session = get_session()
+    return bool(session and session.isolate_failures and operation in ISOLATED_OPERATIONS)
+
+
+def error_paths(error: Exception) -> list[dict]:
+    """
+    Field paths, error strings and triggers of an api error, e.g. {'fieldPath': 'lineItem[0].targeting...',
+    'error': 'CommonError.NOT_FOUND', 'trigger': '123'}.
+    """
+    errors = [{'fieldPath': getattr(api_error, 'fieldPath', None), 'error': getattr(api_error, 'errorString', None), 'trigger': getattr(api_error, 'trigger', None)}
+              for api_error in getattr(error, 'errors', None) or ()]
+    return errors or [{'fieldPath': None, 'error': str(error), 'trigger': None}]
+
+
+def reject(operation: str, item, error: Exception):
+    """
+    Records an item that the api rejected on its own in the session of the run, see GamSession.rejected.
+    """
+    label = item['name'] if 'name' in item else f"lineItemId {item['lineItemId']}"
+    errors = error_paths(error)
+    logging.error(f"{operation}: {label} was rejected: {', '.join(str(api_error['error']) for api_error in errors)}")
+    get_session().reject(operation, label, errors)
+    archive(f'{operation}.rejected', item, errors)
+
+
+class AdaptiveBatcher():
+    """
+    Sends items in batches within a byte and an item budget and adapts the item budget to the observed calls:
+        - a request-size error or timeout halves the budget and the failed batch is sent again in smaller batches
+        - a call slower than target_seconds halves the budget for the next batches
+        - a full batch that is faster grows the budget by a quarter, up to max_items
+    While the session of the run isolates failures, a batch of line items or LICAs that the api rejects because of
+    its items is bisected until the rejected items are found, they are recorded and the rest is created.
+    No batch is sent once a lease of the run was lost, see locking.check_leases.
+    """
+
+    operation: str = ''
+    max_bytes: int = 1024 * 1024
+    max_items: int = 200
+    target_seconds: float = 30
+
+    def __init__(self, operation: str, max_bytes: int = 1024 * 1024, max_items: int = 200, target_seconds: float = 30):
+        self.operation = operation
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.target_seconds = target_seconds
+        self.item_budget = max_items
+
+    def _take(self, items: list) -> tuple[list, list]:
+        # a single item above the byte budget is still sent, alone
+        count = 0
+        size = SOAP_ENVELOPE_BYTES
+        for item in items:
+            item_size = estimate_size(item)
+            if count and (count >= self.item_budget or size + item_size > self.max_bytes):
+                break
+            count += 1
+            size += item_size
+        return items[:count], items[count:]
+
+    def split(self, items: list) -> list[list]:
+        """
+        Splits the items into batches with the current budgets, for callers that send batches concurrently.
+        """
+        batches = []
+        while items:
+            batch, items = self._take(items)
+            batches.append(batch)
+        return batches
+
+    def shrink(self, batch_size: int):
+        self.item_budget = max(1, batch_size // 2)
+
+    def observe(self, batch_size: int, seconds: float):
+        if seconds > self.target_seconds:
+            self.shrink(batch_size)
+            logging.info(f'{self.operation}: batch of {batch_size} took {seconds:.1f}s, next batches have at most {self.item_budget} items')
+        elif batch_size >= self.item_budget and self.item_budget < self.max_items:
+            self.item_budget = min(self.max_items, self.item_budget + max(1, self.item_budget // 4))
+
+    def run(self, items: list, create_batch) -> list:
+        """
+        Calls create_batch for every batch of the items and returns all results in the order of the items.
+        create_batch should skip existing items, a batch that timed out might have been created in parts.
+        """
+        results = []
+        pending = deque([list(items)]) if items else deque()
+        while pending:
+            check_leases(self.operation)
+            batch, rest = self._take(pending.popleft())
+            if rest:
+                pending.appendleft(rest)
+            start = time.perf_counter()
+            try:
+                batch_results = create_batch(batch)
+            except Exception as e:
+                if is_item_error(e) and isolates_failures(self.operation):
+                    if len(batch) == 1:
+                        reject(self.operation, batch[0], e)
+                    else:
+                        logging.warning(f'{self.operation}: batch of {len(batch)} was rejected, bisecting it')
+                        pending.appendleft(batch[len(batch) // 2:])
+                        pending.appendleft(batch[:len(batch) // 2])
+                    continue
+                if len(batch) == 1 or not is_batch_size_error(e):
+                    raise
+                self.shrink(len(batch))
+                logging.warning(f'{self.operation}: batch of {len(batch)} failed ({type(e).__name__}), sending it again in batches of at most {self.item_budget}')
+                pending.appendleft(batch)
+                continue
+            results.extend(batch_results)
+            archive(self.operation, batch, batch_results)
+            self.observe(len(batch), time.perf_counter() - start)
+        return results
+
+
+def get_batcher(dfp_client, operation: str) -> AdaptiveBatcher:
+    """
+    Returns the batcher of the operation, clients with transport settings (see transport.TunedDfpClient) keep their
+    batchers, so the budgets adapt over all calls of a run.
+    """
+    transport_settings = getattr(dfp_client, 'transport_settings', None) or TransportSettings()
+    batchers = getattr(dfp_client, 'batchers', None)
+    if batchers is None:
+        return AdaptiveBatcher(operation, transport_settings.max_request_bytes, transport_settings.max_batch_items)
+    if operation not in batchers:
+        batchers[operation] = AdaptiveBatcher(operation, transport_settings.max_request_bytes, transport_settings.max_batch_items)
+    return batchers[operation]
@@ -0,0 +1,164 @@
+import json
+import logging
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+import validation_helper
+from bucket import Buckets
+
+# offline microbenchmarks for the local computation of a run, no calls to google admanager are made
+# python benchmark.py                     run all cases and compare against benchmark_baseline.json
+# python benchmark.py --update-baseline   run all cases and store the results as new baseline
+
+BASELINE_PATH = 'benchmark_baseline.json'
+SIZES = [100, 1000, 10000, 100000]
+TIME_TOLERANCE = 2.0 # a case regresses if it takes twice as long as the baseline, shared machines easily add 50% noise
+MEMORY_TOLERANCE = 1.2 # or needs 20% more peak memory
+
+
+def create_buckets() -> Buckets:
+    return Buckets({
+        'format': 'wallpaper',
+        'line_item_type': 'price_priority',
+        'line_item_priority': 12,
+        'master_size': [728, 90],
+        'companion_sizes': [[160, 600]],
+        'start_time': 'immediately',
+        'end_time': 'unlimited',
+        'price_bucket_key_value_name': 'stroeer_ssp_hb_pb',
+        'hb_adid_parameter': 'hb_adid',
+        'start_price_bucket': 1,
+        'end_price_bucket': 100,
+        'price_bucket_step': 1,
+        'advertiser_id': 1,
+        'trafficker_id': 1,
+        'dfp_id': 1,
+        'write': False,
+        'currency': 'EUR',
+        'target_ad_units': ['1'],
+    })
+
+
+def create_cases(size: int) -> dict:
+    """
+    Creates the benchmark cases for synthetic inputs with `size` entries, every case is a function without arguments.
+    """
+    buckets = create_buckets()
+    price_buckets = list(range(1, size + 1))
+    line_item_groups = [[pb] for pb in price_buckets]
+    orders_with_price_buckets = buckets.create_price_buckets_per_order(line_item_groups)
+    orders = buckets.assemble_orders(orders_with_price_buckets)
+    orders_dict = {order_name: index for index, order_name in enumerate(orders)}
+    pb_values = [{'name': f'{pb/100:.2f}', 'id': pb} for pb in price_buckets]
+    format_values = [{'name': 'wallpaper', 'id': 1}, {'name': 'fireplace', 'id': 2}]
+    # every second existing value is missing, so half of the price buckets need to be mapped
+    existing_values = [{'name': f'{pb/100:.2f}', 'id': pb} for pb in price_buckets if pb % 2 == 0]
+    existing_orders = {'stroeer_ssp_wallpaper_existing': {'id': 1, 'line_item_names': [buckets.get_line_item_name(group) for group in line_item_groups[:size // 2]]}}
+
+    sizes = ', '.join(f'{100 + i % 1900}x{100 + i % 1700}' for i in range(size))
+    ad_units = ', '.join(f'adunit_{i}' for i in range(size))
+    granularity = ', '.join(f'{i * 10}-{i * 10 + 10}:1' for i in range(size // 10))
+
+    return {
+        'create_line_item_price_buckets': lambda: buckets.create_line_item_price_buckets(1, size, 1),
+        'group_price_buckets': lambda: buckets.group_price_buckets(price_buckets),
+        'create_price_buckets_per_order': lambda: buckets.create_price_buckets_per_order(line_item_groups),
+        'assemble_orders': lambda: buckets.assemble_orders(orders_with_price_buckets),
+        'pack_line_items_into_orders': lambda: buckets.pack_line_items_into_orders(line_item_groups, existing_orders),
+        'assemble_line_item_jsons': lambda: buckets.assemble_line_item_jsons(orders, 1, pb_values, 2, format_values, orders_dict),
+        'map_price_buckets_to_existing_values': lambda: buckets.map_price_buckets_to_existing_values(price_buckets, existing_values),
+        'validate_multiple_sizes': lambda: validation_helper.validate_multiple_sizes(sizes),
+        'validate_target_ad_units': lambda: validation_helper.validate_target_ad_units(ad_units),
+        'validate_price_granularity': lambda: validation_helper.validate_price_granularity(granularity),
+    }
+
+
+def measure(case, repeat: int) -> dict:
+    """
+    Measures the best wall time of `repeat` runs and the peak memory of one traced run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case()
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc slows down the run, so memory is measured separately
+    tracemalloc.start()
+    case()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': min(times), 'peak_bytes': peak_memory}
+
+
+def run_benchmarks(sizes: list[int], case_filter: str = '') -> dict:
+    results = {}
+    for size in sizes:
+        repeat = 5 if size <= 10000 else 2
+        for case_name, case in create_cases(size).items():
+            if case_filter and case_filter not in case_name:
+                continue
+            results[f'{case_name}[{size}]'] = measure(case, repeat)
+    return results
+
+
+def compare_to_baseline(results: dict, baseline: dict) -> list[str]:
+    regressions = []
+    for case_name, result in results.items():
+        if case_name not in baseline:
+            continue
+        base = baseline[case_name]
+        # ignore jitter of a few milliseconds, e.g. from garbage collection
+        if result['seconds'] > max(base['seconds'] * TIME_TOLERANCE, base['seconds'] + 0.005):
+            regressions.append(f"{case_name}: {result['seconds']:.4f}s (baseline {base['seconds']:.4f}s)")
+        if result['peak_bytes'] > max(base['peak_bytes'] * MEMORY_TOLERANCE, base['peak_bytes'] + 64 * 1024):
+            regressions.append(f"{case_name}: {result['peak_bytes'] / 1024:.0f}KiB peak (baseline {base['peak_bytes'] / 1024:.0f}KiB)")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(prog='Line Item Creator Benchmarks', description='Offline microbenchmarks for the local computation hot paths.')
+    parser.add_argument('--sizes', type=lambda sizes: [int(size) for size in sizes.split(',')], default=SIZES,
+                        help=f'Comma-separated input sizes, defaults to {",".join(str(size) for size in SIZES)}')
+    parser.add_argument('--case', type=str, default='',
+                        help='Only run cases whose name contains this string')
+    parser.add_argument('--baseline', type=str, default=BASELINE_PATH,
+                        help=f'Path of the baseline file, defaults to {BASELINE_PATH}')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Store the results as new baseline instead of comparing against it')
+    args = parser.parse_args()
+
+    # the hot paths log every step, which would be measured as well
+    logging.disable(logging.CRITICAL)
+    results = run_benchmarks(args.sizes, args.case)
+    logging.disable(logging.NOTSET)
+
+    for case_name, result in results.items():
+        print(f"{case_name:<50} {result['seconds'] * 1000:>10.2f}ms {result['peak_bytes'] / 1024:>12.0f}KiB")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f'Baseline written to {args.baseline}')
+        return
+
+    try:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        print(f'No baseline found at {args.baseline}, run with --update-baseline to create one')
+        return
+
+    regressions = compare_to_baseline(results, baseline)
+    if regressions:
+        print('Regressions against baseline:')
+        for regression in regressions:
+            print(f'  {regression}')
+        exit(1)
+    print('No regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,24 @@
+import bisect
 import datetime
 import logging
+import time
+from contextlib import nullcontext
 from textwrap import dedent
 
 import pytz
+import delivery
 import dfp_api
+import preflight
+from adunit_index import AdUnitIndex
+from locking import LEASE_TTL, SHARED_LEASE_WAIT, Lease, LeaseBackend, get_lease_backend
+from payload_sink import PayloadSink, archive
+from price_granularity import generate_price_buckets
+from profiling import RunProfiler, profile_stage
+from result_rows import ID_NAME
+from session import GamSession
+from transport import TransportSettings
 from validation_helper import Formats, LineItemTypes
+from verify import VerifyManifest, canonical_line_item, chunk_hash, content_hash, diff_fields
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
@@ -22,6 +36,10 @@ class Buckets():
     start_price_bucket: int = 0
     end_price_bucket: int = 0
     price_bucket_step: int = 0 
+    price_granularity: list[tuple[int, int, int]] = [] # [(start, end, step)] in cents, replaces start/end/step if given
+    price_buckets_per_line_item: int = 1 # amount of consecutive price-bucket values targeted by one line item
+    line_item_cpm: str = 'min' # representative cpm of a consolidated line item (min, mid or max of its price buckets)
+    max_line_item_price_spread: int = 0 # max difference in cents between lowest and highest price bucket of one line item (0 = no limit)
     # price_bucket_amount: int = 0 # maybe add as optional later (three of the four price bucket options to calculate the other?)
     advertiser_id: int = 0
     trafficker_id: int = 0
@@ -30,12 +48,25 @@ class Buckets():
     currency: str = '' # defaults to EUR - is that something we actually need? adservers have a default don't they?
     prefix: str = 'stroeer_ssp'
     target_ad_units: list[str] = [] # defaults to empty
+    profiler: RunProfiler = None # set to profile cpu & memory per stage of the run
+    extend: bool = False # only create the price buckets that are missing in the existing ladder of the format
+    dfp_client = None # injected client (e.g. by line_item_api.run_job), otherwise loaded from googleads_path per run
+    googleads_path: str = 'googleads.yaml'
+    lease_backend: LeaseBackend = None # leases of write runs per network and format, see locking.py (None = no leases)
+    lease_wait: float = 0 # seconds to wait for a lease held by another run, 0 fails fast
+    lease_ttl: float = LEASE_TTL
+    session: GamSession = None # name to id memo of the run, see session.py
+    concurrency: int = 1 # concurrent requests to google admanager, see bucket_async.AsyncBuckets
+    prefix_scan: bool = False # existence checks from one scan of the managed entities, see dfp_api.index_managed_entities
+    payload_archive: str = None # gzip json lines file of the create payloads, see payload_sink.py (None = no archive)
+    payload_max_mib: int = 100
+    payload_sample_rate: float = 1.0
 
     def __init__(self, args):
         
         self.format = args['format'] # format name (e.g. wallpaper, fireplace)
         self.line_item_type = args['line_item_type'] # line item type, set line item priority seperately via --line_item_priority
-        self.line_item_priority = args['line_item_priority'] # line item priority (0-14)
+        self.line_item_priority = args['line_item_priority'] # line item priority (1-16, see validation_helper.MAX_LINE_ITEM_PRIORITY)
         self.creative_size = args['master_size'] # creative size (e.g. 728x90)
         self.companion_sizes = args['companion_sizes'] # companion sizes (e.g. 120x600, 200x600)
         self.start_time = args['start_time'] # defaults to immediately
@@ -45,6 +76,10 @@ class Buckets():
         self.start_price_bucket = args['start_price_bucket']
         self.end_price_bucket = args['end_price_bucket']
         self.price_bucket_step = args['price_bucket_step']
+        self.price_granularity = args.get('price_granularity') or [] # preset or custom ranges, see price_granularity.py
+        self.price_buckets_per_line_item = args.get('price_buckets_per_line_item') or 1
+        self.line_item_cpm = args.get('line_item_cpm') or 'min'
+        self.max_line_item_price_spread = args.get('max_line_item_price_spread') or 0
         # self.price_bucket_amount: int = 0 # maybe add as optional later (three of the four price bucket options to calculate the other?)
         self.advertiser_id = args['advertiser_id'] 
         self.trafficker_id = args['trafficker_id'] 
@@ -52,6 +87,17 @@ class Buckets():
         self.write = args['write'] # write to dfp
         self.currency = args['currency']
         self.target_ad_units = args['target_ad_units'] # defaults to empty
+        self.transport_settings = TransportSettings.from_args(args) # http pool, timeouts, compression & proxy
+        self.refresh_ad_unit_cache = args.get('refresh_ad_unit_cache', False) # refetch the inventory tree instead of using the local cache
+        self.extend = args.get('extend', False) # see extend_run
+        self.lease_backend = get_lease_backend(args.get('lease_backend') or 'file')
+        self.lease_wait = args.get('lease_wait') or 0
+        self.session = GamSession()
+        self.prefix_scan = args.get('prefix_scan', False)
+        self.googleads_path = args.get('googleads_path') or self.googleads_path
+        self.payload_archive = args.get('payload_archive')
+        self.payload_max_mib = args.get('payload_max_mib') or self.payload_max_mib
+        self.payload_sample_rate = args.get('payload_sample_rate') or self.payload_sample_rate
         
         self.name_prefix = f"{self.prefix}_pb" 
         self.format_key_name = f"{self.prefix}_format" 
@@ -106,57 +152,200 @@ class Buckets():
         Returns:
             list: A list of price buckets.
         """
-        price_buckets = []
-
-        price_bucket_amount:float = (end_price_bucket - start_price_bucket ) / price_bucket_step + 1
+        price_bucket_amount = (end_price_bucket - start_price_bucket) // price_bucket_step + 1
         logging.info(f'Calculated price_bucket amount is: {price_bucket_amount}')
 
-        if price_bucket_amount.is_integer():
-            for x in range(0, int(price_bucket_amount)):
-                price_buckets.append(start_price_bucket + (x * price_bucket_step))
-        else: 
-            logging.warning(f'Price_bucket amount is not an integer, therefore end_price_bucket will be set in disregard of the step_size')
-            for x in range(0, price_bucket_amount.__floor__()):
-                price_buckets.append(start_price_bucket + (x * price_bucket_step))
-            price_buckets.append(end_price_bucket)
+        return generate_price_buckets([(start_price_bucket, end_price_bucket, price_bucket_step)])
+
+
+    def get_line_item_price_buckets(self) -> list[int]:
+        """
+        Creates the line item price buckets for this run, either from the price granularity or from start/end/step.
+        Returns:
+            list: A sorted list of unique price buckets in cents.
+        """
+        if self.price_granularity:
+            price_buckets = generate_price_buckets(self.price_granularity)
+            logging.info(f'Calculated price_bucket amount for granularity {self.price_granularity} is: {len(price_buckets)}')
+            return price_buckets
+        return self.create_line_item_price_buckets(self.start_price_bucket, self.end_price_bucket, self.price_bucket_step)
 
-        return price_buckets
 
+    def group_price_buckets(self, price_buckets: list[int]) -> list[list[int]]:
+        """
+        Groups consecutive price buckets into line items, each line item targets all price-bucket values of its group.
+        A group is closed when it holds price_buckets_per_line_item values or would exceed max_line_item_price_spread.
+        Args:
+            price_buckets (list): A list of price buckets in cents.
+        Returns:
+            list: A list of price-bucket groups, one group per line item.
+        """
+        line_item_groups: list[list[int]] = []
+        group: list[int] = []
+
+        # mapped price buckets can contain the same existing price bucket more than once
+        for pb in sorted(set(price_buckets)):
+            if group and (len(group) >= self.price_buckets_per_line_item or (self.max_line_item_price_spread and pb - group[0] > self.max_line_item_price_spread)):
+                line_item_groups.append(group)
+                group = []
+            group.append(pb)
+        if group:
+            line_item_groups.append(group)
 
-    def create_price_buckets_per_order(self, price_buckets: list) -> list:
+        logging.info(f'{len(price_buckets)} price_buckets will be targeted by {len(line_item_groups)} line items')
+        return line_item_groups
 
-        max_price_buckets_per_order = 400
+    def get_line_item_cpm(self, price_bucket_group: list[int]) -> int:
+        """
+        Returns the representative cpm in cents of a line item targeting the given price-bucket group.
+        """
+        if self.line_item_cpm == 'max':
+            return price_bucket_group[-1]
+        if self.line_item_cpm == 'mid':
+            return (price_bucket_group[0] + price_bucket_group[-1]) // 2
+        return price_bucket_group[0]
+
+    def get_line_item_name(self, price_bucket_group: list[int]) -> str:
+        # stroeer_ssp_wallpaper_5.0 for single price buckets, stroeer_ssp_wallpaper_5.0-5.2 for consolidated ones
+        if len(price_bucket_group) == 1:
+            return f'{self.prefix}_{self.format}_{price_bucket_group[0]/100}'
+        return f'{self.prefix}_{self.format}_{price_bucket_group[0]/100}-{price_bucket_group[-1]/100}'
+
+    def get_line_item_price_range(self, line_item_name: str) -> tuple[int, int] | None:
+        """
+        Parses the price range in cents out of a line item name of this format, see get_line_item_name.
+        Returns None for names that don't follow the naming scheme.
+        """
+        line_item_prefix = f'{self.prefix}_{self.format}_'
+        if not line_item_name.startswith(line_item_prefix):
+            return None
+        prices = line_item_name[len(line_item_prefix):].split('-')
+        if len(prices) > 2:
+            return None
+        try:
+            prices = [round(float(price) * 100) for price in prices]
+        except ValueError:
+            return None
+        return prices[0], prices[-1]
+
+    def get_missing_price_buckets(self, price_buckets: list[int], existing_orders: dict[str, dict]) -> list[int]:
+        """
+        Returns the price buckets that no existing line item of the format targets yet.
+        A consolidated line item (e.g. 5.0-5.2) covers every price bucket of its range.
+        Args:
+            price_buckets (list): A list of price buckets in cents.
+            existing_orders (Dict): Existing orders by name, see dfp_api.get_orders_with_line_item_names.
+        Returns:
+            list: A sorted list of the missing price buckets in cents.
+        """
+        line_item_names = [line_item_name for order in existing_orders.values() for line_item_name in order['line_item_names']]
+        price_ranges = sorted(filter(None, map(self.get_line_item_price_range, line_item_names)))
+
+        # merge overlapping ranges, so one bisect per price bucket finds its only candidate range
+        merged_ranges: list[list[int]] = []
+        for start, end in price_ranges:
+            if merged_ranges and start <= merged_ranges[-1][1]:
+                merged_ranges[-1][1] = max(merged_ranges[-1][1], end)
+            else:
+                merged_ranges.append([start, end])
+        range_starts = [start for start, _ in merged_ranges]
+
+        missing_price_buckets = []
+        for pb in sorted(set(price_buckets)):
+            index = bisect.bisect_right(range_starts, pb) - 1
+            if index < 0 or pb > merged_ranges[index][1]:
+                missing_price_buckets.append(pb)
+
+        logging.info(f'{len(line_item_names)} existing line items cover {len(set(price_buckets)) - len(missing_price_buckets)} price buckets, {len(missing_price_buckets)} are missing')
+        return missing_price_buckets
+
+
+    def create_price_buckets_per_order(self, line_item_groups: list[list[int]], max_price_buckets_per_order: int = dfp_api.MAX_LINE_ITEMS_PER_ORDER) -> list[list[list[int]]]:
         
-        order_amount = (price_buckets.__len__() / max_price_buckets_per_order).__ceil__()
+        order_amount = (line_item_groups.__len__() / max_price_buckets_per_order).__ceil__()
 
-        logging.info(f'{price_buckets.__len__()} price_buckets will be created in : {order_amount} orders')
+        logging.info(f'{line_item_groups.__len__()} line items will be created in : {order_amount} orders')
 
-        orders_with_price_buckets = [price_buckets[i:i + max_price_buckets_per_order] for i in range(0, len(price_buckets), max_price_buckets_per_order)]
+        orders_with_price_buckets = [line_item_groups[i:i + max_price_buckets_per_order] for i in range(0, len(line_item_groups), max_price_buckets_per_order)]
 
         return orders_with_price_buckets
 
         
-    def assemble_orders(self, orders_with_price_buckets: list[list[int]]) -> dict[str, list[int]]:
+    def assemble_orders(self, orders_with_price_buckets: list[list[list[int]]]) -> dict[str, list[list[int]]]:
         """
         Assembles the orders with the price buckets.
 
         Args:
-            orders_with_price_buckets (List): A list of orders with price buckets.
+            orders_with_price_buckets (List): A list of orders with their line items' price-bucket groups.
 
         Returns:
-            Dict: A dictionary of orders with price buckets.
+            Dict: A dictionary of orders with price-bucket groups.
         """
 
         orders = {}
         for i, order in enumerate(orders_with_price_buckets):
             # stroeer_ssp_wallpaper_5.0-10.0
-            order_name = f'{self.prefix}_{self.format}_{order[0]/100}-{order[-1]/100}'
+            order_name = f'{self.prefix}_{self.format}_{order[0][0]/100}-{order[-1][-1]/100}'
             orders[order_name] = order
         return orders
 
+    def pack_line_items_into_orders(self, line_item_groups: list[list[int]], existing_orders: dict[str, dict]) -> dict[str, list[list[int]]]:
+        """
+        Packs the line items into orders, existing orders with spare capacity are filled before new orders are created.
+        Line items that already exist stay in their order so their creatives can still be associated.
+        Existing orders are filled in the price order of their line items. Order names keep the price range the order
+        was created with, an order that was filled up later can hold line items outside of the range in its name.
+
+        Args:
+            line_item_groups (List): A list of price-bucket groups, one group per line item.
+            existing_orders (Dict): Existing orders by name, see dfp_api.get_orders_with_line_item_names.
+
+        Returns:
+            Dict: A dictionary of orders with price-bucket groups.
+        """
+        max_price_buckets_per_order = dfp_api.MAX_LINE_ITEMS_PER_ORDER
+
+        existing_line_items = {line_item_name: order_name for order_name, order in existing_orders.items() for line_item_name in order['line_item_names']}
+
+        def order_price(order_name: str) -> tuple:
+            # lowest price of the order's line items, orders without line items of the format come last
+            price_ranges = list(filter(None, map(self.get_line_item_price_range, existing_orders[order_name]['line_item_names'])))
+            return (min(price_ranges)[0] if price_ranges else float('inf'), order_name)
+
+        orders: dict[str, list[list[int]]] = {order_name: [] for order_name in sorted(existing_orders, key=order_price)}
+
+        new_line_item_groups = []
+        for price_bucket_group in line_item_groups:
+            order_name = existing_line_items.get(self.get_line_item_name(price_bucket_group))
+            if order_name:
+                orders[order_name].append(price_bucket_group)
+            else:
+                new_line_item_groups.append(price_bucket_group)
+
+        # fill spare capacity of existing orders in price order
+        for order_name in orders:
+            spare_capacity = max_price_buckets_per_order - len(existing_orders[order_name]['line_item_names'])
+            if spare_capacity > 0 and new_line_item_groups:
+                orders[order_name].extend(new_line_item_groups[:spare_capacity])
+                new_line_item_groups = new_line_item_groups[spare_capacity:]
+
+        filled_orders = {order_name: groups for order_name, groups in orders.items() if groups}
+        logging.info(f'{len(line_item_groups) - len(new_line_item_groups)} line items will be placed in {len(filled_orders)} existing orders')
+
+        for order_name, groups in self.assemble_orders(self.create_price_buckets_per_order(new_line_item_groups, max_price_buckets_per_order)).items():
+            # a full existing order can have the same price range as a new one
+            unique_order_name = order_name
+            suffix = 2
+            while unique_order_name in existing_orders or unique_order_name in filled_orders:
+                unique_order_name = f'{order_name}_{suffix}'
+                suffix += 1
+            filled_orders[unique_order_name] = groups
+
+        return filled_orders
 
 
-    def assemble_line_item_jsons(self, orders: dict[str, list[int]], pb_key_id: int, pb_value_ids: list[dict], format_key_id: int, format_value_ids: list[dict], orders_dict: dict = {}) -> list[dict]:
+
+    def assemble_line_item_jsons(self, orders: dict[str, list[list[int]]], pb_key_id: int, pb_value_ids: list[dict], format_key_id: int, format_value_ids: list[dict], orders_dict: dict = {}) -> list[dict]:
         li_jsons = []
         
         endDateObj = self.define_end_date()
@@ -182,6 +371,9 @@ class Buckets():
         ]
                
         format_value_id = next((item for item in format_value_ids if item["name"] == self.format), dict())
+
+        # price-bucket value ids by cents, names are e.g. "5.00" (need to round because of float inaccuracy)
+        pb_value_ids_by_cents = {round(float(item["name"])*100): item['id'] for item in pb_value_ids}
         
         primaryGoal = self.create_goal_type_object()
         
@@ -191,16 +383,14 @@ class Buckets():
             orderId = orders_dict[order] if orders_dict.__len__() > 0 else 0
             # orderId = dfp_api.get_orders_by_names(self.dfp_client, [order])[0]['id']
             logging.info(f'orderId: {orderId}')
-            for lineitem in values:
-                # print(f'line item pb {lineitem}')
+            for price_bucket_group in values:
+                # print(f'line item pb {price_bucket_group}')
                 
                 costPerUnit = {
                     'currencyCode': self.currency,
-                    'microAmount': lineitem * 10000 # lineitems are in cents, so multiply by 10000 to get to microAmount
+                    'microAmount': self.get_line_item_cpm(price_bucket_group) * 10000 # lineitems are in cents, so multiply by 10000 to get to microAmount
                 }
 
-                pb_value_id = next((item for item in pb_value_ids if round(float(item["name"])*100) == lineitem), dict())
-
                 targeting = {
                     'inventoryTargeting': {
                         'targetedAdUnits': [{'adUnitId': adunitId} for adunitId in self.target_ad_units]
@@ -211,7 +401,7 @@ class Buckets():
                             {
                                 'xsi_type': 'CustomCriteria',
                                 'keyId': pb_key_id,
-                                'valueIds': [pb_value_id['id']],
+                                'valueIds': [pb_value_ids_by_cents[pb] for pb in price_bucket_group],
                                 'operator': 'IS'
                             },
                             {
@@ -226,7 +416,7 @@ class Buckets():
                                                             
                 li_json = {
                     'orderId': orderId, 
-                    'name': f'{self.prefix}_{self.format}_{lineitem/100}', 
+                    'name': self.get_line_item_name(price_bucket_group), 
                     'startDateTime': self.start_time,
                     'startDateTimeType': startDateTimeType,
                     'endDateTime': endDateObj['endDateTime'],
@@ -258,7 +448,10 @@ class Buckets():
 
     # map calculated price buckets to publisher's price-bucket key-values
     def map_line_items_to_existing_price_buckets(self, line_item_price_buckets: list[int], price_bucket_key):
-        existing_pricebucket_obj = dfp_api.get_all_key_values(self.dfp_client, self.price_bucket_key_value_name)
+        existing_pricebucket_obj = dfp_api.get_all_key_values(self.dfp_client, self.price_bucket_key_value_name, fields=ID_NAME)
+        return self.map_price_buckets_to_existing_values(line_item_price_buckets, existing_pricebucket_obj)
+
+    def map_price_buckets_to_existing_values(self, line_item_price_buckets: list[int], existing_pricebucket_obj: list) -> list[int]:
         # get name, cast to int and then to cent units (need to round because of float inaccuracy)
         existing_pricebucket: list[int] = [round(float(x['name'])*100) for x in existing_pricebucket_obj]
         existing_pricebucket.sort()
@@ -268,14 +461,15 @@ class Buckets():
         
         used_price_buckets: list[int] = []
         
+        existing_pricebucket_set = set(existing_pricebucket)
+
         # add matching price-buckets and use next-higher value
         for pb in line_item_price_buckets:
-            if pb not in existing_pricebucket:
-                for expb in existing_pricebucket:
-                    if pb < expb:
-                        used_price_buckets.append(expb)
-                        mapping_necessary = True
-                        break                
+            if pb not in existing_pricebucket_set:
+                next_higher_index = bisect.bisect_right(existing_pricebucket, pb)
+                if next_higher_index < len(existing_pricebucket):
+                    used_price_buckets.append(existing_pricebucket[next_higher_index])
+                    mapping_necessary = True
             else: 
                 used_price_buckets.append(pb)
         
@@ -307,7 +501,8 @@ class Buckets():
             }
     
     def define_end_date(self): 
-        if self.end_time == 'unlimited' and self.line_item_type in [LineItemTypes.SPONSORSHIP.value, LineItemTypes.NETWORK.value, LineItemTypes.PRICE_PRIORITY.value, LineItemTypes.HOUSE.value]:
+        # validate_line_item_type converts the type to underscores (price_priority)
+        if self.end_time == 'unlimited' and self.line_item_type.replace('_', '-') in [LineItemTypes.SPONSORSHIP.value, LineItemTypes.NETWORK.value, LineItemTypes.PRICE_PRIORITY.value, LineItemTypes.HOUSE.value]:
             return {
                 'endDateTime': 'unlimited',
                 'unlimitedEndDateTime': True
@@ -324,6 +519,46 @@ class Buckets():
             'unlimitedEndDateTime': False
         }
         
+    def get_dfp_client(self):
+        if self.dfp_client is None:
+            self.dfp_client = dfp_api.get_dfp_client_for_account(self.googleads_path, self.transport_settings)
+        return self.dfp_client
+
+    def lease(self, scope: str, wait: float = None):
+        """
+        Lease on `<network code>_<scope>`, e.g. the format for a write run (see locking.py). A no-op without lease backend.
+        """
+        if self.lease_backend is None:
+            return nullcontext()
+        return Lease(self.lease_backend, f'{self.dfp_id}_{scope}', self.lease_ttl, self.lease_wait if wait is None else wait)
+
+    def key_values_lease(self):
+        """
+        Lease on the key-values of the network, which all formats share. It's only held around the calls that check
+        and create keys and values, so runs of other formats wait for it briefly.
+        """
+        return self.lease('key_values', wait=max(self.lease_wait, SHARED_LEASE_WAIT))
+
+    def payload_sink(self):
+        """
+        Archive of the payloads of the run (see payload_sink.py). A no-op without payload_archive.
+        """
+        if not self.payload_archive:
+            return nullcontext()
+        return PayloadSink(self.payload_archive, self.payload_max_mib * 1024 * 1024, self.payload_sample_rate).activate()
+
+    def resolve_target_ad_units(self) -> list[str]:
+        """
+        Resolves the target ad units (ids, paths or names) with the cached ad unit index of the network.
+        Returns:
+            list: The target ad unit ids, the root ad unit (run of network) if no target ad units are given.
+        """
+        ad_unit_index = AdUnitIndex.load(self.dfp_client, refresh=self.refresh_ad_unit_cache)
+        if not self.target_ad_units:
+            # set root-adunit as target adunit if no target adunit is given
+            return [ad_unit_index.root_ad_unit_id or dfp_api.get_root_adunit_id(self.dfp_client)]
+        return ad_unit_index.resolve(self.target_ad_units)
+
     def assemble_size_list(self, size: list[int]) -> list[int]: 
         return [size[0], size[1]]
         
@@ -352,37 +587,97 @@ class Buckets():
             'companionCreativeIds': companion_master_creative_ids
         }
     
+    def plan_run(self) -> dict:
+        """
+        Plans the entities of a run offline for the preflight, see preflight.py. Existing orders and key-values are
+        unknown, so the plan holds the complete setup. Ids and target ad units are placeholders of the same size,
+        price buckets are not mapped to the values of a publisher's price-bucket key.
+        Returns:
+            dict: price-bucket groups by order name ('orders'), line item jsons ('line_items'), value names by key name
+                of the values to be created ('key_values'), creative names ('creatives') and the creative set name.
+        """
+        line_item_price_buckets = self.get_line_item_price_buckets()
+        orders = self.pack_line_items_into_orders(self.group_price_buckets(line_item_price_buckets), {})
+
+        pb_values = [{'name': '{:.2f}'.format(pb / 100), 'id': preflight.PLACEHOLDER_ID} for pb in line_item_price_buckets]
+        format_values = [{'name': format, 'id': preflight.PLACEHOLDER_ID} for format in self.format_key_values]
+        target_ad_units = self.target_ad_units
+        self.target_ad_units = [str(preflight.PLACEHOLDER_ID)] * max(1, len(target_ad_units or []))
+        try:
+            line_items = self.assemble_line_item_jsons(orders, preflight.PLACEHOLDER_ID, pb_values, preflight.PLACEHOLDER_ID, format_values, {order_name: preflight.PLACEHOLDER_ID for order_name in orders})
+        finally:
+            self.target_ad_units = target_ad_units
+
+        key_values = {self.format_key_name: list(self.format_key_values)}
+        if self.price_bucket_key_value_name == 'stroeer_ssp_hb_pb':
+            key_values[self.price_bucket_key_value_name] = [value['name'] for value in pb_values]
+        return {
+            'orders': orders,
+            'line_items': line_items,
+            'key_values': key_values,
+            'creatives': [self.master_creative_name] + [f'{self.companion_creative_name}_{index}' for index in range(len(self.companion_sizes))],
+            'creative_set': f'{self.prefix}_{self.format}_creative_set',
+        }
+
+    def preflight_run(self, network_limits_path: str = None) -> dict:
+        """
+        Checks the plan of the run against the limits of google admanager networks and estimates its api calls,
+        bytes and wall time, without any calls to google admanager (see preflight.py).
+        Args:
+            network_limits_path (str): json file with overrides of preflight.NETWORK_LIMITS and CALL_SECONDS.
+        Returns:
+            dict: see preflight.run_preflight, the run fails in google admanager if 'violations' isn't empty.
+        """
+        limits, call_seconds = preflight.load_network_limits(network_limits_path) if network_limits_path else (preflight.NETWORK_LIMITS, preflight.CALL_SECONDS)
+        with profile_stage(self.profiler, 'preflight'):
+            report = preflight.run_preflight(self.plan_run(), self.concurrency, self.transport_settings.max_request_bytes, self.transport_settings.max_batch_items, limits, call_seconds)
+        preflight.log_report(report)
+        return report
+
+    def rejection_report(self) -> dict:
+        """
+        Reports the line items and LICAs that google admanager rejected in a write run with --isolate-failures, the
+        rest of the run was created. A rerun after fixing them only creates what's missing.
+        Returns:
+            dict: {'rejected': {operation: [{'item': line item name or id, 'errors': [{'fieldPath', 'error', 'trigger'}]}]}}
+        """
+        for operation, rejected_items in self.session.rejected.items():
+            logging.error(f"{len(rejected_items)} items of {operation} were rejected: {', '.join(rejected_item['item'] for rejected_item in rejected_items)}")
+        return {'rejected': self.session.rejected}
+
 # ----------- dry run to test parameters, will make calls to dfp but only getters, no writing done here -----------    
     
     def dry_run(self):
         
         # check that network name is valid
-        self.dfp_client = dfp_api.get_dfp_client_for_account('googleads.yaml')
+        self.get_dfp_client()
         print(f'dfp_client from admanager: {self.dfp_client.network_code}')
         
-        line_item_price_buckets = self.create_line_item_price_buckets(self.start_price_bucket, self.end_price_bucket, self.price_bucket_step)
-        
-        # just info on price-bucket usage & line-item-mapping if necessary
-        if self.price_bucket_key_value_name == 'stroeer_ssp_hb_pb':
-           logging.info('No custom key-value for price-buckets set, will create new key-value "stroeer_ssp_hb_pb"')
-        else:
-            # check here if passed key-value for price bucket exists and print error if not, we only want to create ssp
-            key_id = dfp_api.check_bucket_key(self.dfp_client, self.price_bucket_key_value_name)
-            self.map_line_items_to_existing_price_buckets(line_item_price_buckets, key_id)
+        with profile_stage(self.profiler, 'bucket_generation'):
+            line_item_price_buckets = self.get_line_item_price_buckets()
+            
+            # just info on price-bucket usage & line-item-mapping if necessary
+            if self.price_bucket_key_value_name == 'stroeer_ssp_hb_pb':
+               logging.info('No custom key-value for price-buckets set, will create new key-value "stroeer_ssp_hb_pb"')
+            else:
+                # check here if passed key-value for price bucket exists and print error if not, we only want to create ssp
+                key_id = dfp_api.check_bucket_key(self.dfp_client, self.price_bucket_key_value_name)
+                self.map_line_items_to_existing_price_buckets(line_item_price_buckets, key_id)
 
-        # use potentially mapped price-buckets to create orders        
-        orders_with_buckets_list = self.create_price_buckets_per_order(line_item_price_buckets)
-        orders = self.assemble_orders(orders_with_buckets_list) 
+            existing_orders = dfp_api.get_orders_with_line_item_names(self.dfp_client, f'{self.prefix}_{self.format}_')
+            if self.extend:
+                # show only the extension of the existing ladder, see extend_run
+                line_item_price_buckets = self.get_missing_price_buckets(line_item_price_buckets, existing_orders)
 
-        print(f'Orders with buckets: {orders}')
+            # use potentially mapped price-buckets to create line items and orders
+            line_item_groups = self.group_price_buckets(line_item_price_buckets)
+            orders = self.pack_line_items_into_orders(line_item_groups, existing_orders)
 
-        # check that given ad_units are valid
-        if not self.target_ad_units:
-            # try to get root_adunit_id (hopefully this represents run of network, but I don't know)
-            self.target_ad_units = [dfp_api.get_root_adunit_id(self.dfp_client)]
-        else:
-            # validate target adunits; exits if invalid adunit is passed
-            dfp_api.validate_adunits(self.dfp_client, self.target_ad_units)
+        print(f'Orders with buckets: {len(orders)} orders with {sum(len(groups) for groups in orders.values())} line items ({list(orders)})')
+
+        with profile_stage(self.profiler, 'targeting_setup'):
+            # resolve ad unit ids, paths & names to ids; exits if invalid adunit is passed
+            self.target_ad_units = self.resolve_target_ad_units()
 
         print(f'Adunits to be targetted: {self.target_ad_units}')
 
@@ -391,71 +686,362 @@ class Buckets():
         format_key_id = 0
         format_values = [{'name': format, 'id': 0} for format in self.format_key_values]
 
-        # assemble line-item json with a fake order
-        li_json = self.assemble_line_item_jsons(orders, pb_key_id, pb_values, format_key_id, format_values, orders_dict={}) 
+        with profile_stage(self.profiler, 'line_item_assembly'):
+            # assemble line-item json with a fake order
+            li_json = self.assemble_line_item_jsons(orders, pb_key_id, pb_values, format_key_id, format_values, orders_dict={}) 
         
-        logging.info(f'expected line items with pb-, format- and order-ids as 0: {li_json}')
+        logging.info(f'{len(li_json)} expected line items with pb-, format- and order-ids as 0')
+        archive('expectedLineItems', li_json)
 
 # ----------- as the name says, actual run, will create order, line-items & potentially price-buckets in dfp -----------
 
     def actual_run(self):
         
-        self.dfp_client = dfp_api.get_dfp_client_for_account('googleads.yaml')
+        self.get_dfp_client()
         print(f'dfp_client from admanager: {self.dfp_client}')
 
-        line_item_price_buckets = self.create_line_item_price_buckets(self.start_price_bucket, self.end_price_bucket, self.price_bucket_step)
-        pb_key_id = None
+        with profile_stage(self.profiler, 'bucket_generation'):
+            line_item_price_buckets = self.get_line_item_price_buckets()
+            pb_key_id = None
+            pb_values = None
         
-        # check if given key for price-buckets exist, if so, use it, else check if key defaulted to stroeer_ssp_hb_pb, then create, else error
-        if self.price_bucket_key_value_name == 'stroeer_ssp_hb_pb':
-            logging.info('No custom key-value for price-buckets set, will create new key-value "stroeer_ssp_hb_pb"')
-            # create key for ssp price bucket
-            pb_key_id = dfp_api.get_bucket_key(self.dfp_client, self.price_bucket_key_value_name, 'PREDEFINED')
-            # create the price bucket key-values if no publisher key-value is given
-            self.create_price_bucket_key_values(line_item_price_buckets, pb_key_id) # don't write result into line_item_price_buckets
-        else:
-            # try to find given key, throws error and exits if key not found
-            pb_key_id = dfp_api.check_bucket_key(self.dfp_client, self.price_bucket_key_value_name)
-            # map calculated price buckets to publisher's price-bucket key-values
-            line_item_price_buckets = self.map_line_items_to_existing_price_buckets(line_item_price_buckets, pb_key_id)
+            # check if given key for price-buckets exist, if so, use it, else check if key defaulted to stroeer_ssp_hb_pb, then create, else error
+            if self.price_bucket_key_value_name == 'stroeer_ssp_hb_pb':
+                logging.info('No custom key-value for price-buckets set, will create new key-value "stroeer_ssp_hb_pb"')
+                with self.key_values_lease():
+                    # create key for ssp price bucket
+                    pb_key_id = dfp_api.get_bucket_key(self.dfp_client, self.price_bucket_key_value_name, 'PREDEFINED')
+                    # create the price bucket key-values if no publisher key-value is given
+                    pb_values = self.create_price_bucket_key_values(line_item_price_buckets, pb_key_id) # don't write result into line_item_price_buckets
+            else:
+                # try to find given key, throws error and exits if key not found
+                pb_key_id = dfp_api.check_bucket_key(self.dfp_client, self.price_bucket_key_value_name)
+                # map calculated price buckets to publisher's price-bucket key-values
+                line_item_price_buckets = self.map_line_items_to_existing_price_buckets(line_item_price_buckets, pb_key_id)
 
-        # use potentially mapped price-buckets to create orders
-        orders_with_buckets_list = self.create_price_buckets_per_order(line_item_price_buckets)
-        orders = self.assemble_orders(orders_with_buckets_list) 
+            # use potentially mapped price-buckets to create line items and orders
+            line_item_groups = self.group_price_buckets(line_item_price_buckets)
+            existing_orders = dfp_api.get_orders_with_line_item_names(self.dfp_client, f'{self.prefix}_{self.format}_')
+            orders = self.pack_line_items_into_orders(line_item_groups, existing_orders)
+            # with --prefix-scan the existence checks of the run use one index of the managed entities
+            dfp_api.index_managed_entities(self.dfp_client, f'{self.prefix}_{self.format}_')
 
-        if not self.target_ad_units:
-            # set root-adunit as target adunit if no target adunit is given
-            # TODO: find out if this is actually run of network (after fixing it oops) & if it's necesary in the first place
-            self.target_ad_units = [dfp_api.get_root_adunit_id(self.dfp_client)]
-        else:
-            # validate target adunits; exits if invalid adunit is passed
-            dfp_api.validate_adunits(self.dfp_client, self.target_ad_units)
+        with profile_stage(self.profiler, 'targeting_setup'):
+            # resolve ad unit ids, paths & names to ids; exits if invalid adunit is passed
+            self.target_ad_units = self.resolve_target_ad_units()
 
-        print(f'Adunits to be targetted: {self.target_ad_units}')
+            print(f'Adunits to be targetted: {self.target_ad_units}')
 
-        # this should be the order-obj that actually comes back from gam?
-        orders_dict = dfp_api.create_orders_buckets(self.dfp_client, list(orders.keys()), str(self.trafficker_id), str(self.advertiser_id))
-        print(f'Orders dict: {orders_dict}')
+            with self.key_values_lease():
+                if pb_values is None:
+                    pb_values = dfp_api.create_hb_key_values(self.dfp_client, line_item_price_buckets, pb_key_id, self.price_bucket_key_value_name, return_all=False)
+                format_key_id = dfp_api.get_bucket_key(self.dfp_client, self.format_key_name, 'PREDEFINED') # create format key
+                format_values = dfp_api.create_targeting_key_values(self.dfp_client, format_key_id, self.format_key_name, self.format_key_values) # add format values to format key
 
-        pb_values = dfp_api.create_hb_key_values(self.dfp_client, line_item_price_buckets, pb_key_id, self.price_bucket_key_value_name, return_all=False)
-        format_key_id = dfp_api.get_bucket_key(self.dfp_client, self.format_key_name, 'PREDEFINED') # create format key
-        format_values = dfp_api.create_targeting_key_values(self.dfp_client, format_key_id, self.format_key_name, self.format_key_values) # add format values to format key
-        
-        # assemble line-item json
-        li_json = self.assemble_line_item_jsons(orders, pb_key_id, pb_values, format_key_id, format_values, orders_dict) 
+        with profile_stage(self.profiler, 'creation'):
+            # this should be the order-obj that actually comes back from gam?
+            orders_dict = dfp_api.create_orders_buckets(self.dfp_client, list(orders.keys()), str(self.trafficker_id), str(self.advertiser_id))
+            print(f'Order ids: {list(orders_dict.values())}')
+
+        with profile_stage(self.profiler, 'line_item_assembly'):
+            # assemble line-item json
+            li_json = self.assemble_line_item_jsons(orders, pb_key_id, pb_values, format_key_id, format_values, orders_dict) 
         
-        # create line items in gam - I don't understand what type the line-item parameter should be
-        line_items = dfp_api.create_line_item_bulk(self.dfp_client, li_json) 
+        with profile_stage(self.profiler, 'creation'):
+            # create line items in gam - I don't understand what type the line-item parameter should be
+            line_items = dfp_api.create_line_item_bulk(self.dfp_client, li_json) 
 
-        # save ids of the line items
-        li_ids = [li['id'] for li in line_items]
+            # save ids of the line items
+            li_ids = [li['id'] for li in line_items]
         
         logging.info(f'Line item ids after creation: {li_ids}')
         
-        creative_dict = self.create_creative_set()
-        
-        logging.info(f'creative_dict: {creative_dict}')
-        
-        dfp_api.create_licas_buckets_creative_set(self.dfp_client, creative_dict['creativeSetId'], creative_dict['masterCreativeId'], li_ids) 
+        with profile_stage(self.profiler, 'licas'):
+            creative_dict = self.create_creative_set()
+            
+            logging.info(f'creative_dict: {creative_dict}')
+            
+            dfp_api.create_licas_buckets_creative_set(self.dfp_client, creative_dict['creativeSetId'], creative_dict['masterCreativeId'], li_ids) 
         
         logging.info('WE RAN THROUGH THE WHOLE CODE WITHOUT ERRORS!!!')
+
+# ----------- extend run, only creates what the existing ladder of the format is missing -----------
+
+    def extend_run(self):
+        """
+        Adds the missing price buckets to the existing ladder of the format, e.g. 10.25-20.00 to an existing 5.00-10.00.
+        Only the line item names of the existing orders are read, key-values, line items and LICAs are looked up and
+        created for the missing price buckets only, so the cost scales with the extension instead of the whole ladder.
+        """
+
+        self.get_dfp_client()
+        print(f'dfp_client from admanager: {self.dfp_client}')
+
+        with profile_stage(self.profiler, 'bucket_generation'):
+            line_item_price_buckets = self.get_line_item_price_buckets()
+
+            if self.price_bucket_key_value_name == 'stroeer_ssp_hb_pb':
+                with self.key_values_lease():
+                    pb_key_id = dfp_api.get_bucket_key(self.dfp_client, self.price_bucket_key_value_name, 'PREDEFINED')
+            else:
+                # try to find given key, throws error and exits if key not found
+                pb_key_id = dfp_api.check_bucket_key(self.dfp_client, self.price_bucket_key_value_name)
+                # map calculated price buckets to publisher's price-bucket key-values
+                line_item_price_buckets = self.map_line_items_to_existing_price_buckets(line_item_price_buckets, pb_key_id)
+
+            existing_orders = dfp_api.get_orders_with_line_item_names(self.dfp_client, f'{self.prefix}_{self.format}_')
+            missing_price_buckets = self.get_missing_price_buckets(line_item_price_buckets, existing_orders)
+            if not missing_price_buckets:
+                logging.info('The existing ladder already covers all price buckets, nothing to extend')
+                return
+            dfp_api.index_managed_entities(self.dfp_client, f'{self.prefix}_{self.format}_')
+
+            line_item_groups = self.group_price_buckets(missing_price_buckets)
+            orders = self.pack_line_items_into_orders(line_item_groups, existing_orders)
+
+        with profile_stage(self.profiler, 'targeting_setup'):
+            # resolve ad unit ids, paths & names to ids; exits if invalid adunit is passed
+            self.target_ad_units = self.resolve_target_ad_units()
+
+            print(f'Adunits to be targetted: {self.target_ad_units}')
+
+            with self.key_values_lease():
+                pb_values = dfp_api.create_missing_key_values(self.dfp_client, pb_key_id, self.price_bucket_key_value_name, missing_price_buckets)
+                format_key_id = dfp_api.get_bucket_key(self.dfp_client, self.format_key_name, 'PREDEFINED') # create format key
+                format_values = dfp_api.create_targeting_key_values(self.dfp_client, format_key_id, self.format_key_name, self.format_key_values) # add format values to format key
+
+        with profile_stage(self.profiler, 'creation'):
+            # existing orders are already known, only new orders are created
+            orders_dict = {order_name: existing_orders[order_name]['id'] for order_name in orders if order_name in existing_orders}
+            orders_dict.update(dfp_api.create_orders_buckets(self.dfp_client, [order_name for order_name in orders if order_name not in existing_orders], str(self.trafficker_id), str(self.advertiser_id)))
+            print(f'Order ids: {list(orders_dict.values())}')
+
+        with profile_stage(self.profiler, 'line_item_assembly'):
+            li_json = self.assemble_line_item_jsons(orders, pb_key_id, pb_values, format_key_id, format_values, orders_dict)
+
+        with profile_stage(self.profiler, 'creation'):
+            line_items = dfp_api.create_line_item_bulk(self.dfp_client, li_json)
+            li_ids = [li['id'] for li in line_items]
+
+        logging.info(f'Line item ids after extension: {li_ids}')
+
+        with profile_stage(self.profiler, 'licas'):
+            creative_dict = self.create_creative_set()
+            dfp_api.create_licas_buckets_creative_set(self.dfp_client, creative_dict['creativeSetId'], creative_dict['masterCreativeId'], li_ids)
+
+        logging.info(f'Extended the {self.format} ladder by {len(missing_price_buckets)} price buckets in {len(li_ids)} line items')
+
+# ----------- verify run, compares the managed line items in google admanager with this setup, read only -----------
+
+    def verify_run(self, use_manifest: bool = True) -> dict:
+        """
+        Compares the managed line items of the format with the line items this setup would create, by content hashes
+        of their type, priority, cost, dates, sizes and targeting (see verify.py).
+        Orders that matched at the last verification are skipped if their desired line items are unchanged and none
+        of their line items was modified since, see VerifyManifest.
+        Args:
+            use_manifest (bool): False verifies every order.
+        Returns:
+            dict: missing and extra line item names, drifted line items with their differing fields, skipped orders.
+        """
+
+        self.get_dfp_client()
+
+        with profile_stage(self.profiler, 'bucket_generation'):
+            line_item_price_buckets = self.get_line_item_price_buckets()
+            # exits if the keys don't exist, then nothing of the setup exists
+            pb_key_id = dfp_api.check_bucket_key(self.dfp_client, self.price_bucket_key_value_name)
+            if self.price_bucket_key_value_name != 'stroeer_ssp_hb_pb':
+                line_item_price_buckets = self.map_line_items_to_existing_price_buckets(line_item_price_buckets, pb_key_id)
+
+            existing_orders = dfp_api.get_orders_with_line_item_names(self.dfp_client, f'{self.prefix}_{self.format}_')
+            line_item_groups = self.group_price_buckets(line_item_price_buckets)
+            orders = self.pack_line_items_into_orders(line_item_groups, existing_orders)
+
+        with profile_stage(self.profiler, 'targeting_setup'):
+            self.target_ad_units = self.resolve_target_ad_units()
+
+            pb_value_names = list(dict.fromkeys("{:.2f}".format(pb / 100) for pb in line_item_price_buckets))
+            pb_values = dfp_api.get_key_values_by_names(self.dfp_client, pb_key_id, pb_value_names, fields=ID_NAME)
+            # price buckets without a value get id 0, their line items show up as missing or drifted
+            existing_pb_value_names = {value['name'] for value in pb_values}
+            pb_values += [{'name': name, 'id': 0} for name in pb_value_names if name not in existing_pb_value_names]
+            format_key_id = dfp_api.check_bucket_key(self.dfp_client, self.format_key_name)
+            format_values = dfp_api.get_key_values_by_names(self.dfp_client, format_key_id, self.format_key_values, fields=ID_NAME)
+
+        with profile_stage(self.profiler, 'line_item_assembly'):
+            orders_dict = {order_name: existing_orders.get(order_name, {}).get('id', 0) for order_name in orders}
+            li_json = self.assemble_line_item_jsons(orders, pb_key_id, pb_values, format_key_id, format_values, orders_dict)
+
+            compare_start_date = self.start_time not in ['immediately', 'one_hour_from_now']
+            compare_end_date = self.end_time != 'unlimited'
+            desired = {li['name']: canonical_line_item(li, compare_start_date, compare_end_date) for li in li_json}
+            desired_hashes = {order_name: {self.get_line_item_name(group): content_hash(desired[self.get_line_item_name(group)]) for group in groups} for order_name, groups in orders.items()}
+
+        with profile_stage(self.profiler, 'verification'):
+            manifest = VerifyManifest.load(self.dfp_client.network_code, self.format)
+            skipped_orders = []
+            if use_manifest:
+                candidates = [order_name for order_name in orders if order_name in existing_orders and manifest.is_unchanged(order_name, chunk_hash(desired_hashes[order_name])) and manifest.orders[order_name]['id'] == existing_orders[order_name]['id']]
+                if candidates:
+                    modified_order_ids = dfp_api.get_modified_order_ids(self.dfp_client, [existing_orders[order_name]['id'] for order_name in candidates], manifest.modified_since(candidates))
+                    skipped_orders = [order_name for order_name in candidates if existing_orders[order_name]['id'] not in modified_order_ids]
+            logging.info(f'{len(skipped_orders)} orders are unchanged since the last verification and skipped')
+
+            verified_at = time.time()
+            checked_orders = [order_name for order_name in existing_orders if order_name not in skipped_orders]
+            order_names_by_id = {existing_orders[order_name]['id']: order_name for order_name in checked_orders}
+            actual = {li['name']: li for li in dfp_api.get_line_items_by_order_ids(self.dfp_client, list(order_names_by_id))}
+
+            report = {'missing': [], 'extra': [], 'drifted': {}, 'skipped_orders': skipped_orders}
+            drifted_orders = set()
+            for order_name, line_item_hashes in desired_hashes.items():
+                if order_name in skipped_orders:
+                    continue
+                for line_item_name in line_item_hashes:
+                    if line_item_name not in actual:
+                        report['missing'].append(line_item_name)
+                        drifted_orders.add(order_name)
+                        continue
+                    drifted_fields = diff_fields(desired[line_item_name], canonical_line_item(actual[line_item_name], compare_start_date, compare_end_date))
+                    if drifted_fields:
+                        report['drifted'][line_item_name] = drifted_fields
+                        drifted_orders.add(order_name)
+            for line_item_name, line_item in actual.items():
+                if line_item_name not in desired:
+                    report['extra'].append(line_item_name)
+                    drifted_orders.add(order_names_by_id[line_item['orderId']])
+
+            for order_name in checked_orders:
+                if order_name in orders and order_name not in drifted_orders:
+                    manifest.record(order_name, existing_orders[order_name]['id'], chunk_hash(desired_hashes[order_name]), verified_at)
+                else:
+                    manifest.forget(order_name)
+            manifest.save()
+
+        for line_item_name in report['missing']:
+            logging.warning(f'Missing line item: {line_item_name}')
+        for line_item_name, drifted_fields in report['drifted'].items():
+            logging.warning(f'Drifted line item: {line_item_name} ({", ".join(drifted_fields)})')
+        for line_item_name in report['extra']:
+            logging.warning(f'Extra line item: {line_item_name}')
+        report['clean'] = not (report['missing'] or report['drifted'] or report['extra'])
+        logging.info(f"Verified {len(desired)} line items in {len(checked_orders)} orders ({len(skipped_orders)} skipped): {len(report['missing'])} missing, {len(report['drifted'])} drifted, {len(report['extra'])} extra")
+        return report
+
+# ----------- prune run, merges and archives low-delivery line items of the ladder by a delivery report -----------
+
+    def get_price_bucket_groups(self, line_item_names: list[str], price_buckets: list[int]) -> dict[str, list[int]]:
+        """
+        Returns the price buckets of the ladder targeted by each line item, from the price range of its name.
+        Line items that don't follow the naming scheme or don't cover any price bucket are left out.
+        """
+        price_buckets = sorted(set(price_buckets))
+        price_bucket_groups = {}
+        for line_item_name in line_item_names:
+            price_range = self.get_line_item_price_range(line_item_name)
+            if price_range is None:
+                continue
+            group = price_buckets[bisect.bisect_left(price_buckets, price_range[0]):bisect.bisect_right(price_buckets, price_range[1])]
+            if group:
+                price_bucket_groups[line_item_name] = group
+        return price_bucket_groups
+
+    def prune_run(self, start_date: datetime.date, end_date: datetime.date, min_impressions: int, max_archived: int = 0) -> dict:
+        """
+        Recommends a coarser ladder from the delivery of the managed line items between start_date and end_date (see
+        delivery.plan_pruning) and applies it with write: the merged line items are created with their LICAs before
+        the line items they replace and the undelivered top of the ladder are archived.
+        Args:
+            start_date (date): first day of the delivery report.
+            end_date (date): last day of the delivery report.
+            min_impressions (int): line items below this amount of impressions are merged or archived.
+            max_archived (int): line items at the undelivered top of the ladder that may be archived, 0 archives none.
+        Returns:
+            dict: merged and archived line item names, line item counts before and after, whether it was applied.
+        """
+
+        self.get_dfp_client()
+
+        with profile_stage(self.profiler, 'bucket_generation'):
+            line_item_price_buckets = self.get_line_item_price_buckets()
+            pb_key_id = dfp_api.check_bucket_key(self.dfp_client, self.price_bucket_key_value_name)
+            if self.price_bucket_key_value_name != 'stroeer_ssp_hb_pb':
+                line_item_price_buckets = self.map_line_items_to_existing_price_buckets(line_item_price_buckets, pb_key_id)
+
+            existing_orders = dfp_api.get_orders_with_line_item_names(self.dfp_client, f'{self.prefix}_{self.format}_')
+            dfp_api.index_managed_entities(self.dfp_client, f'{self.prefix}_{self.format}_')
+            order_ids = [order['id'] for order in existing_orders.values()]
+            line_item_rows = dfp_api.get_line_item_rows_by_order_ids(self.dfp_client, order_ids, ('id', 'name', 'isArchived'))
+            active_line_items = {row['name']: row['id'] for row in line_item_rows if not row['isArchived']}
+            price_bucket_groups = self.get_price_bucket_groups(list(active_line_items), line_item_price_buckets)
+            line_items = sorted(
+                ({'id': active_line_items[name], 'name': name, 'price_buckets': group} for name, group in price_bucket_groups.items()),
+                key=lambda line_item: line_item['price_buckets'][0]
+            )
+
+        report = {'start_date': str(start_date), 'end_date': str(end_date), 'merged': {}, 'archived': [], 'line_items_before': len(line_items), 'line_items_after': len(line_items), 'applied': False}
+        if not line_items:
+            logging.warning(f'No active line items of the {self.format} ladder found, nothing to prune')
+            return report
+
+        with profile_stage(self.profiler, 'delivery_report'):
+            report_job_id = delivery.run_delivery_report(self.dfp_client, order_ids, start_date, end_date)
+            delivery_by_id = delivery.read_delivery(delivery.stream_report_rows(self.dfp_client, report_job_id))
+            for line_item in line_items:
+                line_item['impressions'] = delivery_by_id.get(line_item['id'], {}).get('impressions', 0)
+
+            plan = delivery.plan_pruning(line_items, min_impressions, self.max_line_item_price_spread, max_archived=max_archived)
+            # an existing (e.g. archived) line item with the merged name would be reused instead of created
+            existing_line_item_names = {row['name'] for row in line_item_rows}
+            for merged in list(plan['merge']):
+                merged_name = self.get_line_item_name(merged['price_buckets'])
+                if merged_name in existing_line_item_names:
+                    logging.warning(f'A line item named {merged_name} already exists, its price buckets are not merged')
+                    plan['merge'].remove(merged)
+                    continue
+                report['merged'][merged_name] = [line_item['name'] for line_item in merged['replaces']]
+            report['archived'] = [line_item['name'] for line_item in plan['archive']]
+            report['line_items_after'] = len(line_items) - len(plan['archive']) - sum(len(merged['replaces']) - 1 for merged in plan['merge'])
+
+        for merged_name, replaced_names in report['merged'].items():
+            logging.info(f'Merge {", ".join(replaced_names)} into {merged_name}')
+        for line_item_name in report['archived']:
+            logging.info(f'Archive {line_item_name}')
+        logging.info(f"{len(line_items)} line items delivered {sum(line_item['impressions'] for line_item in line_items)} impressions from {start_date} to {end_date}, pruning leaves {report['line_items_after']} line items")
+
+        if not self.write or not (plan['merge'] or plan['archive']):
+            return report
+
+        merged_groups = [merged['price_buckets'] for merged in plan['merge']]
+        if merged_groups:
+            with profile_stage(self.profiler, 'targeting_setup'):
+                self.target_ad_units = self.resolve_target_ad_units()
+                pb_value_names = list(dict.fromkeys("{:.2f}".format(pb / 100) for group in merged_groups for pb in group))
+                pb_values = dfp_api.get_key_values_by_names(self.dfp_client, pb_key_id, pb_value_names, fields=ID_NAME)
+                format_key_id = dfp_api.check_bucket_key(self.dfp_client, self.format_key_name)
+                format_values = dfp_api.get_key_values_by_names(self.dfp_client, format_key_id, self.format_key_values, fields=ID_NAME)
+
+            with profile_stage(self.profiler, 'creation'):
+                orders = self.pack_line_items_into_orders(merged_groups, existing_orders)
+                orders_dict = {order_name: existing_orders[order_name]['id'] for order_name in orders if order_name in existing_orders}
+                orders_dict.update(dfp_api.create_orders_buckets(self.dfp_client, [order_name for order_name in orders if order_name not in existing_orders], str(self.trafficker_id), str(self.advertiser_id)))
+
+            with profile_stage(self.profiler, 'line_item_assembly'):
+                li_json = self.assemble_line_item_jsons(orders, pb_key_id, pb_values, format_key_id, format_values, orders_dict)
+
+            with profile_stage(self.profiler, 'creation'):
+                li_ids = [li['id'] for li in dfp_api.create_line_item_bulk(self.dfp_client, li_json)]
+
+            with profile_stage(self.profiler, 'licas'):
+                creative_dict = self.create_creative_set()
+                dfp_api.create_licas_buckets_creative_set(self.dfp_client, creative_dict['creativeSetId'], creative_dict['masterCreativeId'], li_ids)
+
+        with profile_stage(self.profiler, 'creation'):
+            # the replaced line items are archived only after the merged ones can deliver
+            archive_ids = [line_item['id'] for merged in plan['merge'] for line_item in merged['replaces']] + [line_item['id'] for line_item in plan['archive']]
+            archived = dfp_api.archive_line_items(self.dfp_client, archive_ids)
+
+        report['applied'] = True
+        logging.info(f'Created {len(merged_groups)} merged line items and archived {archived} line items of the {self.format} ladder')
+        return report
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+
+import dfp_api
+import dfp_api_async
+from bucket import Buckets
+from profiling import profile_stage
+from result_rows import ID_NAME
+
+
+class AsyncBuckets(Buckets):
+    """
+    Runs the same setup as Buckets.actual_run on dfp_api_async, requests that don't depend on each other
+    (orders, key-values, creatives, line-item and lica chunks) are sent concurrently, at most `concurrency` at a time.
+    """
+
+    concurrency: int = 8
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.concurrency = args.get('concurrency') or self.concurrency
+
+    async def create_creative_set_async(self, async_client: dfp_api_async.AsyncDfpClient) -> dict:
+        master_creative_request = dfp_api_async.create_master_creative_and_get_id(async_client, self.master_creative_name, self.master_snippet, self.advertiser_id, self.assemble_size_list(self.creative_size))
+        companion_creative_requests = [dfp_api_async.create_master_creative_and_get_id(async_client, f'{self.companion_creative_name}_{index}', self.companion_snippet, self.advertiser_id, self.assemble_size_list(companion_size)) for index, companion_size in enumerate(self.companion_sizes)]
+        master_master_creative_id, *companion_master_creative_ids = await asyncio.gather(master_creative_request, *companion_creative_requests)
+
+        logging.info(f'master master-creative created with id: {master_master_creative_id}')
+        logging.info(f'companion master-creative created with id: {companion_master_creative_ids}')
+
+        creative_set_name = f'{self.prefix}_{self.format}_creative_set'
+
+        creative_set = await dfp_api_async.create_creative_set(async_client, creative_set_name, master_master_creative_id, companion_master_creative_ids)
+        return {
+            'creativeSetId': creative_set['id'],
+            'masterCreativeId': master_master_creative_id,
+            'companionCreativeIds': companion_master_creative_ids
+        }
+
+    async def create_price_bucket_values_async(self, async_client: dfp_api_async.AsyncDfpClient, line_item_price_buckets: list[int]) -> tuple[int, list[int], list]:
+        # check if given key for price-buckets exist, if so, use it, else check if key defaulted to stroeer_ssp_hb_pb, then create, else error
+        if self.price_bucket_key_value_name == 'stroeer_ssp_hb_pb':
+            logging.info('No custom key-value for price-buckets set, will create new key-value "stroeer_ssp_hb_pb"')
+            pb_key_id = await dfp_api_async.get_bucket_key(async_client, self.price_bucket_key_value_name, 'PREDEFINED')
+        else:
+            pb_key_id = await dfp_api_async.check_bucket_key(async_client, self.price_bucket_key_value_name)
+            existing_pricebucket_obj = await dfp_api_async.get_all_key_values(async_client, self.price_bucket_key_value_name, fields=ID_NAME)
+            line_item_price_buckets = self.map_price_buckets_to_existing_values(line_item_price_buckets, existing_pricebucket_obj)
+
+        pb_values = await dfp_api_async.create_hb_key_values(async_client, line_item_price_buckets, pb_key_id, self.price_bucket_key_value_name, return_all=False)
+        return pb_key_id, line_item_price_buckets, pb_values
+
+    async def create_format_values_async(self, async_client: dfp_api_async.AsyncDfpClient) -> tuple[int, list]:
+        format_key_id = await dfp_api_async.get_bucket_key(async_client, self.format_key_name, 'PREDEFINED')
+        format_values = await dfp_api_async.create_targeting_key_values(async_client, format_key_id, self.format_key_name, self.format_key_values)
+        return format_key_id, format_values
+
+    async def create_key_values_async(self, async_client: dfp_api_async.AsyncDfpClient, line_item_price_buckets: list[int]) -> tuple[tuple, tuple]:
+        # the key-values lease is only held while keys and values are checked and created (see Buckets.key_values_lease),
+        # it's acquired in a thread, so the other setup requests go on while another run holds it
+        lease = self.key_values_lease()
+        await asyncio.to_thread(lease.__enter__)
+        try:
+            return await asyncio.gather(
+                self.create_price_bucket_values_async(async_client, line_item_price_buckets),
+                self.create_format_values_async(async_client),
+            )
+        finally:
+            lease.__exit__(None, None, None)
+
+    async def validate_target_ad_units_async(self):
+        # the ad unit index is cached locally, so it's loaded in a thread instead of on dfp_api_async
+        self.target_ad_units = await asyncio.to_thread(self.resolve_target_ad_units)
+
+    async def actual_run_async(self):
+
+        self.get_dfp_client()
+        logging.info(f'dfp_client from admanager: {self.dfp_client.network_code}')
+
+        with profile_stage(self.profiler, 'bucket_generation'):
+            line_item_price_buckets = self.get_line_item_price_buckets()
+
+        async with dfp_api_async.AsyncDfpClient(self.dfp_client, self.concurrency) as async_client:
+            # creatives are independent of everything else, so they are created together with the targeting
+            with profile_stage(self.profiler, 'targeting_setup'):
+                # the orders are indexed by get_orders_with_line_item_names, the creatives before they are checked
+                await asyncio.to_thread(dfp_api.index_managed_entities, self.dfp_client, f'{self.prefix}_{self.format}_', ('line_items', 'creatives'))
+                ((pb_key_id, line_item_price_buckets, pb_values), (format_key_id, format_values)), existing_orders, creative_dict, _ = await asyncio.gather(
+                    self.create_key_values_async(async_client, line_item_price_buckets),
+                    dfp_api_async.get_orders_with_line_item_names(async_client, f'{self.prefix}_{self.format}_'),
+                    self.create_creative_set_async(async_client),
+                    self.validate_target_ad_units_async(),
+                )
+            logging.info(f'Adunits to be targetted: {self.target_ad_units}')
+            logging.info(f'creative_dict: {creative_dict}')
+
+            with profile_stage(self.profiler, 'bucket_generation'):
+                # use potentially mapped price-buckets to create line items and orders
+                line_item_groups = self.group_price_buckets(line_item_price_buckets)
+                orders = self.pack_line_items_into_orders(line_item_groups, existing_orders)
+
+            with profile_stage(self.profiler, 'creation'):
+                orders_dict = await dfp_api_async.create_orders_buckets(async_client, list(orders.keys()), str(self.trafficker_id), str(self.advertiser_id))
+                logging.info(f'Order ids: {list(orders_dict.values())}')
+
+            with profile_stage(self.profiler, 'line_item_assembly'):
+                li_json = self.assemble_line_item_jsons(orders, pb_key_id, pb_values, format_key_id, format_values, orders_dict)
+
+            with profile_stage(self.profiler, 'creation'):
+                line_items = await dfp_api_async.create_line_item_bulk(async_client, li_json)
+
+                li_ids = [li['id'] for li in line_items]
+            logging.info(f'Line item ids after creation: {li_ids}')
+
+            with profile_stage(self.profiler, 'licas'):
+                await dfp_api_async.create_licas_buckets_creative_set(async_client, creative_dict['creativeSetId'], creative_dict['masterCreativeId'], li_ids)
+
+        logging.info(f'Created the {self.format} ladder with {len(li_ids)} line items')
+
+    def actual_run(self):
+        asyncio.run(self.actual_run_async())
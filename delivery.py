@@ -0,0 +1,136 @@
+import csv
+import datetime
+import gzip
+import io
+import logging
+from typing import Iterable, Iterator
+
+import requests
+from googleads import ad_manager as dfp
+
+from dfp_api import VERSION_NB
+from transport import TransportSettings
+
+# delivery-driven pruning of a price bucket ladder
+# a ReportService job reads the impressions and revenue of the managed line items over a date range, the gzip csv of
+# the report is streamed and parsed row by row without being stored. Consecutive line items below a minimum of
+# impressions are merged into coarser line items, line items above the highest delivering one are archived up to a cap.
+
+REPORT_POLL_SECONDS = 15
+REPORT_COLUMNS = ['AD_SERVER_IMPRESSIONS', 'AD_SERVER_CPM_AND_CPC_REVENUE']
+MAX_MERGED_PRICE_BUCKETS = 50 # price-bucket values targeted by one merged line item, keeps its targeting small
+
+
+def _report_date(date: datetime.date) -> dict:
+    return {'year': date.year, 'month': date.month, 'day': date.day}
+
+
+def run_delivery_report(dfp_client, order_ids: list[int], start_date: datetime.date, end_date: datetime.date, poll_seconds: int = REPORT_POLL_SECONDS) -> int:
+    """
+    Runs a report of the impressions and revenue per line item of the orders and waits until it's completed.
+    The report is filtered by order id, so the order is one of its dimensions.
+    :return: id of the report job
+    """
+    statement = dfp.StatementBuilder(version=VERSION_NB, where='ORDER_ID IN ({})'.format(', '.join(str(order_id) for order_id in order_ids)), limit=None, offset=None)
+    report_job = {
+        'reportQuery': {
+            'dimensions': ['ORDER_ID', 'LINE_ITEM_ID'],
+            'columns': REPORT_COLUMNS,
+            'dateRangeType': 'CUSTOM_DATE',
+            'startDate': _report_date(start_date),
+            'endDate': _report_date(end_date),
+            'statement': statement.ToStatement(),
+        }
+    }
+    logging.info(f'Running delivery report for {len(order_ids)} orders from {start_date} to {end_date}')
+    return dfp_client.GetDataDownloader(version=VERSION_NB).WaitForReport(report_job, poll_time_seconds=poll_seconds)
+
+
+def stream_report_rows(dfp_client, report_job_id: int) -> Iterator[dict]:
+    """
+    Streams the rows of a completed report as dicts by csv column, e.g. 'Dimension.LINE_ITEM_ID'.
+    The gzip file is decompressed and parsed while it's downloaded, the report is never held in memory as a whole.
+    """
+    report_service = dfp_client.GetService('ReportService', version=VERSION_NB)
+    report_url = report_service.getReportDownloadUrlWithOptions(report_job_id, {
+        'exportFormat': 'CSV_DUMP',
+        'includeReportProperties': False,
+        'includeTotalsRow': False,
+        'useGzipCompression': True
+    })
+    session = getattr(dfp_client, 'http_session', None) or requests.Session()
+    transport_settings = getattr(dfp_client, 'transport_settings', None) or TransportSettings()
+    with session.get(report_url, stream=True, timeout=(transport_settings.connect_timeout, transport_settings.read_timeout)) as response:
+        response.raise_for_status()
+        # the raw stream is the gzip file as it's downloaded
+        with gzip.GzipFile(fileobj=response.raw) as report_file:
+            yield from csv.DictReader(io.TextIOWrapper(report_file, encoding='utf-8', newline=''))
+
+
+def read_delivery(rows: Iterable[dict]) -> dict[int, dict]:
+    """
+    Sums the impressions and revenue (in micros) of the report rows by line item id.
+    """
+    delivery: dict[int, dict] = {}
+    for row in rows:
+        line_item_delivery = delivery.setdefault(int(row['Dimension.LINE_ITEM_ID']), {'impressions': 0, 'revenue_micros': 0})
+        line_item_delivery['impressions'] += int(row['Column.AD_SERVER_IMPRESSIONS'] or 0)
+        line_item_delivery['revenue_micros'] += int(row['Column.AD_SERVER_CPM_AND_CPC_REVENUE'] or 0)
+    return delivery
+
+
+def _close_chunk(chunk: list[dict], plan: dict):
+    # a single low-delivery line item has no neighbour to be merged with, it stays
+    if len(chunk) == 1:
+        plan['keep'].append(chunk[0])
+    elif chunk:
+        plan['merge'].append({
+            'price_buckets': [pb for line_item in chunk for pb in line_item['price_buckets']],
+            'replaces': chunk,
+            'impressions': sum(line_item['impressions'] for line_item in chunk),
+        })
+
+
+def plan_pruning(line_items: list[dict], min_impressions: int, max_price_spread: int = 0, max_price_buckets: int = MAX_MERGED_PRICE_BUCKETS, max_archived: int = 0) -> dict:
+    """
+    Plans a coarser ladder from the delivery of its line items:
+        - line items with at least min_impressions stay
+        - consecutive line items below min_impressions are merged until the merged line item reaches min_impressions,
+          max_price_spread (in cents, 0 = no limit) or max_price_buckets
+        - line items above the highest line item with any impressions are archived, at most max_archived from the top
+          of the ladder, the others stay. Nothing high-priced might have delivered in a short date range only, so
+          archiving is capped and off by default.
+    A ladder without any delivery stays as it is, e.g. for a date range before its creation.
+    :param line_items: line items in price order with 'id', 'name', 'price_buckets' (in cents) and 'impressions'
+    :return: {'keep': [line items], 'merge': [{'price_buckets', 'replaces', 'impressions'}], 'archive': [line items]}
+    """
+    plan = {'keep': [], 'merge': [], 'archive': []}
+    delivering = [index for index, line_item in enumerate(line_items) if line_item['impressions'] > 0]
+    if not delivering:
+        plan['keep'] = list(line_items)
+        return plan
+    undelivered_top = line_items[delivering[-1] + 1:]
+    archived_count = min(max_archived, len(undelivered_top))
+    plan['archive'] = undelivered_top[len(undelivered_top) - archived_count:]
+    if archived_count < len(undelivered_top):
+        logging.info(f'{len(undelivered_top)} line items above the highest delivering one, only {archived_count} of them are archived (max. {max_archived})')
+
+    chunk: list[dict] = []
+    for line_item in line_items[:delivering[-1] + 1]:
+        if line_item['impressions'] >= min_impressions:
+            _close_chunk(chunk, plan)
+            chunk = []
+            plan['keep'].append(line_item)
+            continue
+        if chunk:
+            price_buckets = [pb for member in chunk for pb in member['price_buckets']] + line_item['price_buckets']
+            if len(price_buckets) > max_price_buckets or (max_price_spread and price_buckets[-1] - price_buckets[0] > max_price_spread):
+                _close_chunk(chunk, plan)
+                chunk = []
+        chunk.append(line_item)
+        if sum(member['impressions'] for member in chunk) >= min_impressions:
+            _close_chunk(chunk, plan)
+            chunk = []
+    _close_chunk(chunk, plan)
+    plan['keep'].extend(undelivered_top[:len(undelivered_top) - archived_count])
+    return plan
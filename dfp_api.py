@@ -1,20 +1,41 @@
 from __future__ import absolute_import, print_function
 
+import datetime
 import logging
 from builtins import range
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
 from googleads import ad_manager as dfp
 from googleads.ad_manager import AdManagerClient as DfpClient
 
+import pql
+import soap_templates
+from batching import get_batcher
+from result_rows import AD_UNIT_FIELDS, ID_NAME, KEY_VALUE_FIELDS, LICA_FIELDS, LINE_ITEM_FIELDS, ORDER_FIELDS, project, to_dict
+from session import get_session, record
+from transport import PARALLEL_PAGE_READS, TransportSettings, TunedDfpClient
+
 # Current version nb of the dfp api. In case of API update, change this version
 # number. For details, see
 # https://developers.google.com/ad-manager/api/deprecation
 VERSION_NB = "v202502"
 
+# GAM allows at most 450 line items per order, see
+# https://support.google.com/admanager/answer/1628457
+MAX_LINE_ITEMS_PER_ORDER = 450
+
+# parallel page reads are repeated this often if the result set changes during the read, then it is read serially
+PARALLEL_PAGE_READ_ATTEMPTS = 3
+
 
-def get_dfp_client_for_account(path):
+def get_dfp_client_for_account(path, transport_settings: TransportSettings = None):
     
-    dfp_client = DfpClient.LoadFromStorage(path)
+    if transport_settings is None:
+        return DfpClient.LoadFromStorage(path)
+
+    # all services of the client share one pooled session, see transport.py
+    dfp_client = TunedDfpClient.LoadFromStorage(path, transport_settings)
 
     return dfp_client
 
@@ -29,7 +50,7 @@ def create_orders_buckets(dfp_client: DfpClient, orders, trafficker_id: str, adv
 def check_create_orders(dfp_client: DfpClient, orders, skip_existing=True) -> list:
     existing_orders = []
     if skip_existing:
-        existing_orders = get_orders_by_names(dfp_client, [item['name'] for item in orders])
+        existing_orders = get_orders_by_names(dfp_client, [item['name'] for item in orders], fields=ORDER_FIELDS)
         existing_order_names = {item['name'] for item in existing_orders}
         orders = [item for item in orders if item['name'] not in existing_order_names]
 
@@ -37,7 +58,10 @@ def check_create_orders(dfp_client: DfpClient, orders, skip_existing=True) -> li
     if orders:
         srv = dfp_client.GetService('OrderService', version=VERSION_NB)
         try:
-            results = srv.createOrders(orders)
+            results = get_batcher(dfp_client, 'createOrders').run(orders, srv.createOrders)
+            session = get_session()
+            if session:
+                session.orders.update((order['name'], order) for order in project(results, ORDER_FIELDS))
         except Exception as e:
             order_names = [o['name'] for o in orders]
             if "UniqueError.NOT_UNIQUE" in str(e.args):
@@ -51,19 +75,104 @@ def check_create_orders(dfp_client: DfpClient, orders, skip_existing=True) -> li
             else:
                 raise e
 
+    record('orders', [order['id'] for order in results], [order['id'] for order in existing_orders])
     return results + existing_orders
 
-def get_orders_by_names(dfp_client: DfpClient, names):
+def get_orders_by_names(dfp_client: DfpClient, names, fields=None):
     if not names:
         return []
+    session = get_session()
+    if session and fields and set(fields) <= set(ORDER_FIELDS):
+        # only the orders the run doesn't know yet are read
+        known_orders, names = session.get_by_names('orders', names, fields)
+        orders = _read_orders_by_names(dfp_client, names, ORDER_FIELDS) if names else []
+        session.orders.update((order['name'], order) for order in orders)
+        return known_orders + project(orders, fields)
+    return _read_orders_by_names(dfp_client, names, fields)
+
+def _read_orders_by_names(dfp_client: DfpClient, names, fields=None):
     order_service = dfp_client.GetService('OrderService', version=VERSION_NB)
     query = "WHERE name IN ({})".format(', '.join(["'{}'".format(name) for name in names]))
     statement = dfp.FilterStatement(query)
     response = order_service.getOrdersByStatement(statement.ToStatement())
     if "results" not in response:
         return []
-    return response["results"]
+    return project(response["results"], fields) if fields else response["results"]
+
+
+def get_orders_with_line_item_names(dfp_client: DfpClient, order_name_prefix: str) -> dict:
+    """
+    Reads all orders whose name starts with the given prefix together with the names of their line items.
+    The line items of all orders are read in one bulk (paged) read instead of one read per order.
+    :param dfp_client: Client for API call
+    :param order_name_prefix: prefix of the order names, e.g. stroeer_ssp_wallpaper_
+    :return: dict of order name to {'id': order id, 'line_item_names': [names of all line items in the order]}
+    """
+    order_service = dfp_client.GetService('OrderService', version=VERSION_NB)
+    statement = dfp.FilterStatement("WHERE name LIKE :name", [{
+        "key": "name",
+        "value": {
+            "xsi_type": "TextValue",
+            "value": order_name_prefix + '%'
+        }
+    }])
+    orders = get_all_results_by_statement(order_service.getOrdersByStatement, statement, fields=ORDER_FIELDS)
+    session = get_session()
+    if session and session.prefix_scan:
+        # all orders of the prefix were read
+        session.index('orders', order_name_prefix, orders)
+    elif session:
+        session.orders.update((order['name'], order) for order in orders)
+    if not orders:
+        return {}
+
+    orders_by_id = {order['id']: {'name': order['name'], 'id': order['id'], 'line_item_names': []} for order in orders}
+    # only the two columns are read via pql, the pages are consumed while they are streamed
+    pql_service = dfp_client.GetService('PublisherQueryLanguageService', version=VERSION_NB)
+    where_clause = "WHERE OrderId IN ({})".format(', '.join(str(order_id) for order_id in orders_by_id))
+    for page in pql.select_pages(pql_service, 'Line_Item', ('orderId', 'name'), where_clause):
+        for line_item in page:
+            orders_by_id[line_item['orderId']]['line_item_names'].append(line_item['name'])
+
+    return {order['name']: {'id': order['id'], 'line_item_names': order['line_item_names']} for order in orders_by_id.values()}
+
+
+def _name_like(name_prefix: str) -> list[dict]:
+    return [{"key": "name", "value": {"xsi_type": "TextValue", "value": name_prefix + '%'}}]
+
+def scan_by_prefix(dfp_client: DfpClient, kind: str, name_prefix: str) -> list:
+    """
+    Reads all entities of a kind whose name starts with the prefix in one scan, paged and ordered by id.
+    :param kind: orders, line_items or creatives
+    :return: rows with the fields of the session's memo of the kind (see session.py)
+    """
+    if kind == 'line_items':
+        pql_service = dfp_client.GetService('PublisherQueryLanguageService', version=VERSION_NB)
+        return pql.select(pql_service, 'Line_Item', LINE_ITEM_FIELDS, "WHERE Name LIKE :name", _name_like(name_prefix))
+    if kind == 'orders':
+        api_fun, fields = dfp_client.GetService('OrderService', version=VERSION_NB).getOrdersByStatement, ORDER_FIELDS
+    elif kind == 'creatives':
+        api_fun, fields = dfp_client.GetService('CreativeService', version=VERSION_NB).getCreativesByStatement, ID_NAME
+    else:
+        raise ValueError(f'unknown kind {kind}')
+    statement = dfp.FilterStatement("WHERE name LIKE :name ORDER BY id ASC", _name_like(name_prefix))
+    return get_all_results_by_statement(api_fun, statement, fields=fields)
 
+def index_managed_entities(dfp_client: DfpClient, name_prefix: str, kinds=('orders', 'line_items', 'creatives')):
+    """
+    Indexes all orders, line items and creatives of the name prefix (e.g. stroeer_ssp_wallpaper_) in the session of
+    the run, their existence checks are then answered from the index instead of `name IN (...)` reads per batch.
+    Kinds that were already scanned with the prefix (e.g. the orders by get_orders_with_line_item_names) are skipped.
+    A no-op unless the session has prefix_scan set.
+    """
+    session = get_session()
+    if not session or not session.prefix_scan:
+        return
+    for kind in kinds:
+        if session.scanned.get(kind) != name_prefix:
+            rows = scan_by_prefix(dfp_client, kind, name_prefix)
+            session.index(kind, name_prefix, rows)
+            logging.info(f'Indexed {len(rows)} {kind.replace("_", " ")} named {name_prefix}*')
 
 
 def get_bucket_key(dfp_client: DfpClient, key_name, key_type='PREDEFINED'):
@@ -82,6 +191,9 @@ def check_bucket_key(dfp_client: DfpClient, key_name):
     return key_id
 
 def _get_key_id(dfp_client: DfpClient, key_name):
+    session = get_session()
+    if session and key_name in session.key_ids:
+        return session.key_ids[key_name]
     cts = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
     # retrieve key_id
     stmt_key = "WHERE name = :name"
@@ -101,6 +213,8 @@ def _get_key_id(dfp_client: DfpClient, key_name):
         raise Exception(
             "Could not find key {} for DFP account {}. Please create the key in the DFP Account".format(key_name, dfp_client.network_code)
         )
+    if session:
+        session.key_ids[key_name] = key_id
     return key_id
 
 
@@ -118,6 +232,10 @@ def create_targeting_key(dfp_client: DfpClient, name, type_='FREEFORM'):
                'type': type_}]
     result = cts.createCustomTargetingKeys(values)
     key_id = result[0]["id"]
+    session = get_session()
+    if session:
+        session.key_ids[name] = key_id
+    record('keys', [key_id])
     return key_id
 
 
@@ -137,35 +255,137 @@ def create_key_values(dfp_client: DfpClient, key_id, values, key_name, return_al
 
     return check_create_key_values(dfp_client, key_values, key_name, return_all, skip_existing=True)
 
-def check_create_key_values(dfp_client: DfpClient, values, key_name, return_all=False, skip_existing=True, str_values=False):
+def check_create_key_values(dfp_client: DfpClient, values, key_name, return_all=False, skip_existing=True):
+    """
+    Creates the values of a key that don't exist yet. The created values are taken from the create response and
+    merged with the existing ones, they are only read again if the outcome of the create is unknown.
+    :param values: values to be created, all of the same key
+    :param return_all: return all active values of the key instead of the given ones
+    :return: list of values with KEY_VALUE_FIELDS
+    """
     existing_values = []
-    key_values = None
+    key_values = values
     if skip_existing:
-        existing_values = get_all_key_values(dfp_client, key_name, only_active=True, as_dict=False)
+        existing_values = get_all_key_values(dfp_client, key_name, only_active=True, fields=KEY_VALUE_FIELDS)
         existing_key_values_names = {item['name'] for item in existing_values}
         key_values = [item for item in values if item['name'] not in existing_key_values_names]
     results = []
     if key_values:
         srv = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
-        try:
-            results = srv.createCustomTargetingValues(key_values)
-        except Exception as e:
-            key_names = [kn['name'] for kn in key_values]
-            if "CustomTargetingError.VALUE_NAME_DUPLICATE" in str(e.args):
-                pass
+        results = _create_key_values(dfp_client, key_name, key_values, lambda: get_batcher(dfp_client, 'createCustomTargetingValues').run(key_values, srv.createCustomTargetingValues))
+    names = {value['name'] for value in values}
+    record('key_values', [value['id'] for value in results], [value['id'] for value in existing_values if value['name'] in names])
     if return_all:
         return results + existing_values
-    elif str_values:
-        values = [value['name'] for value in values]
-        return get_amazon_key_value_by_name(dfp_client, key_name, values)
-    else:
-        values = [value['name'] for value in values]
-        return get_key_value_by_name(dfp_client, key_name, values)
+    return [value for value in results + existing_values if value['name'] in names]
+
+
+def is_ambiguous_create_error(error: Exception, duplicate_error: str) -> bool:
+    """
+    True if the entities of a failed create call may exist anyway, created by a concurrent run or by an earlier
+    attempt of a call that timed out.
+    """
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    return duplicate_error in str(error.args)
+
+
+def _create_key_values(dfp_client: DfpClient, key_name, key_values, create) -> list:
+    """
+    Runs create for the key values and returns the created values, the values are read by name after an
+    ambiguous error.
+    """
+    key_id = key_values[0]['customTargetingKeyId']
+    names = [value['name'] for value in key_values]
+    try:
+        results = project(create(), KEY_VALUE_FIELDS)
+    except Exception as e:
+        if not is_ambiguous_create_error(e, 'CustomTargetingError.VALUE_NAME_DUPLICATE'):
+            logging.error(f'Could not create {len(key_values)} values of key {key_name}: {e}')
+            raise
+        logging.warning(f'Creating {len(key_values)} values of key {key_name} failed ({type(e).__name__}), reading them by name')
+        results = get_key_value_by_name(dfp_client, key_name, names, fields=KEY_VALUE_FIELDS)
+        missing_names = set(names) - {value['name'] for value in results}
+        if missing_names:
+            logging.error(f'Values {sorted(missing_names)} of key {key_name} were not created')
+            raise e
+    _add_created_key_values(key_id, [value for value in results if value['status'] == 'ACTIVE'])
+    return results
+
+
+def _add_created_key_values(key_id, created_values):
+    session = get_session()
+    if session:
+        session.add_key_values(key_id, created_values)
 
 
+def create_missing_key_values(dfp_client: DfpClient, key_id, key_name, values) -> list:
+    """
+    Creates the price-bucket values of the key that don't exist yet. Only the given values are looked up instead
+    of all values of the key, so the cost scales with the amount of values.
+    :param dfp_client: Client for API call
+    :param key_id: id of the price-bucket key
+    :param key_name: name of the price-bucket key, values are read by name after an ambiguous error
+    :param values: price buckets in cents
+    :return: list of the created and the existing values with KEY_VALUE_FIELDS
+    """
+    names = list(dict.fromkeys("{:.2f}".format(value / 100) for value in values))
+    existing_values = get_key_values_by_names(dfp_client, key_id, names, fields=KEY_VALUE_FIELDS)
+    existing_names = {value['name'] for value in existing_values}
+    key_values = [{
+        "customTargetingKeyId": key_id,
+        "displayName": name,
+        "name": name,
+        "matchType": "EXACT"
+    } for name in names if name not in existing_names]
+
+    results = []
+    if key_values:
+        srv = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
+        results = _create_key_values(dfp_client, key_name, key_values, lambda: get_batcher(dfp_client, 'createCustomTargetingValues').run(key_values, srv.createCustomTargetingValues))
+    logging.info(f'{len(results)} key-values created, {len(existing_values)} already existed')
+    record('key_values', [value['id'] for value in results], [value['id'] for value in existing_values])
+    return results + existing_values
+
+
+def get_key_values_by_names(dfp_client: DfpClient, key_id, names, fields=None, chunk_size=500):
+    """
+    Reads the active values of a key with the given names, in chunks of `chunk_size` names per query.
+    """
+    session = get_session()
+    known_values = session.get_key_values(key_id, True, KEY_VALUE_FIELDS) if session and fields and set(fields) <= set(KEY_VALUE_FIELDS) else None
+    if known_values is not None:
+        names = set(names)
+        return project([value for value in known_values if value['name'] in names], fields)
+    cts = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
+    values = [{
+        "key": "id",
+        "value": {
+            "xsi_type": "NumberValue",
+            "value": key_id
+        }
+    }]
+    results = []
+    for i in range(0, len(names), chunk_size):
+        query = "WHERE customTargetingKeyId = :id AND status = 'ACTIVE' AND name IN ({})".format(', '.join(["'{}'".format(name) for name in names[i:i + chunk_size]]))
+        statement = dfp.FilterStatement(query, values)
+        results.extend(get_all_results_by_statement(cts.getCustomTargetingValuesByStatement, statement, fields=fields))
+    return results
+
 
-def get_all_key_values(dfp_client: DfpClient, key_name, only_active=True, as_dict=False):
+def get_all_key_values(dfp_client: DfpClient, key_name, only_active=True, as_dict=False, fields=None):
     key_id = _get_key_id(dfp_client, key_name)
+    session = get_session()
+    if session and not as_dict and fields and set(fields) <= set(KEY_VALUE_FIELDS):
+        # the values of a key are read once per run and kept up to date by the creates
+        known_values = session.get_key_values(key_id, only_active, fields)
+        if known_values is None:
+            session.key_values[(key_id, only_active)] = _read_key_values(dfp_client, key_id, only_active, fields=KEY_VALUE_FIELDS)
+            known_values = session.get_key_values(key_id, only_active, fields)
+        return known_values
+    return _read_key_values(dfp_client, key_id, only_active, as_dict, fields)
+
+def _read_key_values(dfp_client: DfpClient, key_id, only_active=True, as_dict=False, fields=None):
     cts = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
 
     # check for existing keys
@@ -180,80 +400,115 @@ def get_all_key_values(dfp_client: DfpClient, key_name, only_active=True, as_dic
         }
     }]
     statement_values = dfp.FilterStatement(stmt_values, values)
-    statement_values.limit = 5000
-    results = []
-    while True:
-        res = cts.getCustomTargetingValuesByStatement(
-            statement_values.ToStatement()
-        )
-        if res['totalResultSetSize']:
-            results.extend(res['results'])
-            statement_values.offset = len(results)
-        if statement_values.offset >= res['totalResultSetSize']:
-            break
-    if as_dict:
-        results = [{key: getattr(r, key) for key in dir(r) if not key.startswith('_')} for r in results]
-    return results
+    return get_all_results_by_statement(cts.getCustomTargetingValuesByStatement, statement_values, limit=5000, as_dict=as_dict, fields=fields, page_workers=PARALLEL_PAGE_READS)
 
 
-def get_amazon_key_value_by_name(dfp_client: DfpClient, key_name, values):
-    service = dfp_client.GetService('CustomTargetingService', version=VERSION_NB)
-    query = "WHERE name = '{}'".format(key_name)
-    statement = dfp.FilterStatement(query)
-    key_id = get_all_results_by_statement(service.getCustomTargetingKeysByStatement, statement)[0]['id']
-    query = "WHERE customTargetingKeyId = '{}' AND name in ('{}')".format(key_id, "','".join(values))
-    statement = dfp.FilterStatement(query)
-
-    return get_all_results_by_statement(service.getCustomTargetingValuesByStatement, statement)
+def get_amazon_key_value_by_name(dfp_client: DfpClient, key_name, values, fields=None):
+    return get_key_value_by_name(dfp_client, key_name, values, fields)
 
-def get_key_value_by_name(dfp_client: DfpClient, key_name, values):
+def get_key_value_by_name(dfp_client: DfpClient, key_name, values, fields=None, chunk_size=500):
+    """
+    Reads the values of a key with the given names whatever their status, in chunks of `chunk_size` names per query.
+    """
     service = dfp_client.GetService('CustomTargetingService', version=VERSION_NB)
-    query = "WHERE name = '{}'".format(key_name)
-    statement = dfp.FilterStatement(query)
-    key_id = get_all_results_by_statement(service.getCustomTargetingKeysByStatement, statement)[0]['id']
-    query = "WHERE customTargetingKeyId = '{}' AND name in ({})".format(key_id, ', '.join([value for value in values]))
-    statement = dfp.FilterStatement(query)
-
-    return get_all_results_by_statement(service.getCustomTargetingValuesByStatement, statement)
+    key_id = _get_key_id(dfp_client, key_name)
+    bind_values = [{
+        "key": "id",
+        "value": {
+            "xsi_type": "NumberValue",
+            "value": key_id
+        }
+    }]
+    results = []
+    for i in range(0, len(values), chunk_size):
+        query = "WHERE customTargetingKeyId = :id AND name IN ({})".format(', '.join(["'{}'".format(value) for value in values[i:i + chunk_size]]))
+        statement = dfp.FilterStatement(query, bind_values)
+        results.extend(get_all_results_by_statement(service.getCustomTargetingValuesByStatement, statement, fields=fields))
+    return results
 
 
-def get_all_results_by_statement(api_fun, statement, limit=500, as_dict=False):
+def get_all_results_by_statement(api_fun, statement, limit=500, as_dict=False, fields=None, page_workers=1):
     """
     This function calls a dfp api function to collect all items and return the full list of response objects.
     It performs the bulk fetching which is suggested for large data sets.
     :param api_fun: the api service function to be called
     :param statement: the statement to be used for the function call
+    :param as_dict: return shallow dicts instead of zeep objects
+    :param fields: return rows with only these fields instead of zeep objects, see result_rows.py
+    :param page_workers: fetch up to this many pages at the same time, only for objects with an id, see _get_all_results_parallel
     :return: list of all result objects
     """
     statement.limit = limit
+    if page_workers > 1:
+        return _get_all_results_parallel(api_fun, statement, page_workers, as_dict, fields)
+
     results = []
     while True:
         res = api_fun(statement.ToStatement()
                       )
         if res['totalResultSetSize']:
-            results.extend(res['results'])
+            # convert page by page, so the zeep objects of a page can be freed right away
+            results.extend(_convert_results(res['results'], as_dict, fields))
             statement.offset = len(results)
         if statement.offset >= res['totalResultSetSize']:
             break
-    if as_dict:
-        results = [{key: getattr(r, key) for key in dir(r) if not key.startswith('_')} for r in results]
     return results
 
+
+def _convert_results(results, as_dict=False, fields=None):
+    if fields:
+        return project(results, fields)
+    if as_dict:
+        return [to_dict(r) for r in results]
+    return list(results)
+
+
+def _get_all_results_parallel(api_fun, statement, page_workers, as_dict=False, fields=None):
+    """
+    Reads the first page to get totalResultSetSize, then fetches all remaining offsets concurrently and
+    reassembles the pages in order.
+    The statement is ordered by id, so every offset addresses the same rows as long as the set doesn't change.
+    Every page reports the size of the set at its read: if it differs from the first page, rows may have moved
+    between pages and the whole read is repeated, after PARALLEL_PAGE_READ_ATTEMPTS it falls back to the serial read.
+    Rows are deduplicated by id in any case.
+    """
+    if 'ORDER BY' not in statement.where_clause.upper():
+        statement.where_clause = f'{statement.where_clause.rstrip()} ORDER BY id ASC'
+
+    def fetch_page(offset):
+        page_statement = dfp.FilterStatement(statement.where_clause, statement.values, statement.limit, offset)
+        res = api_fun(page_statement.ToStatement())
+        if not res['totalResultSetSize']:
+            return 0, [], []
+        # ids are read before the conversion, as the requested fields don't need to contain the id
+        return res['totalResultSetSize'], [r['id'] for r in res['results']], _convert_results(res['results'], as_dict, fields)
+
+    for attempt in range(PARALLEL_PAGE_READ_ATTEMPTS):
+        first_page = fetch_page(0)
+        total_result_set_size = first_page[0]
+        offsets = range(statement.limit, total_result_set_size, statement.limit)
+        with ThreadPoolExecutor(max_workers=min(page_workers, max(len(offsets), 1))) as executor:
+            pages = [first_page] + list(executor.map(fetch_page, offsets))
+
+        if all(page_size == total_result_set_size for page_size, _, _ in pages):
+            results = []
+            seen_ids = set()
+            for _, ids, rows in pages:
+                for result_id, row in zip(ids, rows):
+                    if result_id not in seen_ids:
+                        seen_ids.add(result_id)
+                        results.append(row)
+            return results
+        logging.warning(f'Result set changed during parallel page read (attempt {attempt + 1} of {PARALLEL_PAGE_READ_ATTEMPTS}), reading it again')
+
+    logging.warning('Result set keeps changing, falling back to serial page read')
+    statement.offset = 0
+    return get_all_results_by_statement(api_fun, statement, statement.limit, as_dict, fields)
+
 def create_line_item_bulk(dfp_client: DfpClient, line_items):
-    start_index = 0
-    limit = 200
-    li_items = []
-    logging.info(f'create_line_item_bulk: {line_items}')
-    while True:
-        if start_index + limit < len(line_items):
-            li_items.extend(check_create_line_items(
-                dfp_client, line_items[start_index: start_index + limit]))
-        else:
-            li_items.extend(check_create_line_items(
-                dfp_client, line_items[start_index: len(line_items)]))
-            break
-        start_index += limit
-    return li_items
+    logging.info(f'create_line_item_bulk: {len(line_items)} line items')
+    # existing line items are skipped per batch, so a batch that is sent again doesn't create duplicates
+    return get_batcher(dfp_client, 'createLineItems').run(line_items, lambda batch: check_create_line_items(dfp_client, batch))
 
 def check_create_line_items(dfp_client: DfpClient, line_items, skip_existing=True):
     """
@@ -266,37 +521,123 @@ def check_create_line_items(dfp_client: DfpClient, line_items, skip_existing=Tru
     """
     existing_items = []
     if skip_existing:
-        existing_items = get_line_items_by_names(dfp_client, [item['name'] for item in line_items])
+        existing_items = get_line_items_by_names(dfp_client, [item['name'] for item in line_items], fields=LINE_ITEM_FIELDS)
         existing_item_names = {item['name'] for item in existing_items}
         line_items = [item for item in line_items if item['name'] not in existing_item_names]
     results = []
     if line_items:
         service = dfp_client.GetService('LineItemService', version=VERSION_NB)
-        results = service.createLineItems(line_items)
+        results = soap_templates.create_line_items(dfp_client, service, line_items)
+        session = get_session()
+        if session and 'line_items' in session.scanned:
+            session.line_items.update((line_item['name'], line_item) for line_item in project(results, LINE_ITEM_FIELDS))
+    record('line_items', [line_item['id'] for line_item in results], [line_item['id'] for line_item in existing_items])
     return results + existing_items
 
-def get_line_items_by_names(dfp_client: DfpClient, names):
+def get_line_items_by_order_ids(dfp_client: DfpClient, order_ids) -> list:
+    """
+    Reads the complete line items (including targeting) of the given orders with parallel paging.
+    """
+    if not order_ids:
+        return []
+    service = dfp_client.GetService('LineItemService', version=VERSION_NB)
+    statement = dfp.FilterStatement("WHERE orderId IN ({})".format(', '.join(str(order_id) for order_id in order_ids)))
+    return get_all_results_by_statement(service.getLineItemsByStatement, statement, page_workers=PARALLEL_PAGE_READS)
+
+def get_modified_order_ids(dfp_client: DfpClient, order_ids, since: float) -> set:
+    """
+    Returns the ids of the orders which have line items that were modified (or created) after `since` (unix time).
+    """
+    if not order_ids:
+        return set()
+    since_utc = datetime.datetime.fromtimestamp(since, datetime.timezone.utc)
+    values = [{
+        "key": "since",
+        "value": {
+            "xsi_type": "DateTimeValue",
+            "value": {
+                "date": {"year": since_utc.year, "month": since_utc.month, "day": since_utc.day},
+                "hour": since_utc.hour,
+                "minute": since_utc.minute,
+                "second": since_utc.second,
+                "timeZoneId": "UTC"
+            }
+        }
+    }]
+    pql_service = dfp_client.GetService('PublisherQueryLanguageService', version=VERSION_NB)
+    where_clause = "WHERE OrderId IN ({}) AND LastModifiedDateTime > :since".format(', '.join(str(order_id) for order_id in order_ids))
+    return {line_item['orderId'] for line_item in pql.select(pql_service, 'Line_Item', ('orderId',), where_clause, values)}
+
+def get_line_item_rows_by_order_ids(dfp_client: DfpClient, order_ids, fields) -> list:
+    """
+    Reads the given pql columns (see pql.PQL_TABLES) of all line items of the orders, including archived ones.
+    """
+    if not order_ids:
+        return []
+    pql_service = dfp_client.GetService('PublisherQueryLanguageService', version=VERSION_NB)
+    where_clause = "WHERE OrderId IN ({})".format(', '.join(str(order_id) for order_id in order_ids))
+    return pql.select(pql_service, 'Line_Item', fields, where_clause)
+
+def archive_line_items(dfp_client: DfpClient, line_item_ids, chunk_size=500) -> int:
+    """
+    Archives the line items, archived line items stop delivering and keep their reporting data.
+    :return: amount of archived line items
+    """
+    service = dfp_client.GetService('LineItemService', version=VERSION_NB)
+    archived = 0
+    for i in range(0, len(line_item_ids), chunk_size):
+        statement = dfp.FilterStatement("WHERE id IN ({})".format(', '.join(str(line_item_id) for line_item_id in line_item_ids[i:i + chunk_size])))
+        result = service.performLineItemAction({'xsi_type': 'ArchiveLineItems'}, statement.ToStatement())
+        archived += result['numChanges'] if result and 'numChanges' in result else 0
+    return archived
+
+def get_line_items_by_names(dfp_client: DfpClient, names, fields=None):
     if not names:
         return []
+    session = get_session()
+    if session and 'line_items' in session.scanned and fields and set(fields) <= set(LINE_ITEM_FIELDS):
+        # answered by the prefix index, names outside of the prefix are read
+        known_line_items, names = session.get_by_names('line_items', names, fields)
+        line_items = _read_line_items_by_names(dfp_client, names, LINE_ITEM_FIELDS) if names else []
+        session.line_items.update((line_item['name'], line_item) for line_item in line_items)
+        return known_line_items + project(line_items, fields)
+    return _read_line_items_by_names(dfp_client, names, fields)
+
+def _read_line_items_by_names(dfp_client: DfpClient, names, fields=None):
+    if pql.supports('Line_Item', fields):
+        # only the requested columns instead of whole line items with their targeting
+        pql_service = dfp_client.GetService('PublisherQueryLanguageService', version=VERSION_NB)
+        return pql.select(pql_service, 'Line_Item', fields, "WHERE Name IN ({})".format(', '.join(["'{}'".format(name) for name in names])))
     service = dfp_client.GetService('LineItemService', version=VERSION_NB)
     query = "WHERE name IN ({})".format(', '.join(["'{}'".format(name) for name in names]))
     statement = dfp.FilterStatement(query)
     response = service.getLineItemsByStatement(statement.ToStatement())
     if "results" not in response:
         return []
-    return response["results"]
+    return project(response["results"], fields) if fields else response["results"]
 
 def create_master_creative_and_get_id(dfp_client: DfpClient, creative_name, snippet, advertiser_id, size=(1, 1)):
-    creative_id = get_creatives_by_names(dfp_client, [creative_name])
+    creative_id = get_creatives_by_names(dfp_client, [creative_name], fields=ID_NAME)
     if len(creative_id) > 0:
+        record('creatives', [], [creative_id[0]['id']])
         return creative_id[0]['id']
     else:
         creative_size = {"width": size[0], "height": size[1]}
         creative_id = create_third_party_creative(dfp_client, creative_name, creative_size, snippet, advertiser_id)['id']
+        record('creatives', [creative_id])
         return creative_id
 
 
-def get_creatives_by_names(dfp_client: DfpClient, creative_names):
+def get_creatives_by_names(dfp_client: DfpClient, creative_names, fields=None):
+    session = get_session()
+    if session and fields and set(fields) <= set(ID_NAME):
+        known_creatives, creative_names = session.get_by_names('creatives', creative_names, fields)
+        creatives = _read_creatives_by_names(dfp_client, creative_names, ID_NAME) if creative_names else []
+        session.creatives.update((creative['name'], creative) for creative in creatives)
+        return known_creatives + project(creatives, fields)
+    return _read_creatives_by_names(dfp_client, creative_names, fields)
+
+def _read_creatives_by_names(dfp_client: DfpClient, creative_names, fields=None):
     creative_service = dfp_client.GetService('CreativeService', version=VERSION_NB)
 
     keys = ['key' + str(idx) for idx in range(len(creative_names))]
@@ -316,7 +657,7 @@ def get_creatives_by_names(dfp_client: DfpClient, creative_names):
         )
     statement_values = dfp.FilterStatement(stmt_values, values)
 
-    return get_all_results_by_statement(creative_service.getCreativesByStatement, statement_values)
+    return get_all_results_by_statement(creative_service.getCreativesByStatement, statement_values, fields=fields)
 
 def create_third_party_creative(
         dfp_client: DfpClient, name, size, snippet, advertiser_id, safe_frame=False):
@@ -341,25 +682,21 @@ def create_third_party_creative(
         'CreativeService', version=VERSION_NB
     )
     res = creative_service.createCreatives(creatives)
+    session = get_session()
+    if session:
+        session.creatives[name] = project(res, ID_NAME)[0]
     return res[0]
 
 def create_licas_buckets(dfp_client: DfpClient, master_creative_id, li_ids, sizes):
     creative_sizes = [{"width": w, "height": h} for (w, h) in sizes]
     licas = [{"creativeId": master_creative_id, "lineItemId": li_id, "sizes": creative_sizes}
              for li_id in li_ids]
-    start_index = 0
-    while True:
-        if start_index + 200 < len(licas):
-            check_create_licas(dfp_client, licas[start_index: start_index + 200])
-            start_index += 200
-        else:
-            check_create_licas(dfp_client, licas[start_index: len(licas)])
-            break
+    get_batcher(dfp_client, 'createLineItemCreativeAssociations').run(licas, lambda batch: check_create_licas(dfp_client, batch))
 
 def check_create_licas(dfp_client: DfpClient, licas, skip_existing=True):
     existing_licas = []
     if skip_existing:
-        existing_licas = get_licas(dfp_client, [(item['lineItemId'], item['creativeId']) for item in licas])
+        existing_licas = get_licas(dfp_client, [(item['lineItemId'], item['creativeId']) for item in licas], fields=LICA_FIELDS)
         existing_lica_id_tuples = {(item['lineItemId'], item['creativeId']) for item in existing_licas}
         licas = [item for item in licas if (item['lineItemId'], item['creativeId']) not in existing_lica_id_tuples]
 
@@ -368,15 +705,16 @@ def check_create_licas(dfp_client: DfpClient, licas, skip_existing=True):
         srv = dfp_client.GetService('LineItemCreativeAssociationService', version=VERSION_NB)
         results = srv.createLineItemCreativeAssociations(licas)
 
+    record('licas', [lica['lineItemId'] for lica in results], [lica['lineItemId'] for lica in existing_licas])
     return results + existing_licas
 
-def get_licas(dfp_client: DfpClient, lica_id_tuples):
+def get_licas(dfp_client: DfpClient, lica_id_tuples, fields=None):
     service = dfp_client.GetService('LineItemCreativeAssociationService', version=VERSION_NB)
     query = 'WHERE ' + ' OR '.join(['(lineItemId={li_id} AND creativeId={cr_id})'.format(li_id=tup[0], cr_id=tup[1])
                                     for tup in lica_id_tuples])
     statement = dfp.FilterStatement(query)
 
-    return get_all_results_by_statement(service.getLineItemCreativeAssociationsByStatement, statement)
+    return get_all_results_by_statement(service.getLineItemCreativeAssociationsByStatement, statement, fields=fields)
 
 def create_buckets_additional_keys(dfp_client: DfpClient, additional_keys):
     keys_dict = {item['key_name']: get_bucket_key(dfp_client, item['key_name'], item['key_type'])
@@ -389,25 +727,24 @@ def create_targeting_key_values(dfp_client: DfpClient, key_id: int, key_name:str
     :param dfp_client: (googleads.dfp.DfpClient) Client for API call
     :param key_id: id of the key to be checked
     :param key_values: values which should be created for the targeting key
+    :return: all values of the key (the existing ones and the created ones) with KEY_VALUE_FIELDS
     """
     cts = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
-    existing_values = get_all_key_values(dfp_client, key_name, only_active=False, as_dict=False)
-    values = []
-    for name in key_values:
-        # only create the values which are not already existing
-        if name in [value['name'] for value in existing_values]:
-            continue
-        values.append(
-            {
-                "customTargetingKeyId": key_id,
-                "displayName": name,
-                "name": name,
-                "matchType": "EXACT",
-                "status": "ACTIVE"
-            }
-        )
-    cts.createCustomTargetingValues(values)
-    return get_all_key_values(dfp_client, key_name, only_active=False, as_dict=False)
+    existing_values = get_all_key_values(dfp_client, key_name, only_active=False, fields=KEY_VALUE_FIELDS)
+    # only create the values which are not already existing
+    existing_value_names = {value['name'] for value in existing_values}
+    values = [
+        {
+            "customTargetingKeyId": key_id,
+            "displayName": name,
+            "name": name,
+            "matchType": "EXACT",
+            "status": "ACTIVE"
+        } for name in dict.fromkeys(key_values) if name not in existing_value_names
+    ]
+    created_values = _create_key_values(dfp_client, key_name, values, lambda: get_batcher(dfp_client, 'createCustomTargetingValues').run(values, cts.createCustomTargetingValues)) if values else []
+    record('key_values', [value['id'] for value in created_values], [value['id'] for value in existing_values if value['name'] in key_values])
+    return existing_values + created_values
 
 
 def get_root_adunit_id(dfp_client: DfpClient):
@@ -418,7 +755,25 @@ def get_root_adunit_id(dfp_client: DfpClient):
     return network['effectiveRootAdUnitId']
 
 
-def validate_adunits(dfp_client: DfpClient, ad_unit_ids: list[str]):   
+def get_all_ad_units(dfp_client: DfpClient) -> list[dict]:
+    """
+    Reads the whole inventory tree of the network with paging.
+    :param dfp_client: Client for API call
+    :return: list of {'id', 'parentId', 'name', 'adUnitCode', 'status'} dicts, ids as strings
+    """
+    ad_unit_service = dfp_client.GetService('InventoryService', version=VERSION_NB)
+    statement = dfp.FilterStatement("ORDER BY id ASC")
+    ad_units = get_all_results_by_statement(ad_unit_service.getAdUnitsByStatement, statement, fields=AD_UNIT_FIELDS, page_workers=PARALLEL_PAGE_READS)
+    return [{
+        'id': str(ad_unit['id']),
+        'parentId': str(ad_unit['parentId']) if ad_unit['parentId'] else None,
+        'name': ad_unit['name'],
+        'adUnitCode': ad_unit['adUnitCode'],
+        'status': ad_unit['status']
+    } for ad_unit in ad_units]
+
+
+def validate_adunits(dfp_client: DfpClient, ad_unit_ids: list[str], fields=None):   
     """
     Validate the ad units
     :param dfp_client:
@@ -435,35 +790,62 @@ def validate_adunits(dfp_client: DfpClient, ad_unit_ids: list[str]):
     if len(response["results"]) != len(ad_unit_ids):
         logging.error("Not all ad units were found. Please check the ids.")
         exit(1)
-    return response["results"]
+    return project(response["results"], fields) if fields else response["results"]
 
-def create_creative_set(dfp_client: DfpClient, creative_set_name, master_creative_id, companion_creative_ids): 
+def get_creative_set_by_name(dfp_client: DfpClient, creative_set_name):
+    """
+    :return: id and name of the creative set, None if there is none with the name
+    """
+    session = get_session()
+    if session and creative_set_name in session.creative_sets:
+        return session.creative_sets[creative_set_name]
+    creative_set_service = dfp_client.GetService('CreativeSetService', version=VERSION_NB)
+    values = [{
+        "key": "name",
+        "value": {
+            "xsi_type": "TextValue",
+            "value": creative_set_name
+        }
+    }]
+    statement = dfp.FilterStatement("WHERE name = :name", values)
+    creative_sets = get_all_results_by_statement(creative_set_service.getCreativeSetsByStatement, statement, fields=ID_NAME)
+    if not creative_sets:
+        return None
+    if session:
+        session.creative_sets[creative_set_name] = creative_sets[0]
+    return creative_sets[0]
+
+def create_creative_set(dfp_client: DfpClient, creative_set_name, master_creative_id, companion_creative_ids):
+    """
+    Creates the creative set unless one with the name exists (e.g. in an extend run), the existing one is returned then.
+    """
+    creative_set = get_creative_set_by_name(dfp_client, creative_set_name)
+    if creative_set:
+        record('creative_sets', [], [creative_set['id']])
+        return creative_set
     creative_set_json = {
         'name': creative_set_name,
         'masterCreativeId': master_creative_id,
         'companionCreativeIds': companion_creative_ids
     }
     creative_set_service = dfp_client.GetService('CreativeSetService', version=VERSION_NB)
-    
-    return creative_set_service.createCreativeSet(creative_set_json)
+    creative_set = creative_set_service.createCreativeSet(creative_set_json)
+    session = get_session()
+    if session:
+        session.creative_sets[creative_set_name] = project([creative_set], ID_NAME)[0]
+    record('creative_sets', [creative_set['id']])
+    return creative_set
 
 
 def create_licas_buckets_creative_set(dfp_client: DfpClient, creative_set_id, master_creative_id, li_ids):
     licas = [{"creativeSetId": creative_set_id, 'creativeId': master_creative_id, "lineItemId": li_id}
              for li_id in li_ids]
-    start_index = 0
-    while True:
-        if start_index + 200 < len(licas):
-            check_create_licas_creative_set(dfp_client, licas[start_index: start_index + 200])
-            start_index += 200
-        else:
-            check_create_licas_creative_set(dfp_client, licas[start_index: len(licas)])
-            break
+    get_batcher(dfp_client, 'createLineItemCreativeAssociations').run(licas, lambda batch: check_create_licas_creative_set(dfp_client, batch))
 
 def check_create_licas_creative_set(dfp_client: DfpClient, licas, skip_existing=True):
     existing_licas = []
     if skip_existing:
-        existing_licas = get_licas_creative_set(dfp_client, [(item['lineItemId'], item['creativeSetId'], item['creativeId']) for item in licas])
+        existing_licas = get_licas_creative_set(dfp_client, [(item['lineItemId'], item['creativeSetId'], item['creativeId']) for item in licas], fields=LICA_FIELDS)
         existing_lica_id_tuples = {(item['lineItemId'], item['creativeId']) for item in existing_licas}
         licas = [item for item in licas if (item['lineItemId'], item['creativeId']) not in existing_lica_id_tuples]
 
@@ -472,12 +854,13 @@ def check_create_licas_creative_set(dfp_client: DfpClient, licas, skip_existing=
     if licas:
         srv = dfp_client.GetService('LineItemCreativeAssociationService', version=VERSION_NB)
         results = srv.createLineItemCreativeAssociations(licas)
+    record('licas', [lica['lineItemId'] for lica in results], [lica['lineItemId'] for lica in existing_licas])
     return results + existing_licas
 
-def get_licas_creative_set(dfp_client: DfpClient, lica_id_tuples):
+def get_licas_creative_set(dfp_client: DfpClient, lica_id_tuples, fields=None):
     service = dfp_client.GetService('LineItemCreativeAssociationService', version=VERSION_NB)
     query = 'WHERE ' + ' OR '.join(['(lineItemId={li_id} AND creativeId={cr_id})'.format(li_id=tup[0], cs_id=tup[1], cr_id=tup[2])
                                     for tup in lica_id_tuples])
     statement = dfp.FilterStatement(query)
-    return get_all_results_by_statement(service.getLineItemCreativeAssociationsByStatement, statement)
+    return get_all_results_by_statement(service.getLineItemCreativeAssociationsByStatement, statement, fields=fields)
 
@@ -0,0 +1,573 @@
+import asyncio
+import logging
+import time
+
+import httpx
+import zeep
+from googleads import ad_manager as dfp
+from googleads.ad_manager import AdManagerClient as DfpClient
+from zeep.transports import AsyncTransport
+
+import pql
+import soap_templates
+from batching import get_batcher, is_batch_size_error, is_item_error, isolates_failures, reject
+from dfp_api import VERSION_NB
+from locking import check_leases
+from payload_sink import archive
+from result_rows import ID_NAME, KEY_VALUE_FIELDS, LINE_ITEM_FIELDS, ORDER_FIELDS, project
+from session import get_session, record
+
+# asyncio variant of dfp_api, every function mirrors its blocking counterpart in dfp_api and returns the same results
+
+
+class AsyncDfpService():
+    """
+    Async counterpart of a googleads service, e.g. `await srv.createOrders(orders)`.
+    Argument packing and SOAP headers are taken from the blocking googleads service, only the http call is async.
+    """
+
+    def __init__(self, service, transport: AsyncTransport, semaphore: asyncio.Semaphore):
+        self._service = service
+        self._semaphore = semaphore
+        sync_client = service.zeep_client
+        # reuse the already loaded wsdl and the googleads plugins (auth header, logging)
+        self._zeep_client = zeep.AsyncClient(sync_client.wsdl, transport=transport, plugins=sync_client.plugins)
+
+    def __getattr__(self, method_name):
+        service = self._service
+        soap_service_method = self._zeep_client.service[method_name]
+
+        async def MakeSoapRequest(*args):
+            soap_headers = service._GetZeepFormattedSOAPHeaders()
+            packed_args = service._PackArguments(method_name, args)
+            async with self._semaphore:
+                if method_name.startswith('create'):
+                    # create calls wait for the semaphore, the lease is checked when it's their turn
+                    check_leases(method_name)
+                try:
+                    response = await soap_service_method(*packed_args, _soapheaders=soap_headers)
+                except zeep.exceptions.Fault as e:
+                    raise soap_templates.server_fault(service, e)
+            return response['body']['rval']
+
+        return MakeSoapRequest
+
+    async def create_line_items(self, dfp_client: DfpClient, line_items):
+        """
+        createLineItems with the client's pre-serialized templates, see soap_templates.create_line_items.
+        """
+        rendered = soap_templates.render_request(dfp_client, self._service, line_items)
+        if rendered is None:
+            return await self.createLineItems(line_items)
+        template, request = rendered
+        async with self._semaphore:
+            check_leases('createLineItems')
+            response = await self._zeep_client.transport.post(template.address, request, soap_templates.get_http_headers(self._service, template))
+        return soap_templates.process_reply(self._service, response)
+
+
+class AsyncDfpClient():
+    """
+    Wraps a DfpClient for asyncio, all services share one http connection pool and one semaphore
+    which bounds the amount of requests in flight.
+
+    async with AsyncDfpClient(dfp_client, concurrency=8) as async_client:
+        orders = await get_orders_by_names(async_client, names)
+    """
+
+    def __init__(self, dfp_client: DfpClient, concurrency: int = 8):
+        self.dfp_client = dfp_client
+        self.network_code = dfp_client.network_code
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        transport_settings = getattr(dfp_client, 'transport_settings', None)
+        if transport_settings:
+            proxy = transport_settings.proxy or None
+            timeout = httpx.Timeout(transport_settings.read_timeout, connect=transport_settings.connect_timeout)
+        else:
+            proxy = dfp_client.proxy_config.proxies.get('https') if dfp_client.proxy_config.proxies else None
+            timeout = httpx.Timeout(dfp_client.timeout)
+        # httpx requests gzip responses by default
+        self._http_client = httpx.AsyncClient(
+            timeout=timeout,
+            proxy=proxy,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        )
+        self._wsdl_client = httpx.Client(timeout=timeout, proxy=proxy)
+        self._services = {}
+
+    def GetService(self, service_name, version=VERSION_NB) -> AsyncDfpService:
+        if (service_name, version) not in self._services:
+            transport = AsyncTransport(client=self._http_client, wsdl_client=self._wsdl_client)
+            self._services[(service_name, version)] = AsyncDfpService(
+                self.dfp_client.GetService(service_name, version=version), transport, self._semaphore
+            )
+        return self._services[(service_name, version)]
+
+    async def aclose(self):
+        await self._http_client.aclose()
+        self._wsdl_client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+async def create_orders_buckets(dfp_client: AsyncDfpClient, orders, trafficker_id: str, advertiser_id: str) -> dict:
+    orders_name = [{'name': item, 'advertiserId': advertiser_id, 'traffickerId': trafficker_id}
+                   for item in orders]
+    orders_json = await check_create_orders(dfp_client, orders_name)
+    orders_ids_dict = {item['name']: item['id'] for item in orders_json}
+    return orders_ids_dict
+
+async def check_create_orders(dfp_client: AsyncDfpClient, orders, skip_existing=True) -> list:
+    existing_orders = []
+    if skip_existing:
+        existing_orders = await get_orders_by_names(dfp_client, [item['name'] for item in orders])
+        existing_order_names = {item['name'] for item in existing_orders}
+        orders = [item for item in orders if item['name'] not in existing_order_names]
+
+    results = []
+    if orders:
+        srv = dfp_client.GetService('OrderService', version=VERSION_NB)
+        try:
+            results = await create_batched(dfp_client, 'createOrders', orders, srv.createOrders)
+            session = get_session()
+            if session:
+                session.orders.update((order['name'], order) for order in project(results, ORDER_FIELDS))
+        except Exception as e:
+            order_names = [o['name'] for o in orders]
+            if "UniqueError.NOT_UNIQUE" in str(e.args):
+                raise Exception(
+                    "One or more of the names ({}) chosen for order isn't unique.".format(order_names))
+            elif "TypeError.INVALID_TYPE @ [0].advertiser" in str(e.args):
+                raise Exception(
+                    "The company supposed to be associated with "
+                    "the orders ({}) does not feature a suitable type.".format(order_names)
+                )
+            else:
+                raise e
+
+    record('orders', [order['id'] for order in results], [order['id'] for order in existing_orders])
+    return results + existing_orders
+
+def _get_indexed(kind: str, names, fields) -> tuple[list, list]:
+    # existing entities from the prefix index of the run (see dfp_api.index_managed_entities) and the names to be read
+    session = get_session()
+    if session and kind in session.scanned:
+        return session.get_by_names(kind, names, fields)
+    return [], names
+
+async def get_orders_by_names(dfp_client: AsyncDfpClient, names):
+    known_orders, names = _get_indexed('orders', names, ORDER_FIELDS)
+    if not names:
+        return known_orders
+    order_service = dfp_client.GetService('OrderService', version=VERSION_NB)
+    query = "WHERE name IN ({})".format(', '.join(["'{}'".format(name) for name in names]))
+    statement = dfp.FilterStatement(query)
+    response = await order_service.getOrdersByStatement(statement.ToStatement())
+    if "results" not in response:
+        return known_orders
+    return known_orders + list(response["results"])
+
+async def get_orders_with_line_item_names(dfp_client: AsyncDfpClient, order_name_prefix: str) -> dict:
+    order_service = dfp_client.GetService('OrderService', version=VERSION_NB)
+    statement = dfp.FilterStatement("WHERE name LIKE :name", [{
+        "key": "name",
+        "value": {
+            "xsi_type": "TextValue",
+            "value": order_name_prefix + '%'
+        }
+    }])
+    orders = await get_all_results_by_statement(order_service.getOrdersByStatement, statement, fields=ORDER_FIELDS)
+    session = get_session()
+    if session and session.prefix_scan:
+        # all orders of the prefix were read, see dfp_api.index_managed_entities
+        session.index('orders', order_name_prefix, orders)
+    elif session:
+        session.orders.update((order['name'], order) for order in orders)
+    if not orders:
+        return {}
+
+    orders_by_id = {order['id']: {'name': order['name'], 'id': order['id'], 'line_item_names': []} for order in orders}
+    # only the two columns are read via pql, see dfp_api.get_orders_with_line_item_names
+    pql_service = dfp_client.GetService('PublisherQueryLanguageService', version=VERSION_NB)
+    where_clause = "WHERE OrderId IN ({})".format(', '.join(str(order_id) for order_id in orders_by_id))
+    async for page in pql.select_pages_async(pql_service, 'Line_Item', ('orderId', 'name'), where_clause):
+        for line_item in page:
+            orders_by_id[line_item['orderId']]['line_item_names'].append(line_item['name'])
+
+    return {order['name']: {'id': order['id'], 'line_item_names': order['line_item_names']} for order in orders_by_id.values()}
+
+
+async def get_bucket_key(dfp_client: AsyncDfpClient, key_name, key_type='PREDEFINED'):
+    try:
+        key_id = await _get_key_id(dfp_client, key_name)
+    except:
+        key_id = await create_targeting_key(dfp_client, key_name, key_type)
+    return key_id
+
+async def check_bucket_key(dfp_client: AsyncDfpClient, key_name):
+    try:
+        key_id = await _get_key_id(dfp_client, key_name)
+    except:
+        logging.error("Could not find key {} for DFP account {}".format(key_name, dfp_client.network_code))
+        exit(1)
+    return key_id
+
+async def _get_key_id(dfp_client: AsyncDfpClient, key_name):
+    session = get_session()
+    if session and key_name in session.key_ids:
+        return session.key_ids[key_name]
+    cts = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
+    # retrieve key_id
+    stmt_key = "WHERE name = :name"
+    values = [{
+        "key": "name",
+        "value": {
+            "xsi_type": "TextValue",
+            "value": key_name
+        }
+    }
+    ]
+    statement_key = dfp.FilterStatement(stmt_key, values)
+    try:
+        key_id = (await cts.getCustomTargetingKeysByStatement(
+            statement_key.ToStatement()))["results"][0]["id"]
+    except (AttributeError, KeyError, IndexError) as e:
+        raise Exception(
+            "Could not find key {} for DFP account {}. Please create the key in the DFP Account".format(key_name, dfp_client.network_code)
+        )
+    if session:
+        session.key_ids[key_name] = key_id
+    return key_id
+
+async def create_targeting_key(dfp_client: AsyncDfpClient, name, type_='FREEFORM'):
+    cts = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
+    values = [{'displayName': name, 'name': name,
+               'type': type_}]
+    result = await cts.createCustomTargetingKeys(values)
+    key_id = result[0]["id"]
+    session = get_session()
+    if session:
+        session.key_ids[name] = key_id
+    record('keys', [key_id])
+    return key_id
+
+
+async def create_hb_key_values(dfp_client: AsyncDfpClient, values, key_id, key_name, return_all=False):
+    results = await create_key_values(dfp_client, key_id, values, key_name, return_all)
+    return results
+
+async def create_key_values(dfp_client: AsyncDfpClient, key_id, values, key_name, return_all=False):
+    key_values = [{
+        "customTargetingKeyId": key_id,
+        "displayName": "{:.2f}".format(value / 100),
+        "name": "{:.2f}".format(value / 100),
+        "matchType": "EXACT"
+    } for value in values]
+
+    return await check_create_key_values(dfp_client, key_values, key_name, return_all, skip_existing=True)
+
+async def check_create_key_values(dfp_client: AsyncDfpClient, values, key_name, return_all=False, skip_existing=True):
+    existing_values = []
+    key_values = values
+    if skip_existing:
+        existing_values = await get_all_key_values(dfp_client, key_name, only_active=True, fields=KEY_VALUE_FIELDS)
+        existing_key_values_names = {item['name'] for item in existing_values}
+        key_values = [item for item in values if item['name'] not in existing_key_values_names]
+    results = []
+    if key_values:
+        srv = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
+        results = await _create_key_values(dfp_client, key_name, key_values, lambda values: create_batched(dfp_client, 'createCustomTargetingValues', values, srv.createCustomTargetingValues))
+    names = {value['name'] for value in values}
+    record('key_values', [value['id'] for value in results], [value['id'] for value in existing_values if value['name'] in names])
+    if return_all:
+        return results + existing_values
+    return [value for value in results + existing_values if value['name'] in names]
+
+async def _create_key_values(dfp_client: AsyncDfpClient, key_name, key_values, create) -> list:
+    key_id = key_values[0]['customTargetingKeyId']
+    names = [value['name'] for value in key_values]
+    try:
+        results = project(await create(key_values), KEY_VALUE_FIELDS)
+    except Exception as e:
+        # the values may exist anyway, created by a concurrent run or by a request that timed out
+        if not (isinstance(e, httpx.TransportError) or "CustomTargetingError.VALUE_NAME_DUPLICATE" in str(e.args)):
+            logging.error(f'Could not create {len(key_values)} values of key {key_name}: {e}')
+            raise
+        logging.warning(f'Creating {len(key_values)} values of key {key_name} failed ({type(e).__name__}), reading them by name')
+        results = await get_key_value_by_name(dfp_client, key_name, names)
+        missing_names = set(names) - {value['name'] for value in results}
+        if missing_names:
+            logging.error(f'Values {sorted(missing_names)} of key {key_name} were not created')
+            raise e
+    session = get_session()
+    if session:
+        session.add_key_values(key_id, [value for value in results if value['status'] == 'ACTIVE'])
+    return results
+
+async def get_all_key_values(dfp_client: AsyncDfpClient, key_name, only_active=True, fields=None):
+    key_id = await _get_key_id(dfp_client, key_name)
+    cts = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
+
+    stmt_values = "WHERE customTargetingKeyId = :id "
+    if only_active:
+        stmt_values += "AND status = 'ACTIVE'"
+    values = [{
+        "key": "id",
+        "value": {
+            "xsi_type": "NumberValue",
+            "value": key_id
+        }
+    }]
+    statement_values = dfp.FilterStatement(stmt_values, values)
+    return await get_all_results_by_statement(cts.getCustomTargetingValuesByStatement, statement_values, limit=5000, fields=fields)
+
+async def get_key_value_by_name(dfp_client: AsyncDfpClient, key_name, values, chunk_size=500):
+    service = dfp_client.GetService('CustomTargetingService', version=VERSION_NB)
+    key_id = await _get_key_id(dfp_client, key_name)
+    bind_values = [{
+        "key": "id",
+        "value": {
+            "xsi_type": "NumberValue",
+            "value": key_id
+        }
+    }]
+    statements = [
+        dfp.FilterStatement("WHERE customTargetingKeyId = :id AND name IN ({})".format(', '.join(["'{}'".format(value) for value in values[i:i + chunk_size]])), bind_values)
+        for i in range(0, len(values), chunk_size)
+    ]
+    pages = await asyncio.gather(*[get_all_results_by_statement(service.getCustomTargetingValuesByStatement, statement, fields=KEY_VALUE_FIELDS) for statement in statements])
+    return [value for page in pages for value in page]
+
+async def create_targeting_key_values(dfp_client: AsyncDfpClient, key_id: int, key_name: str, key_values):
+    cts = dfp_client.GetService("CustomTargetingService", version=VERSION_NB)
+    existing_values = await get_all_key_values(dfp_client, key_name, only_active=False, fields=KEY_VALUE_FIELDS)
+    existing_value_names = {value['name'] for value in existing_values}
+    values = [
+        {
+            "customTargetingKeyId": key_id,
+            "displayName": name,
+            "name": name,
+            "matchType": "EXACT",
+            "status": "ACTIVE"
+        } for name in dict.fromkeys(key_values) if name not in existing_value_names
+    ]
+    created_values = await _create_key_values(dfp_client, key_name, values, lambda values: create_batched(dfp_client, 'createCustomTargetingValues', values, cts.createCustomTargetingValues)) if values else []
+    record('key_values', [value['id'] for value in created_values], [value['id'] for value in existing_values if value['name'] in key_values])
+    return existing_values + created_values
+
+
+async def get_all_results_by_statement(api_fun, statement, limit=500, fields=None):
+    """
+    Async counterpart of dfp_api.get_all_results_by_statement, pages are read one after another.
+    :param api_fun: the async api service function to be called
+    :param statement: the statement to be used for the function call
+    :param fields: return rows with only these fields instead of zeep objects, see result_rows.py
+    :return: list of all result objects
+    """
+    statement.limit = limit
+    results = []
+    while True:
+        res = await api_fun(statement.ToStatement())
+        if res['totalResultSetSize']:
+            results.extend(project(res['results'], fields) if fields else res['results'])
+            statement.offset = len(results)
+        if statement.offset >= res['totalResultSetSize']:
+            break
+    return results
+
+async def create_batched(dfp_client: AsyncDfpClient, operation: str, items: list, create_batch) -> list:
+    """
+    Async counterpart of batching.AdaptiveBatcher.run, the batches are sent concurrently (bounded by the client's
+    semaphore). A batch that fails because of its size halves the budget and is sent again in smaller batches.
+    :return: results of all batches in the order of the items
+    """
+    batcher = get_batcher(dfp_client.dfp_client, operation)
+
+    async def send(batch: list) -> list:
+        start = time.perf_counter()
+        try:
+            batch_results = await create_batch(batch)
+        except Exception as e:
+            if len(batch) == 1 or not is_batch_size_error(e):
+                raise
+            batcher.shrink(len(batch))
+            logging.warning(f'{operation}: batch of {len(batch)} failed ({type(e).__name__}), sending it again in batches of at most {batcher.item_budget}')
+            return await send_all(batch)
+        archive(operation, batch, batch_results)
+        batcher.observe(len(batch), time.perf_counter() - start)
+        return list(batch_results)
+
+    async def send_all(items: list) -> list:
+        results = await asyncio.gather(*[send(batch) for batch in batcher.split(items)])
+        return [result for batch_results in results for result in batch_results]
+
+    return await send_all(items)
+
+async def create_isolating_failures(operation: str, chunk: list, create_chunk) -> list:
+    """
+    Awaits create_chunk(chunk). While the session isolates failures, a chunk rejected because of its items is bisected
+    and its halves are sent concurrently until the rejected items are found, see batching.AdaptiveBatcher.run.
+    """
+    try:
+        return await create_chunk(chunk)
+    except Exception as e:
+        if not (is_item_error(e) and isolates_failures(operation)):
+            raise
+        if len(chunk) == 1:
+            reject(operation, chunk[0], e)
+            return []
+        logging.warning(f'{operation}: chunk of {len(chunk)} was rejected, bisecting it')
+        halves = await asyncio.gather(
+            create_isolating_failures(operation, chunk[:len(chunk) // 2], create_chunk),
+            create_isolating_failures(operation, chunk[len(chunk) // 2:], create_chunk),
+        )
+        return halves[0] + halves[1]
+
+async def create_line_item_bulk(dfp_client: AsyncDfpClient, line_items):
+    """
+    Creates the line items in batches within the byte and item budget of the client's batcher, all batches are sent
+    concurrently (bounded by the client's semaphore) and adapt the budget like orders and key-values, see create_batched.
+    :return: created and existing line items in the order of the batches
+    """
+    logging.info(f'create_line_item_bulk: {len(line_items)} line items')
+    return await create_batched(dfp_client, 'createLineItems', line_items,
+                                lambda batch: create_isolating_failures('createLineItems', batch, lambda items: check_create_line_items(dfp_client, items)))
+
+async def check_create_line_items(dfp_client: AsyncDfpClient, line_items, skip_existing=True):
+    existing_items = []
+    if skip_existing:
+        existing_items = await get_line_items_by_names(dfp_client, [item['name'] for item in line_items])
+        existing_item_names = {item['name'] for item in existing_items}
+        line_items = [item for item in line_items if item['name'] not in existing_item_names]
+    results = []
+    if line_items:
+        service = dfp_client.GetService('LineItemService', version=VERSION_NB)
+        results = await service.create_line_items(dfp_client.dfp_client, line_items)
+    record('line_items', [line_item['id'] for line_item in results], [line_item['id'] for line_item in existing_items])
+    return results + existing_items
+
+async def get_line_items_by_names(dfp_client: AsyncDfpClient, names):
+    known_line_items, names = _get_indexed('line_items', names, LINE_ITEM_FIELDS)
+    if not names:
+        return known_line_items
+    # only the columns of the existence check instead of whole line items with their targeting, see dfp_api.get_line_items_by_names
+    pql_service = dfp_client.GetService('PublisherQueryLanguageService', version=VERSION_NB)
+    where_clause = "WHERE Name IN ({})".format(', '.join(["'{}'".format(name) for name in names]))
+    async for page in pql.select_pages_async(pql_service, 'Line_Item', LINE_ITEM_FIELDS, where_clause):
+        known_line_items.extend(page)
+    return known_line_items
+
+
+async def create_master_creative_and_get_id(dfp_client: AsyncDfpClient, creative_name, snippet, advertiser_id, size=(1, 1)):
+    creative_id = await get_creatives_by_names(dfp_client, [creative_name])
+    if len(creative_id) > 0:
+        record('creatives', [], [creative_id[0]['id']])
+        return creative_id[0]['id']
+    creative_size = {"width": size[0], "height": size[1]}
+    creative_id = (await create_third_party_creative(dfp_client, creative_name, creative_size, snippet, advertiser_id))['id']
+    record('creatives', [creative_id])
+    return creative_id
+
+async def get_creatives_by_names(dfp_client: AsyncDfpClient, creative_names):
+    known_creatives, creative_names = _get_indexed('creatives', creative_names, ID_NAME)
+    if not creative_names:
+        return known_creatives
+    creative_service = dfp_client.GetService('CreativeService', version=VERSION_NB)
+
+    keys = ['key' + str(idx) for idx in range(len(creative_names))]
+    stmt_values = "WHERE name IN ({})".format(', '.join([':' + key for key in keys]))
+    values = [
+        {
+            "key": keys[idx],
+            "value": {
+                "xsi_type": "TextValue",
+                "value": val
+            }
+        } for idx, val in enumerate(creative_names)
+    ]
+    statement_values = dfp.FilterStatement(stmt_values, values)
+
+    return known_creatives + await get_all_results_by_statement(creative_service.getCreativesByStatement, statement_values)
+
+async def create_third_party_creative(dfp_client: AsyncDfpClient, name, size, snippet, advertiser_id, safe_frame=False):
+    creatives = [{
+        'xsi_type': 'ThirdPartyCreative',
+        'name': name,
+        'advertiserId': advertiser_id,
+        'size': size,
+        'snippet': snippet,
+        'lockedOrientation': 'FREE_ORIENTATION',
+        'isSafeFrameCompatible': safe_frame
+    }]
+    creative_service = dfp_client.GetService('CreativeService', version=VERSION_NB)
+    res = await creative_service.createCreatives(creatives)
+    session = get_session()
+    if session:
+        session.creatives[name] = project(res, ID_NAME)[0]
+    return res[0]
+
+async def get_creative_set_by_name(dfp_client: AsyncDfpClient, creative_set_name):
+    session = get_session()
+    if session and creative_set_name in session.creative_sets:
+        return session.creative_sets[creative_set_name]
+    creative_set_service = dfp_client.GetService('CreativeSetService', version=VERSION_NB)
+    values = [{"key": "name", "value": {"xsi_type": "TextValue", "value": creative_set_name}}]
+    statement = dfp.FilterStatement("WHERE name = :name", values)
+    creative_sets = await get_all_results_by_statement(creative_set_service.getCreativeSetsByStatement, statement, fields=ID_NAME)
+    if not creative_sets:
+        return None
+    if session:
+        session.creative_sets[creative_set_name] = creative_sets[0]
+    return creative_sets[0]
+
+async def create_creative_set(dfp_client: AsyncDfpClient, creative_set_name, master_creative_id, companion_creative_ids):
+    creative_set = await get_creative_set_by_name(dfp_client, creative_set_name)
+    if creative_set:
+        record('creative_sets', [], [creative_set['id']])
+        return creative_set
+    creative_set_json = {
+        'name': creative_set_name,
+        'masterCreativeId': master_creative_id,
+        'companionCreativeIds': companion_creative_ids
+    }
+    creative_set_service = dfp_client.GetService('CreativeSetService', version=VERSION_NB)
+    creative_set = await creative_set_service.createCreativeSet(creative_set_json)
+    session = get_session()
+    if session:
+        session.creative_sets[creative_set_name] = project([creative_set], ID_NAME)[0]
+    record('creative_sets', [creative_set['id']])
+    return creative_set
+
+
+async def create_licas_buckets_creative_set(dfp_client: AsyncDfpClient, creative_set_id, master_creative_id, li_ids):
+    licas = [{"creativeSetId": creative_set_id, 'creativeId': master_creative_id, "lineItemId": li_id}
+             for li_id in li_ids]
+    return await create_batched(dfp_client, 'createLineItemCreativeAssociations', licas,
+                                lambda batch: create_isolating_failures('createLineItemCreativeAssociations', batch, lambda items: check_create_licas_creative_set(dfp_client, items)))
+
+async def check_create_licas_creative_set(dfp_client: AsyncDfpClient, licas, skip_existing=True):
+    existing_licas = []
+    if skip_existing:
+        existing_licas = await get_licas_creative_set(dfp_client, [(item['lineItemId'], item['creativeSetId'], item['creativeId']) for item in licas])
+        existing_lica_id_tuples = {(item['lineItemId'], item['creativeId']) for item in existing_licas}
+        licas = [item for item in licas if (item['lineItemId'], item['creativeId']) not in existing_lica_id_tuples]
+
+    licas = [{'lineItemId': item['lineItemId'], 'creativeSetId': item['creativeSetId']} for item in licas]
+    results = []
+    if licas:
+        srv = dfp_client.GetService('LineItemCreativeAssociationService', version=VERSION_NB)
+        results = await srv.createLineItemCreativeAssociations(licas)
+    record('licas', [lica['lineItemId'] for lica in results], [lica['lineItemId'] for lica in existing_licas])
+    return results + existing_licas
+
+async def get_licas_creative_set(dfp_client: AsyncDfpClient, lica_id_tuples):
+    service = dfp_client.GetService('LineItemCreativeAssociationService', version=VERSION_NB)
+    query = 'WHERE ' + ' OR '.join(['(lineItemId={li_id} AND creativeId={cr_id})'.format(li_id=tup[0], cr_id=tup[2])
+                                    for tup in lica_id_tuples])
+    statement = dfp.FilterStatement(query)
+    return await get_all_results_by_statement(service.getLineItemCreativeAssociationsByStatement, statement)
@@ -1,29 +1,91 @@
+import datetime
+import logging
+from contextlib import nullcontext
+
 from attr import validate
 from validation_helper import *
 from argparse import ArgumentParser
 from bucket import Buckets
+from bucket_async import AsyncBuckets
+from profiling import RunProfiler
 
 def main():
 
     args = vars(parse_cli_args())
     print(args)
 
+    validate_args(args)
+
+    print("adunits after validation: ", args['target_ad_units'])
+
+    # call Adserver API to create line items
+    bucket = create_bucket(args)
+
+    if args['profile']:
+        # e.g. profiles/wallpaper_20250101-120000/cpu.folded & allocations.txt
+        bucket.profiler = RunProfiler(f"{args['profile_dir']}/{args['format']}_{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}")
+
+    with bucket.profiler.profile() if bucket.profiler else nullcontext():
+        result = run_bucket(bucket, args)
+
+    if args['verify'] and not result.get('clean', True):
+        exit(1)
+    if args['preflight'] and result.get('violations'):
+        exit(1)
+    if args['isolate_failures'] and result and result.get('rejected'):
+        exit(1)
+
+
+def validate_args(args: dict):
     # validate combined args
     validate_start_and_end_time(args['start_time'], args['end_time'])
-    validate_price_bucket(args['start_price_bucket'], args['end_price_bucket'], args['price_bucket_step'])
+    validate_price_buckets_or_granularity(args['start_price_bucket'], args['end_price_bucket'], args['price_bucket_step'], args['price_granularity'])
     validate_format(args['format'], args['master_size'], args['companion_sizes'])
+    validate_run_modes(args)
+    if args['prune_delivery']:
+        validate_report_date_range(args['delivery_start_date'], args['delivery_end_date'])
 
-    print("adunits after validation: ", args['target_ad_units'])
 
-    # call Adserver API to create line items
-    bucket = Buckets(args) 
-    if args['write']:
-        bucket.actual_run()
-    else:
-        bucket.dry_run()
+def create_bucket(args: dict) -> Buckets:
+    return AsyncBuckets(args) if args['concurrency'] > 1 else Buckets(args)
+
+
+def run_bucket(bucket: Buckets, args: dict):
+    # lookups by name are memoized for the run (see session.py), payloads are archived with --payload-archive
+    with bucket.session.activate(), bucket.payload_sink():
+        bucket.session.prefix_scan = bucket.prefix_scan
+        # merged line items of --prune-delivery replace the archived ones, they must not be skipped
+        bucket.session.isolate_failures = bool(args.get('isolate_failures')) and not args['prune_delivery']
+        if args['preflight']:
+            return bucket.preflight_run(args['network_limits'])
+        if args['verify']:
+            return bucket.verify_run(use_manifest=not args['verify_all'])
+        if args['write'] and not args['prune_delivery'] and bucket.preflight_run(args['network_limits'])['violations']:
+            # the setup would fail in google admanager, fail before anything is written
+            logging.error('Preflight failed, nothing was written. See --preflight')
+            raise ValueError
+        # runs that write hold the lease of their network and format, see locking.py
+        with bucket.lease(bucket.format) if args['write'] else nullcontext():
+            if args['prune_delivery']:
+                return bucket.prune_run(args['delivery_start_date'], args['delivery_end_date'], args['min_impressions'], args['max_archived_line_items'])
+            if args['write'] and args['extend']:
+                bucket.extend_run()
+            elif args['write']:
+                bucket.actual_run()
+            else:
+                bucket.dry_run()
+        if bucket.session.isolate_failures and args['write']:
+            return bucket.rejection_report()
+
 
+def parse_cli_args(argv: list[str] = None):
 
-def parse_cli_args():
+    args = create_parser().parse_args(argv)
+
+    return args
+
+
+def create_parser() -> ArgumentParser:
 
     parser = ArgumentParser(
         prog='Prebid Line Item Creator',
@@ -41,7 +103,7 @@ def parse_cli_args():
                         help='Line item type, set line item priority seperately via --line-item-priority') 
 
     parser.add_argument('--line-item-priority', required=True, type=validate_line_item_priority, 
-                        help='Line item priority (0-14)') 
+                        help=f'Line item priority ({MIN_LINE_ITEM_PRIORITY}-{MAX_LINE_ITEM_PRIORITY})') 
 
     parser.add_argument('--master-size', required=True, type=validate_single_size, 
                         help='Creative size (e.g. 728x90)')
@@ -49,14 +111,26 @@ def parse_cli_args():
     parser.add_argument('--companion-sizes', required=True, type=validate_multiple_sizes, 
                         help='Companion sizes (e.g. 120x600 or for multiple sizes comma-separated: "120x600, 200x600")')
 
-    parser.add_argument('--start-price-bucket', required=True, type=int, 
-                        help='Start price bucket in cents (e.g. 500 for 5.00€)')
+    parser.add_argument('--start-price-bucket', type=int, 
+                        help='Start price bucket in cents (e.g. 500 for 5.00€), required unless --price-granularity is given')
+
+    parser.add_argument('--end-price-bucket', type=int, 
+                        help='End price bucket in cents (e.g. 1000 for 10.00€), required unless --price-granularity is given')
+
+    parser.add_argument('--price-bucket-step', type=int,
+                        help='Price bucket step in cents (e.g. 25 for 0.25€), required unless --price-granularity is given')
+
+    parser.add_argument('--price-granularity', type=validate_price_granularity,
+                        help='Prebid price granularity, either a preset (low, medium, high, auto, dense) or comma-separated ranges in cents (e.g. "1-300:1, 300-800:5, 800-2000:50"); replaces start/end/step')
 
-    parser.add_argument('--end-price-bucket', required=True, type=int, 
-                        help='End price bucket in cents (e.g. 1000 for 10.00€)')
+    parser.add_argument('--price-buckets-per-line-item', type=validate_price_buckets_per_line_item, default=1,
+                        help='Amount of consecutive price-bucket values targeted by one line item (e.g. 5 creates a fifth of the line items), defaults to 1')
 
-    parser.add_argument('--price-bucket-step', required=True, type=int,
-                        help='Price bucket step in cents (e.g. 25 for 0.25€)')
+    parser.add_argument('--line-item-cpm', type=str, choices=['min', 'mid', 'max'], default='min',
+                        help='CPM of a line item targeting several price buckets: lowest (min), middle (mid) or highest (max) of its price buckets')
+
+    parser.add_argument('--max-line-item-price-spread', type=validate_max_line_item_price_spread, default=0,
+                        help='Max difference in cents between the lowest and highest price bucket of one line item (e.g. 50 for 0.50€), defaults to no limit')
 
     parser.add_argument('--advertiser-id', required=True, type=validate_advertiser_id, 
                         help='Advertiser ID')
@@ -71,7 +145,10 @@ def parse_cli_args():
                         help='Name of hb_adid parameter for master-creative. Defaults to hb_adid')
     
     parser.add_argument('--target-ad-units', type=validate_target_ad_units,
-                        help='Target ad units, give as comma-separated string, e.g. "adunit1, adunit2", if not specified, all ad units will be targeted')
+                        help='Target ad units as comma-separated ids, paths or names, e.g. "21812345678, sports/football, news/*" (news/* targets all ad units below news), if not specified, all ad units will be targeted')
+
+    parser.add_argument('--refresh-ad-unit-cache', action='store_true',
+                        help='Refetch the ad unit tree of the network instead of using the local cache in .cache/ (refreshed daily)')
 
     parser.add_argument('--currency', type=str, choices=['EUR', 'GDP', 'USD'], default='EUR', 
                         help='Currency for price buckets')
@@ -82,12 +159,103 @@ def parse_cli_args():
     parser.add_argument('--end-time', type=validate_end_date, default='unlimited', 
                         help='End time (YYYY-MM-DD HH:MM:SS)')
 
+    parser.add_argument('--concurrency', type=validate_concurrency, default=1,
+                        help='Amount of concurrent requests to google admanager (1-64), values above 1 run the setup on asyncio. Defaults to 1')
+
+    parser.add_argument('--http-pool-size', type=validate_concurrency,
+                        help='Max. keep-alive connections to google admanager shared by all services, defaults to --concurrency, at least 4 for parallel page reads')
+
+    parser.add_argument('--connect-timeout', type=validate_timeout, default=10,
+                        help='Connect timeout in seconds for requests to google admanager. Defaults to 10')
+
+    parser.add_argument('--read-timeout', type=validate_timeout, default=300,
+                        help='Read timeout in seconds for requests to google admanager. Defaults to 300')
+
+    parser.add_argument('--no-response-compression', action='store_true',
+                        help='Disable gzip compression of responses from google admanager')
+
+    parser.add_argument('--compress-requests', action='store_true',
+                        help='Send gzip compressed requests to google admanager')
+
+    parser.add_argument('--no-soap-templates', action='store_true',
+                        help='Serialize every line item with zeep instead of splicing it into a pre-serialized request')
+
+    parser.add_argument('--proxy', type=str, default='',
+                        help='Proxy for requests to google admanager (e.g. http://proxy:3128)')
+
+    parser.add_argument('--max-batch-items', type=validate_max_batch_items, default=200,
+                        help='Max. items per create call (1-1000), the batch size adapts below it to errors and latencies. Defaults to 200')
+
+    parser.add_argument('--max-request-kib', type=validate_max_request_kib, default=1024,
+                        help='Max. estimated size of one create call in KiB, e.g. for line items targeting many ad units. Defaults to 1024')
+
+    # the run modes return different reports, a run does one of them
+    run_modes = parser.add_mutually_exclusive_group()
+
+    run_modes.add_argument('--extend', action='store_true',
+                        help='Only create the price buckets missing in the existing ladder of the format, e.g. to add 10.25-20.00 to an existing 5.00-10.00. Runs sequentially')
+
+    parser.add_argument('--prefix-scan', action='store_true',
+                        help='Read all orders, line items and creatives named stroeer_ssp_<format>_* in one paged scan per type and check their existence against it, instead of name IN (...) reads per batch')
+
+    parser.add_argument('--isolate-failures', action='store_true',
+                        help='Bisect line item and LICA batches that google admanager rejects to find the invalid items, create the rest and report the rejected items with their error paths (exits with 1 if any were rejected)')
+
+    parser.add_argument('--lease-backend', type=str, default='file',
+                        help='Leases of write runs per network and format: file (in .locks/), none, or module:ClassName of a custom locking.LeaseBackend. Defaults to file')
+
+    parser.add_argument('--lease-wait', type=validate_lease_wait, default=0,
+                        help='Seconds to wait for a run on the same network and format to finish, 0 fails right away. Defaults to 0')
+
+    run_modes.add_argument('--verify', action='store_true',
+                        help='Compare the managed line items of the format in google admanager with this setup and report drifted, missing and extra line items (read only, exits with 1 on drift)')
+
+    parser.add_argument('--verify-all', action='store_true',
+                        help='With --verify, also verify orders that are unchanged since the last verification (see .cache/verify_*.json)')
+
+    run_modes.add_argument('--prune-delivery', action='store_true',
+                        help='Recommend merging and archiving low-delivery line items of the ladder from a delivery report, applies the recommendation with --write')
+
+    parser.add_argument('--delivery-start-date', type=validate_report_date, default=datetime.date.today() - datetime.timedelta(days=30),
+                        help='First day of the delivery report of --prune-delivery (YYYY-MM-DD). Defaults to 30 days ago')
+
+    parser.add_argument('--delivery-end-date', type=validate_report_date, default=datetime.date.today() - datetime.timedelta(days=1),
+                        help='Last day of the delivery report of --prune-delivery (YYYY-MM-DD). Defaults to yesterday')
+
+    parser.add_argument('--min-impressions', type=validate_min_impressions, default=100,
+                        help='With --prune-delivery, line items below this amount of impressions are merged with their neighbours or archived. Defaults to 100')
+
+    parser.add_argument('--max-archived-line-items', type=validate_max_archived_line_items, default=0,
+                        help='With --prune-delivery, archive at most this many line items from the top of the ladder that had no delivery above the highest delivering one. Defaults to 0, nothing is archived')
+
+    run_modes.add_argument('--preflight', action='store_true',
+                        help='Check the setup against the limits of google admanager and estimate its api calls, bytes and duration for --concurrency, without any calls to google admanager (exits with 1 on violations). Write runs do this first')
+
+    parser.add_argument('--network-limits', type=str,
+                        help='Json file with overrides of the network limits and call latencies of --preflight (see preflight.NETWORK_LIMITS and CALL_SECONDS)')
+
+    parser.add_argument('--profile', action='store_true',
+                        help='Profile cpu (sampled, flamegraph-compatible folded stacks) and memory (top allocations) per stage of the run')
+
+    parser.add_argument('--profile-dir', type=str, default='profiles',
+                        help='Directory for the profiles of --profile. Defaults to profiles/')
+
+    parser.add_argument('--payload-archive', type=str,
+                        help='Gzip json lines file to archive the payloads of the create calls in, e.g. payloads.jsonl.gz. The log only shows their counts and ids')
+
+    parser.add_argument('--payload-max-mib', type=validate_payload_max_mib, default=100,
+                        help='Compressed size in MiB at which --payload-archive stops archiving. Defaults to 100')
+
+    parser.add_argument('--payload-sample-rate', type=validate_payload_sample_rate, default=1.0,
+                        help='Share of the payloads archived by --payload-archive, e.g. 0.1 for every tenth. Defaults to 1 (all)')
+
+    parser.add_argument('--googleads-path', type=str, default='googleads.yaml',
+                        help='Path of the googleads credentials. Defaults to googleads.yaml')
+
     parser.add_argument('--write', type=bool, default=False,
                         help='write to google admanager | only use when you are sure everything is configured correctly') # if true performs creation inside gam
 
-    args = parser.parse_args()
-
-    return args
+    return parser
 
 
 if __name__ == "__main__":
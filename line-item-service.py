@@ -0,0 +1,277 @@
+import json
+import logging
+import threading
+import time
+import traceback
+import uuid
+from argparse import ArgumentParser
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import dfp_api
+from line_item_api import JobConfig, JobProgress, run_job
+from session import GamSession
+from transport import TransportSettings
+from validation_helper import validate_concurrency
+
+# long-running service mode: runs line-item-creator jobs from a local HTTP/JSON API and keeps authenticated clients,
+# service proxies, ad unit indexes and the name to id lookups of each network (see session.py) warm between jobs
+#
+# python line-item-service.py --port 8080 --max-jobs 2
+#
+# POST /jobs        job spec with the cli options as keys (dashes or underscores) and values as on the command line:
+#                   {"dfp_id": "1234", "format": "wallpaper", "master_size": "728x90", ..., "write": true}
+#                   -> 202 {"id": "...", "status": "queued"} or 400 {"error": "..."}
+# GET  /jobs        all jobs without their logs
+# GET  /jobs/<id>   status, current stage, finished stages with durations, log tail and error of one job
+# GET  /health
+
+JOB_LOG_LINES = 200 # log lines kept per job
+MAX_FINISHED_JOBS = 1000 # finished jobs kept in memory, the oldest ones are dropped first
+SESSION_TTL = 600 # seconds the lookups of a network are shared by its jobs, changes made outside of the service show up after it
+
+
+class Job():
+
+    def __init__(self, spec: dict, args: dict):
+        self.id = uuid.uuid4().hex
+        self.spec = spec
+        self.args = args
+        self.status = 'queued' # queued, running, succeeded, failed
+        self.error = ''
+        self.result = None # e.g. the report of --verify
+        self.created: dict[str, list] = {} # ids by kind, see line_item_api.RunResult
+        self.skipped: dict[str, list] = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = JobProgress()
+        self.log: deque[str] = deque(maxlen=JOB_LOG_LINES)
+
+    def to_dict(self, with_log: bool = False) -> dict:
+        job = {
+            'id': self.id,
+            'status': self.status,
+            'network_code': str(self.args['dfp_id']),
+            'format': self.args['format'],
+            'write': bool(self.args['write']),
+            'stage': self.progress.current_stage,
+            'stages': self.progress.stages,
+            'error': self.error,
+            'result': self.result,
+            'created': {kind: len(ids) for kind, ids in self.created.items()},
+            'skipped': {kind: len(ids) for kind, ids in self.skipped.items()},
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if with_log:
+            job['spec'] = self.spec
+            job['created'] = self.created
+            job['skipped'] = self.skipped
+            job['log'] = list(self.log)
+        return job
+
+
+class JobLogHandler(logging.Handler):
+    """
+    Copies the log records of a job's worker thread into the job's log.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.jobs_by_thread: dict[int, Job] = {}
+        self.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+
+    def emit(self, record):
+        job = self.jobs_by_thread.get(record.thread)
+        if job:
+            job.log.append(self.format(record))
+
+
+def parse_job_spec(spec: dict) -> dict:
+    args = JobConfig.from_spec(spec).to_args()
+    if args['profile']:
+        raise ValueError('--profile is not supported in service mode, the profiler samples all jobs of the process')
+    return args
+
+
+class JobRunner():
+    """
+    Queues jobs and runs them on `max_jobs` worker threads with one warm client and one lookup session per network.
+    Jobs on the same network and format create the same entities, they run one after another: a worker takes the
+    oldest queued job whose network and format isn't running, so one busy ladder doesn't hold up the other jobs.
+    """
+
+    def __init__(self, max_jobs: int, googleads_path: str):
+        self.googleads_path = googleads_path
+        self.jobs: dict[str, Job] = {}
+        self.pending: list[Job] = []
+        self.running_keys: set[tuple[str, str]] = set()
+        self.condition = threading.Condition()
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        self.sessions: dict[str, tuple[GamSession, float]] = {} # network code -> session and its creation time
+        self.log_handler = JobLogHandler()
+        logging.getLogger().addHandler(self.log_handler)
+
+        for index in range(max_jobs):
+            threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True).start()
+
+    def submit(self, spec: dict) -> Job:
+        job = Job(spec, parse_job_spec(spec))
+        self._drop_finished_jobs()
+        self.jobs[job.id] = job
+        with self.condition:
+            self.pending.append(job)
+            self.condition.notify()
+        logging.info(f"Queued job {job.id} for {job.args['format']} on network {job.args['dfp_id']}")
+        return job
+
+    def _drop_finished_jobs(self):
+        finished_jobs = [job for job in self.jobs.values() if job.finished_at]
+        for job in sorted(finished_jobs, key=lambda job: job.finished_at)[:max(len(finished_jobs) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job.id]
+
+    def get_client(self, args: dict):
+        """
+        Returns the warm client of the job's network and transport settings, the client caches its service proxies.
+        """
+        transport_settings = TransportSettings.from_args(args)
+        key = (str(args['dfp_id']), tuple(sorted(vars(transport_settings).items())))
+        with self.clients_lock:
+            if key not in self.clients:
+                dfp_client = dfp_api.get_dfp_client_for_account(self.googleads_path, transport_settings)
+                # one set of credentials can serve several networks
+                dfp_client.network_code = str(args['dfp_id'])
+                self.clients[key] = dfp_client
+            return self.clients[key]
+
+    def get_session(self, args: dict) -> GamSession:
+        """
+        Returns a session of the job that shares the lookups of earlier jobs of its network for SESSION_TTL seconds.
+        Jobs of the same network and another format run at the same time, the shared key-values are only created
+        under the network lease (see Buckets.lease).
+        """
+        network_code = str(args['dfp_id'])
+        with self.clients_lock:
+            session, created_at = self.sessions.get(network_code, (None, 0))
+            if session is None or time.time() - created_at > SESSION_TTL:
+                session, created_at = GamSession(), time.time()
+                self.sessions[network_code] = (session, created_at)
+            return session.fork()
+
+    def invalidate_session(self, args: dict):
+        # e.g. after a failed job, which might have failed because of an entity changed outside of the service
+        with self.clients_lock:
+            self.sessions.pop(str(args['dfp_id']), None)
+
+    @staticmethod
+    def _run_key(job: Job) -> tuple[str, str]:
+        return str(job.args['dfp_id']), job.args['format']
+
+    def _next_job(self) -> Job:
+        with self.condition:
+            while True:
+                for job in self.pending:
+                    if self._run_key(job) not in self.running_keys:
+                        self.pending.remove(job)
+                        self.running_keys.add(self._run_key(job))
+                        return job
+                self.condition.wait()
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                self._run(job)
+            finally:
+                with self.condition:
+                    self.running_keys.discard(self._run_key(job))
+                    self.condition.notify_all()
+
+    def _run(self, job: Job):
+        job.status = 'running'
+        job.started_at = time.time()
+        self.log_handler.jobs_by_thread[threading.get_ident()] = job
+        try:
+            result = run_job(JobConfig.from_args(job.args), dfp_client=self.get_client(job.args), session=self.get_session(job.args), progress=job.progress)
+            job.result = result.report
+            job.created = result.created
+            job.skipped = result.skipped
+            job.status = 'succeeded'
+        except (Exception, SystemExit) as e:
+            # validations and ad unit resolution exit on errors, that must only end the job
+            logging.error(traceback.format_exc())
+            self.invalidate_session(job.args)
+            job.status = 'failed'
+            job.error = str(e) or type(e).__name__
+        finally:
+            job.finished_at = time.time()
+            del self.log_handler.jobs_by_thread[threading.get_ident()]
+        logging.info(f'Job {job.id} {job.status} after {job.finished_at - job.started_at:.1f}s')
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+
+    runner: JobRunner = None
+
+    def send_json(self, status: int, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path == '/health':
+            statuses = [job.status for job in self.runner.jobs.values()]
+            self.send_json(200, {'status': 'ok', 'jobs': {status: statuses.count(status) for status in set(statuses)}})
+        elif path == '/jobs':
+            self.send_json(200, [job.to_dict() for job in list(self.runner.jobs.values())])
+        elif path.startswith('/jobs/') and path[len('/jobs/'):] in self.runner.jobs:
+            self.send_json(200, self.runner.jobs[path[len('/jobs/'):]].to_dict(with_log=True))
+        else:
+            self.send_json(404, {'error': f'not found: {self.path}'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': f'not found: {self.path}'})
+            return
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'null')
+            job = self.runner.submit(spec)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(202, {'id': job.id, 'status': job.status})
+
+    def log_message(self, format, *args):
+        logging.debug(f'{self.address_string()} {format % args}')
+
+
+def main():
+    parser = ArgumentParser(prog='Prebid Line Item Service', description='Runs line-item-creator jobs from a local HTTP/JSON API with warm clients and caches.')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Interface to listen on. Defaults to 127.0.0.1, the API has no authentication')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='Port to listen on. Defaults to 8080')
+    parser.add_argument('--max-jobs', type=validate_concurrency, default=2,
+                        help='Amount of jobs running at the same time (1-64). Defaults to 2')
+    parser.add_argument('--googleads-path', type=str, default='googleads.yaml',
+                        help='Path of the googleads credentials, the network code is taken from each job. Defaults to googleads.yaml')
+    args = parser.parse_args()
+
+    JobRequestHandler.runner = JobRunner(args.max_jobs, args.googleads_path)
+    server = ThreadingHTTPServer((args.host, args.port), JobRequestHandler)
+    logging.info(f'Line item service listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
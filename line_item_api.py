@@ -0,0 +1,223 @@
+import datetime
+import importlib
+import time
+from contextlib import contextmanager
+
+from session import GamSession
+
+# embeddable python api of the line item creator
+# runs a setup in-process with a typed config, an injected client (e.g. one warm client for many jobs) and an optional
+# session, and returns the created and skipped ids and the stage timings instead of only logging them
+#
+# config = JobConfig(dfp_id=1234, format='wallpaper', line_item_type='price_priority', line_item_priority=12,
+#                    master_size=[728, 90], companion_sizes=[[160, 600]], advertiser_id=1, trafficker_id=2,
+#                    start_price_bucket=1, end_price_bucket=2000, price_bucket_step=1, write=True)
+# result = run_job(config, dfp_client=client)
+# result.created['line_items'], result.timings
+
+# the cli script can't be imported by name because of the dashes, its parser and run functions are shared
+line_item_creator = importlib.import_module('line-item-creator')
+
+
+class JobProgress():
+    """
+    Records the stages of a job, it's set as profiler of the job's Buckets (see profiling.profile_stage).
+    """
+
+    def __init__(self):
+        self.current_stage = ''
+        self.stages: list[dict] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        previous_stage = self.current_stage
+        self.current_stage = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({'name': name, 'seconds': round(time.perf_counter() - start, 3)})
+            self.current_stage = previous_stage
+
+
+def spec_to_argv(parser, spec: dict) -> list[str]:
+    """
+    Converts a job spec to command line arguments, so jobs are validated exactly like cli runs.
+    """
+    options = {action.dest: action for action in parser._actions if action.option_strings}
+    argv = []
+    for key, value in spec.items():
+        action = options.get(key.replace('-', '_'))
+        if action is None or action.dest == 'help':
+            raise ValueError(f'unknown option {key}')
+        if value is None or value is False:
+            continue
+        flag = action.option_strings[0]
+        if action.nargs == 0: # switches like --extend
+            argv.append(flag)
+        elif isinstance(value, list):
+            argv.extend([flag, ', '.join(str(item) for item in value)])
+        else:
+            argv.extend([flag, str(value)])
+    return argv
+
+
+class JobConfig():
+    """
+    Typed setup of one run, the attributes are the options of line-item-creator.py with their parsed types.
+    A config from keyword arguments is taken as it is, from_spec validates cli-style values like the cli does.
+    """
+
+    dfp_id: int = 0
+    format: str = '' # e.g. wallpaper, fireplace
+    line_item_type: str = '' # with underscores, e.g. price_priority
+    line_item_priority: int = 0
+    master_size: list[int] = [] # [width, height]
+    companion_sizes: list[list[int]] = []
+    start_price_bucket: int = None # in cents, unless price_granularity is given
+    end_price_bucket: int = None
+    price_bucket_step: int = None
+    price_granularity: list[tuple[int, int, int]] = None # (start, end, step) ranges in cents, see price_granularity.py
+    price_buckets_per_line_item: int = 1
+    line_item_cpm: str = 'min' # min, mid or max
+    max_line_item_price_spread: int = 0
+    advertiser_id: int = 0
+    trafficker_id: int = 0
+    price_bucket_key_value_name: str = 'stroeer_ssp_hb_pb'
+    hb_adid_parameter: str = 'hb_adid'
+    target_ad_units: list[str] = None # ids, paths or names, defaults to the root ad unit
+    refresh_ad_unit_cache: bool = False
+    currency: str = 'EUR'
+    start_time: str = 'immediately'
+    end_time: str = 'unlimited'
+    concurrency: int = 1
+    http_pool_size: int = None
+    connect_timeout: float = 10
+    read_timeout: float = 300
+    no_response_compression: bool = False
+    compress_requests: bool = False
+    no_soap_templates: bool = False
+    proxy: str = ''
+    max_batch_items: int = 200
+    max_request_kib: int = 1024
+    extend: bool = False
+    prefix_scan: bool = False
+    isolate_failures: bool = False
+    lease_backend: str = 'file'
+    lease_wait: float = 0
+    verify: bool = False
+    verify_all: bool = False
+    prune_delivery: bool = False
+    delivery_start_date: datetime.date = None # defaults to 30 days ago
+    delivery_end_date: datetime.date = None # defaults to yesterday
+    min_impressions: int = 100
+    max_archived_line_items: int = 0 # undelivered line items at the top of the ladder that --prune-delivery may archive
+    preflight: bool = False
+    network_limits: str = None
+    profile: bool = False
+    profile_dir: str = 'profiles'
+    payload_archive: str = None # gzip json lines file, see payload_sink.py
+    payload_max_mib: int = 100
+    payload_sample_rate: float = 1.0
+    googleads_path: str = 'googleads.yaml' # credentials, only used without an injected client
+    write: bool = False
+
+    def __init__(self, **options):
+        for name, value in options.items():
+            if name not in JobConfig.__annotations__:
+                raise ValueError(f'unknown option {name}')
+            setattr(self, name, value)
+
+    @classmethod
+    def from_args(cls, args: dict) -> 'JobConfig':
+        return cls(**{name: value for name, value in args.items() if name in JobConfig.__annotations__})
+
+    @classmethod
+    def from_spec(cls, spec: dict) -> 'JobConfig':
+        """
+        Parses and validates a job spec with the cli options as keys (dashes or underscores) and values as on the
+        command line, e.g. {"dfp_id": "1234", "master_size": "728x90", "write": true}.
+        """
+        if not isinstance(spec, dict):
+            raise ValueError('job spec must be a json object')
+
+        def raise_error(message):
+            raise ValueError(message)
+
+        parser = line_item_creator.create_parser()
+        # argparse exits on invalid arguments, a job spec must only be rejected
+        parser.error = raise_error
+        try:
+            args = vars(parser.parse_args(spec_to_argv(parser, spec)))
+            line_item_creator.validate_args(args)
+        except (ValueError, TypeError, SystemExit) as e:
+            # the validators log their message and raise without one
+            raise ValueError(f"invalid job spec: {str(e) or 'see the log for details'}")
+        return cls.from_args(args)
+
+    def to_args(self) -> dict:
+        """
+        Returns the args dict of Buckets and line_item_creator.run_bucket.
+        """
+        args = {name: getattr(self, name) for name in JobConfig.__annotations__}
+        today = datetime.date.today()
+        args['delivery_start_date'] = args['delivery_start_date'] or today - datetime.timedelta(days=30)
+        args['delivery_end_date'] = args['delivery_end_date'] or today - datetime.timedelta(days=1)
+        return args
+
+    def validate(self):
+        """
+        Validates the combined options like the cli, raises ValueError.
+        """
+        for name in ['dfp_id', 'format', 'line_item_type', 'master_size', 'companion_sizes', 'advertiser_id', 'trafficker_id']:
+            if not getattr(self, name):
+                raise ValueError(f'{name} is required')
+        line_item_creator.validate_args(self.to_args())
+
+
+class RunResult():
+    """
+    Outcome of one run: ids of the created and the already existing (skipped) entities by kind (keys, key_values,
+    orders, line_items, creatives, creative_sets, licas by line item id), the stage timings and the report of
+    --verify, --prune-delivery, --preflight and --isolate-failures runs.
+    """
+
+    def __init__(self, created: dict[str, list], skipped: dict[str, list], timings: list[dict], seconds: float, report: dict = None):
+        self.created = created
+        self.skipped = skipped
+        self.timings = timings
+        self.seconds = seconds
+        self.report = report
+
+    def to_dict(self) -> dict:
+        return {'created': self.created, 'skipped': self.skipped, 'timings': self.timings, 'seconds': self.seconds, 'report': self.report}
+
+
+def run_job(config: JobConfig, dfp_client=None, session: GamSession = None, progress=None) -> RunResult:
+    """
+    Runs one setup in-process.
+    :param config: see JobConfig
+    :param dfp_client: client of the config's network (e.g. dfp_api.get_dfp_client_for_account), loaded from
+        googleads.yaml in the working directory if not given
+    :param session: memo of names to ids, a session passed to several jobs of the same network shares their lookups
+        (see session.py). Entities changed outside of these jobs aren't seen.
+    :param progress: recorder of the stages, e.g. a JobProgress or profiling.RunProfiler
+    :return: see RunResult, created and skipped ids are the ones of this job even with a shared session
+    """
+    args = config.to_args()
+    bucket = line_item_creator.create_bucket(args)
+    bucket.dfp_client = dfp_client
+    if session is not None:
+        # the job shares the lookups of the session, its recorded ids and rejected items are its own
+        bucket.session = session.fork()
+    bucket.profiler = progress or JobProgress()
+
+    start = time.perf_counter()
+    report = line_item_creator.run_bucket(bucket, args)
+    return RunResult(
+        created=bucket.session.created,
+        skipped=bucket.session.skipped,
+        timings=list(getattr(bucket.profiler, 'stages', [])),
+        seconds=round(time.perf_counter() - start, 3),
+        report=report,
+    )
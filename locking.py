@@ -0,0 +1,245 @@
+import fcntl
+import importlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from session import get_session
+
+# leases for runs that write to google admanager
+# the check_create_* functions look up names and then create what's missing, two runs creating the same entities at
+# the same time race each other (duplicate key-values, NOT_UNIQUE errors, double LICAs). A write run holds a lease
+# on its network and format, and a short lease on its network while it creates the shared key-values.
+# A lease expires if its holder stops renewing it (e.g. the process was killed), it's then taken over.
+
+LEASE_DIR = '.locks'
+LEASE_TTL = 120 # seconds, the holder renews its lease every third of it
+LEASE_POLL_SECONDS = 5 # between two attempts to acquire a lease that's held by another run
+SHARED_LEASE_WAIT = 600 # seconds a run waits for the network lease of the key-values, it's only held briefly
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_stale(lease: dict) -> bool:
+    """
+    A lease is stale if it expired or its process on this host is gone.
+    """
+    if lease['expires_at'] < time.time():
+        return True
+    return lease['host'] == socket.gethostname() and not _is_process_alive(lease['pid'])
+
+
+def new_lease(owner: str, ttl: float) -> dict:
+    now = time.time()
+    return {'owner': owner, 'host': socket.gethostname(), 'pid': os.getpid(), 'acquired_at': now, 'expires_at': now + ttl}
+
+
+class LeaseLostError(RuntimeError):
+    pass
+
+
+class LeaseBackend(ABC):
+    """
+    Storage of leases, e.g. a shared database or key-value store for runs on several hosts.
+    Custom backends are passed as `--lease-backend module:ClassName` and are created without arguments.
+    All methods must be atomic per key.
+    """
+
+    @abstractmethod
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Sets the lease of the key to owner if it's free, stale or already held by owner.
+        """
+
+    @abstractmethod
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Extends the lease of owner, False if owner doesn't hold it anymore.
+        """
+
+    @abstractmethod
+    def release(self, key: str, owner: str):
+        pass
+
+    @abstractmethod
+    def read(self, key: str) -> dict | None:
+        pass
+
+
+class FileLeaseBackend(LeaseBackend):
+    """
+    Leases as json files in a directory, changes of a lease are serialized with an flock on a guard file of its key.
+    """
+
+    directory: str = LEASE_DIR
+
+    def __init__(self, directory: str = LEASE_DIR):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.lease')
+
+    @contextmanager
+    def _guard(self, key: str):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f'{key}.guard'), 'a') as guard_file:
+            fcntl.flock(guard_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(guard_file, fcntl.LOCK_UN)
+
+    def _write(self, key: str, lease: dict):
+        temp_path = f'{self._path(key)}.{uuid.uuid4().hex}'
+        with open(temp_path, 'w') as lease_file:
+            json.dump(lease, lease_file)
+        os.replace(temp_path, self._path(key))
+
+    def read(self, key: str) -> dict | None:
+        try:
+            with open(self._path(key)) as lease_file:
+                return json.load(lease_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        with self._guard(key):
+            lease = self.read(key)
+            if lease and lease['owner'] != owner:
+                if not is_stale(lease):
+                    return False
+                logging.warning(f"Taking over the stale lease {key} of {lease['owner']}")
+            self._write(key, new_lease(owner, ttl))
+            return True
+
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        with self._guard(key):
+            lease = self.read(key)
+            if not lease or lease['owner'] != owner:
+                return False
+            lease['expires_at'] = time.time() + ttl
+            self._write(key, lease)
+            return True
+
+    def release(self, key: str, owner: str):
+        with self._guard(key):
+            lease = self.read(key)
+            if lease and lease['owner'] == owner:
+                os.remove(self._path(key))
+
+
+def get_lease_backend(name: str) -> LeaseBackend | None:
+    """
+    Returns the lease backend by name: file, none (no leases) or module:ClassName of a custom LeaseBackend.
+    """
+    if name == 'none':
+        return None
+    if name == 'file':
+        return FileLeaseBackend()
+    module_name, _, class_name = name.partition(':')
+    if not module_name or not class_name:
+        logging.error(f'Invalid lease backend: {name}. Allowed values are file, none and module:ClassName.')
+        raise ValueError
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def check_leases(operation: str):
+    """
+    Raises LeaseLostError if a lease of the current run was lost, called before every create batch so a run stops
+    writing once another run may have taken over its entities.
+    """
+    session = get_session()
+    lost_keys = [lease.key for lease in session.leases if lease.lost] if session else []
+    if lost_keys:
+        logging.error(f"{operation}: lost lease {', '.join(lost_keys)}, stopping before the next batch")
+        raise LeaseLostError(f"lost lease {', '.join(lost_keys)}")
+
+
+class Lease():
+    """
+    Lease on a key, renewed by a heartbeat thread while it's held.
+    While it's held, it's registered in the session of the run, see check_leases.
+
+    with Lease(FileLeaseBackend(), '1234_wallpaper', wait=60):
+        ...
+    """
+
+    key: str = ''
+    ttl: float = LEASE_TTL
+    wait: float = 0 # seconds to wait for a held lease, 0 fails fast
+
+    def __init__(self, backend: LeaseBackend, key: str, ttl: float = LEASE_TTL, wait: float = 0):
+        self.backend = backend
+        self.key = key
+        self.ttl = ttl
+        self.wait = wait
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lost = False # True if the lease expired and was taken over while it was held
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        deadline = time.monotonic() + self.wait
+        waiting = False
+        while not self.backend.acquire(self.key, self.owner, self.ttl):
+            holder = self.backend.read(self.key) or {}
+            if time.monotonic() >= deadline:
+                logging.error(f"Lease {self.key} is held by {holder.get('owner')}, another run is writing the same entities")
+                raise TimeoutError(f'lease {self.key} is held by another run')
+            if not waiting:
+                logging.info(f"Waiting for lease {self.key} held by {holder.get('owner')}")
+                waiting = True
+            time.sleep(max(0, min(LEASE_POLL_SECONDS, deadline - time.monotonic())))
+        logging.info(f'Acquired lease {self.key}')
+        session = get_session()
+        if session:
+            session.leases.append(self)
+
+        self._stop_heartbeat.clear()
+        self._heartbeat = threading.Thread(target=self._renew, name=f'lease-{self.key}', daemon=True)
+        self._heartbeat.start()
+
+    def _renew(self):
+        while not self._stop_heartbeat.wait(self.ttl / 3):
+            try:
+                renewed = self.backend.renew(self.key, self.owner, self.ttl)
+            except Exception as e:
+                # e.g. a shared backend that's briefly unavailable, the lease holds until it expires
+                logging.warning(f'Could not renew lease {self.key}: {e}')
+                continue
+            if not renewed:
+                logging.error(f'Lost lease {self.key}, another run may be writing the same entities')
+                self.lost = True
+                return
+
+    def release(self):
+        self._stop_heartbeat.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+            self._heartbeat = None
+        session = get_session()
+        if session and self in session.leases:
+            session.leases.remove(self)
+        self.backend.release(self.key, self.owner)
+        logging.info(f'Released lease {self.key}')
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
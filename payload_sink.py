@@ -0,0 +1,105 @@
+import datetime
+import gzip
+import json
+import logging
+import queue
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from zeep.helpers import serialize_object
+
+# archive of the payloads of a run
+# the create calls of large runs send and receive thousands of line items, logging them costs formatting time on the
+# hot path and makes multi-megabyte log lines. While a sink is active, the payloads are queued as they are and written
+# as gzip json lines by a background thread, the console only logs counts and ids.
+#
+# {"time": "2024-05-01T12:00:00", "kind": "createLineItems", "request": [...], "response": [...]}
+
+SINK_QUEUE_SIZE = 1000 # payloads waiting for the writer, archive blocks if the writer falls behind that far
+
+_active_sink: ContextVar['PayloadSink | None'] = ContextVar('payload_sink', default=None)
+
+
+def archive(kind: str, request, response=None):
+    """
+    Archives a payload in the sink of the current run (thread or asyncio task), a no-op outside of a run.
+    The payload is serialized later by the writer thread, it must not be changed after it's archived.
+    """
+    sink = _active_sink.get()
+    if sink:
+        sink.write(kind, request, response)
+
+
+def _to_json(record: dict) -> bytes:
+    # responses are zeep objects
+    return (json.dumps(serialize_object(record, dict), default=str, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class PayloadSink():
+    """
+    Writes payloads as gzip json lines through a background thread.
+    Payloads are sampled (sample_rate of them are kept) and the archive stops at max_bytes (compressed), the rest
+    is dropped and counted.
+
+    with PayloadSink('payloads.jsonl.gz').activate():
+        ...
+    """
+
+    path: str = ''
+    max_bytes: int = 100 * 1024 * 1024
+    sample_rate: float = 1.0
+
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024, sample_rate: float = 1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sample_rate = sample_rate
+        self.written = 0
+        self.sampled_out = 0
+        self.dropped = 0 # above max_bytes or unserializable
+        self._queue: queue.Queue = queue.Queue(SINK_QUEUE_SIZE)
+        self._writer = None
+
+    def write(self, kind: str, request, response=None):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        self._queue.put({'time': datetime.datetime.now().isoformat(timespec='seconds'), 'kind': kind, 'request': request, 'response': response})
+
+    def _write_all(self):
+        with open(self.path, 'ab') as raw_file, gzip.GzipFile(fileobj=raw_file, mode='ab') as archive_file:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    return
+                # the position of the raw file lags behind the compressor by its buffer
+                if raw_file.tell() >= self.max_bytes:
+                    self.dropped += 1
+                    continue
+                try:
+                    archive_file.write(_to_json(record))
+                    self.written += 1
+                except (TypeError, ValueError) as e:
+                    logging.warning(f"Could not archive a {record['kind']} payload: {e}")
+                    self.dropped += 1
+
+    def open(self):
+        self._writer = threading.Thread(target=self._write_all, name='payload-sink', daemon=True)
+        self._writer.start()
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        logging.info(f'Archived {self.written} payloads in {self.path}, {self.dropped} dropped, {self.sampled_out} sampled out')
+
+    @contextmanager
+    def activate(self):
+        self.open()
+        token = _active_sink.set(self)
+        try:
+            yield self
+        finally:
+            _active_sink.reset(token)
+            self.close()
@@ -0,0 +1,94 @@
+from typing import AsyncIterator, Iterator
+
+from result_rows import row_type
+
+# column-projected reads via PublisherQueryLanguageService.select, see
+# https://developers.google.com/ad-manager/api/reference/v202502/PublisherQueryLanguageService
+# only the selected columns are sent, e.g. line items without their targeting trees
+
+PQL_PAGE_LIMIT = 500
+
+# pql columns of the entity tables by api field name (as used in result_rows.py) with their python type,
+# orders, key-values, creatives and licas have no pql table and are read with result_rows projections instead
+PQL_TABLES = {
+    'Line_Item': {
+        'id': ('Id', int),
+        'name': ('Name', str),
+        'orderId': ('OrderId', int),
+        'status': ('Status', str),
+        'lineItemType': ('LineItemType', str),
+        'costType': ('CostType', str),
+        'isMissingCreatives': ('IsMissingCreatives', bool),
+        'isArchived': ('IsArchived', bool),
+    },
+}
+
+
+def supports(table: str, fields: tuple[str, ...]) -> bool:
+    """
+    Returns True if all fields can be selected from the pql table.
+    """
+    return bool(fields) and table in PQL_TABLES and all(field in PQL_TABLES[table] for field in fields)
+
+
+def _convert_value(pql_value, python_type: type):
+    value = pql_value['value'] if 'value' in pql_value else None
+    if value is None:
+        return None
+    if python_type is bool:
+        return value if isinstance(value, bool) else str(value).lower() == 'true'
+    # NumberValues are transferred as strings
+    return python_type(value)
+
+
+def select_pages(pql_service, table: str, fields: tuple[str, ...], where_clause: str = '', values: list = None, limit: int = PQL_PAGE_LIMIT) -> Iterator[list[tuple]]:
+    """
+    Streams the rows of a pql table page by page, ordered by id so the pages don't overlap.
+    :param pql_service: PublisherQueryLanguageService of the client
+    :param table: pql table, see PQL_TABLES
+    :param fields: api field names to select, rows are result_rows with these fields
+    :param where_clause: pql where clause with the pql column names, e.g. "WHERE OrderId IN (1, 2)"
+    :param values: bind variables of the where clause
+    :return: iterator over the pages, every page is a list of rows
+    """
+    offset = 0
+    while True:
+        page = _convert_page(table, fields, pql_service.select(_select_statement(table, fields, where_clause, values, limit, offset)))
+        yield page
+        if len(page) < limit:
+            break
+        offset += limit
+
+
+async def select_pages_async(pql_service, table: str, fields: tuple[str, ...], where_clause: str = '', values: list = None, limit: int = PQL_PAGE_LIMIT) -> AsyncIterator[list[tuple]]:
+    """
+    Async counterpart of select_pages for a dfp_api_async.AsyncDfpService.
+    """
+    offset = 0
+    while True:
+        page = _convert_page(table, fields, await pql_service.select(_select_statement(table, fields, where_clause, values, limit, offset)))
+        yield page
+        if len(page) < limit:
+            break
+        offset += limit
+
+
+def _select_statement(table: str, fields: tuple[str, ...], where_clause: str, values: list, limit: int, offset: int) -> dict:
+    if not supports(table, fields):
+        raise ValueError(f'pql table {table} does not support the fields {fields}')
+    columns = ', '.join(PQL_TABLES[table][field][0] for field in fields)
+    return {'query': f"SELECT {columns} FROM {table} {where_clause} ORDER BY Id ASC LIMIT {limit} OFFSET {offset}", 'values': values}
+
+
+def _convert_page(table: str, fields: tuple[str, ...], result_set) -> list[tuple]:
+    python_types = [PQL_TABLES[table][field][1] for field in fields]
+    row = row_type(fields)
+    pql_rows = result_set['rows'] if 'rows' in result_set and result_set['rows'] else []
+    return [row._make(_convert_value(pql_value, python_type) for pql_value, python_type in zip(pql_row['values'], python_types)) for pql_row in pql_rows]
+
+
+def select(pql_service, table: str, fields: tuple[str, ...], where_clause: str = '', values: list = None, limit: int = PQL_PAGE_LIMIT) -> list[tuple]:
+    """
+    Reads all rows of select_pages into one list.
+    """
+    return [pql_row for page in select_pages(pql_service, table, fields, where_clause, values, limit) for pql_row in page]
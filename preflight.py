@@ -0,0 +1,201 @@
+import datetime
+import json
+import logging
+import math
+
+from batching import SOAP_ENVELOPE_BYTES, AdaptiveBatcher, estimate_size
+from dfp_api import MAX_LINE_ITEMS_PER_ORDER
+from validation_helper import MAX_LINE_ITEM_PRIORITY, MIN_LINE_ITEM_PRIORITY
+
+# offline preflight of a run
+# the plan of a run (price buckets, line items, orders, key-values and create requests) is checked against known
+# limits of google admanager networks, and its api calls, bytes and wall time are estimated. Nothing is read from
+# google admanager, the plan assumes that none of the managed entities of the format exist yet (the largest run).
+
+# limits of google admanager networks, a file passed with --network-limits overrides single entries
+NETWORK_LIMITS = {
+    'line_items_per_order': MAX_LINE_ITEMS_PER_ORDER,
+    'values_per_key': 200000, # values of one predefined key, the managed keys hold the values of all formats
+    'key_name_length': 20,
+    'value_name_length': 40,
+    'name_length': 255, # orders, line items, creatives and creative sets
+    'min_priority': MIN_LINE_ITEM_PRIORITY,
+    'max_priority': MAX_LINE_ITEM_PRIORITY,
+}
+
+# rough latency of one call: seconds per call and per item of the call, a file passed with --network-limits
+# overrides single operations under "call_seconds"
+CALL_SECONDS = {
+    'read': (0.8, 0.0),
+    'createCustomTargetingValues': (1.0, 0.01),
+    'createOrders': (1.0, 0.05),
+    'createCreatives': (1.0, 0.0),
+    'createCreativeSet': (1.0, 0.0),
+    'createLineItems': (1.5, 0.05),
+    'createLineItemCreativeAssociations': (1.0, 0.02),
+}
+
+RESPONSE_SIZE_FACTOR = 1.5 # create responses return the created entities with all defaults filled in
+PLACEHOLDER_ID = 123456789012 # ids of entities that don't exist yet, as long as real ids for the size estimates
+
+
+def load_network_limits(path: str) -> tuple[dict, dict]:
+    """
+    Reads overrides of NETWORK_LIMITS and CALL_SECONDS from a json file, e.g.
+    {"values_per_key": 50000, "call_seconds": {"createLineItems": [3.0, 0.1]}}
+    :return: network limits and call seconds
+    """
+    with open(path) as limits_file:
+        overrides = json.load(limits_file)
+    call_seconds = dict(CALL_SECONDS)
+    for operation, seconds in overrides.pop('call_seconds', {}).items():
+        if operation not in CALL_SECONDS:
+            logging.error(f'Invalid operation in {path}: {operation}. Allowed values are: {list(CALL_SECONDS)}.')
+            raise ValueError
+        call_seconds[operation] = tuple(seconds)
+    unknown_limits = set(overrides) - set(NETWORK_LIMITS)
+    if unknown_limits:
+        logging.error(f'Invalid network limits in {path}: {sorted(unknown_limits)}. Allowed values are: {list(NETWORK_LIMITS)}.')
+        raise ValueError
+    return dict(NETWORK_LIMITS, **overrides), call_seconds
+
+
+def check_names(kind: str, names: list[str], max_length: int) -> list[str]:
+    too_long = [name for name in names if len(name) > max_length]
+    if not too_long:
+        return []
+    return [f'{len(too_long)} {kind} names are longer than {max_length} characters, e.g. {too_long[0]}']
+
+
+def check_plan(plan: dict, limits: dict, max_request_bytes: int) -> list[str]:
+    """
+    Checks the plan of a run against the network limits.
+    :param plan: see Buckets.plan_run
+    :return: the violations, a run with violations fails in google admanager
+    """
+    violations = []
+    for order_name, line_items in plan['orders'].items():
+        if len(line_items) > limits['line_items_per_order']:
+            violations.append(f"Order {order_name} has {len(line_items)} line items, at most {limits['line_items_per_order']} are allowed")
+
+    for key_name, values in plan['key_values'].items():
+        if len(values) > limits['values_per_key']:
+            violations.append(f"Key {key_name} needs {len(values)} values, at most {limits['values_per_key']} are allowed per key")
+        violations += check_names(f'{key_name} value', values, limits['value_name_length'])
+    violations += check_names('key', list(plan['key_values']), limits['key_name_length'])
+    violations += check_names('order', list(plan['orders']), limits['name_length'])
+    violations += check_names('line item', [line_item['name'] for line_item in plan['line_items']], limits['name_length'])
+    violations += check_names('creative', plan['creatives'] + [plan['creative_set']], limits['name_length'])
+
+    invalid_priorities = sorted({line_item['priority'] for line_item in plan['line_items'] if not limits['min_priority'] <= line_item['priority'] <= limits['max_priority']})
+    if invalid_priorities:
+        violations.append(f"Line item priority {', '.join(map(str, invalid_priorities))} is outside of {limits['min_priority']}-{limits['max_priority']}")
+
+    # a batch holds at least one line item, a line item above the request budget can't be sent at all
+    too_large = [line_item['name'] for line_item in plan['line_items'] if estimate_size(line_item) + SOAP_ENVELOPE_BYTES > max_request_bytes]
+    if too_large:
+        violations.append(f'{len(too_large)} line items are larger than one request ({max_request_bytes // 1024} KiB) on their own, e.g. {too_large[0]}')
+
+    # every line item is checked, each distinct date is parsed and reported once
+    now = datetime.datetime.now()
+    start_times = {line_item['startDateTime'] for line_item in plan['line_items'] if line_item['startDateTimeType'] == 'USE_START_DATE_TIME'}
+    end_times = {line_item['endDateTime'] for line_item in plan['line_items'] if not line_item['unlimitedEndDateTime']}
+    for start_time in sorted(start_times):
+        if datetime.datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S') <= now:
+            violations.append(f"Start time {start_time} is in the past")
+    for end_time in sorted(end_times):
+        if datetime.datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S') <= now:
+            violations.append(f"End time {end_time} is in the past")
+    return violations
+
+
+def _create_calls(operation: str, items: list, max_request_bytes: int, max_batch_items: int) -> list[dict]:
+    # calls of a check_create_* function, a read of the existing items and a create per batch
+    calls = []
+    for batch in AdaptiveBatcher(operation, max_request_bytes, max_batch_items).split(items):
+        request_bytes = SOAP_ENVELOPE_BYTES + sum(estimate_size(item) for item in batch)
+        calls.append({'operation': 'read', 'items': 0, 'request_bytes': SOAP_ENVELOPE_BYTES, 'response_bytes': SOAP_ENVELOPE_BYTES})
+        calls.append({'operation': operation, 'items': len(batch), 'request_bytes': request_bytes, 'response_bytes': int(request_bytes * RESPONSE_SIZE_FACTOR)})
+    return calls
+
+
+def plan_calls(plan: dict, max_request_bytes: int, max_batch_items: int) -> dict[str, list[dict]]:
+    """
+    Lists the calls of every stage of a run, like actual_run would send them.
+    :return: calls by stage, every call with its operation, items and estimated bytes
+    """
+    read = {'operation': 'read', 'items': 0, 'request_bytes': SOAP_ENVELOPE_BYTES, 'response_bytes': SOAP_ENVELOPE_BYTES}
+    key_values = []
+    for key_name, values in plan['key_values'].items():
+        # the key, all of its values and the values to be created
+        key_values += [read, read]
+        value_jsons = [{'customTargetingKeyId': PLACEHOLDER_ID, 'displayName': value, 'name': value, 'matchType': 'EXACT'} for value in values]
+        key_values += [call for call in _create_calls('createCustomTargetingValues', value_jsons, max_request_bytes, max_batch_items) if call['operation'] != 'read']
+
+    creatives = []
+    for creative_name in plan['creatives']:
+        creatives += [read, {'operation': 'createCreatives', 'items': 1, 'request_bytes': SOAP_ENVELOPE_BYTES, 'response_bytes': SOAP_ENVELOPE_BYTES}]
+    creatives.append({'operation': 'createCreativeSet', 'items': 1, 'request_bytes': SOAP_ENVELOPE_BYTES, 'response_bytes': SOAP_ENVELOPE_BYTES})
+
+    order_jsons = [{'name': order_name, 'advertiserId': str(PLACEHOLDER_ID), 'traffickerId': str(PLACEHOLDER_ID)} for order_name in plan['orders']]
+    lica_jsons = [{'lineItemId': PLACEHOLDER_ID, 'creativeSetId': PLACEHOLDER_ID} for _ in plan['line_items']]
+    return {
+        'key_values': key_values,
+        'creatives': creatives,
+        # the existing orders of the format are read with the names of their line items
+        'orders': [read, read] + _create_calls('createOrders', order_jsons, max_request_bytes, max_batch_items),
+        'line_items': _create_calls('createLineItems', plan['line_items'], max_request_bytes, max_batch_items),
+        'licas': _create_calls('createLineItemCreativeAssociations', lica_jsons, max_request_bytes, max_batch_items),
+    }
+
+
+def estimate_seconds(calls: list[dict], concurrency: int, call_seconds: dict = CALL_SECONDS) -> float:
+    """
+    Wall time of the calls of one stage with at most `concurrency` calls at a time.
+    """
+    seconds = [call_seconds[call['operation']][0] + call_seconds[call['operation']][1] * call['items'] for call in calls]
+    if not seconds:
+        return 0
+    return max(max(seconds), sum(seconds) / concurrency)
+
+
+def run_preflight(plan: dict, concurrency: int, max_request_bytes: int, max_batch_items: int, limits: dict = NETWORK_LIMITS, call_seconds: dict = CALL_SECONDS) -> dict:
+    """
+    Checks the plan of a run and estimates its cost.
+    :param plan: see Buckets.plan_run
+    :param concurrency: concurrent requests of the run, runs above 1 set up key-values and creatives at the same time
+    :return: {'violations', 'line_items', 'orders', 'values', 'calls' (by operation), 'request_bytes', 'response_bytes',
+        'seconds' (by stage), 'total_seconds'}
+    """
+    stages = plan_calls(plan, max_request_bytes, max_batch_items)
+    calls = [call for stage_calls in stages.values() for call in stage_calls]
+    calls_by_operation: dict[str, int] = {}
+    for call in calls:
+        calls_by_operation[call['operation']] = calls_by_operation.get(call['operation'], 0) + 1
+
+    seconds = {stage: estimate_seconds(stage_calls, concurrency, call_seconds) for stage, stage_calls in stages.items()}
+    total_seconds = sum(seconds.values())
+    if concurrency > 1:
+        # see AsyncBuckets.actual_run_async
+        total_seconds -= min(seconds['key_values'], seconds['creatives'])
+
+    return {
+        'violations': check_plan(plan, limits, max_request_bytes),
+        'line_items': len(plan['line_items']),
+        'orders': len(plan['orders']),
+        'values': sum(len(values) for values in plan['key_values'].values()),
+        'calls': calls_by_operation,
+        'request_bytes': sum(call['request_bytes'] for call in calls),
+        'response_bytes': sum(call['response_bytes'] for call in calls),
+        'seconds': {stage: round(stage_seconds, 1) for stage, stage_seconds in seconds.items()},
+        'total_seconds': round(total_seconds, 1),
+    }
+
+
+def log_report(report: dict):
+    logging.info(f"Preflight: {report['line_items']} line items in {report['orders']} orders, {report['values']} key-values")
+    logging.info(f"Preflight: {sum(report['calls'].values())} api calls ({', '.join(f'{count} {operation}' for operation, count in report['calls'].items())})")
+    logging.info(f"Preflight: ~{math.ceil(report['request_bytes'] / 1024)} KiB sent, ~{math.ceil(report['response_bytes'] / 1024)} KiB received")
+    logging.info(f"Preflight: ~{report['total_seconds'] / 60:.1f} minutes ({', '.join(f'{stage} {seconds:.0f}s' for stage, seconds in report['seconds'].items())})")
+    for violation in report['violations']:
+        logging.error(f'Preflight: {violation}')
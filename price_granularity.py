@@ -0,0 +1,53 @@
+import logging
+
+# prebid price granularities in cents as (start, end, step) ranges, see https://docs.prebid.org/prebid/prebidConfig.html#price-granularity
+# ranges start at their first step because a 0.00 bucket never wins an auction
+PRICE_GRANULARITY_PRESETS: dict[str, list[tuple[int, int, int]]] = {
+    'low': [(50, 500, 50)],
+    'medium': [(10, 2000, 10)],
+    'high': [(1, 2000, 1)],
+    'auto': [(5, 500, 5), (500, 1000, 10), (1000, 2000, 50)],
+    'dense': [(1, 300, 1), (300, 800, 5), (800, 2000, 50)],
+}
+
+
+def parse_price_granularity(granularity: str) -> list[tuple[int, int, int]]:
+    """
+    Parses a price granularity into a list of price ranges.
+    Args:
+        granularity (str): Either the name of a preset (e.g. dense) or comma-separated ranges in cents
+            following the pattern start-end:step (e.g. "1-300:1, 300-800:5, 800-2000:50").
+    Returns:
+        list: A list of (start, end, step) tuples in cents.
+    """
+    cleaned_granularity = granularity.lower().strip()
+    if cleaned_granularity in PRICE_GRANULARITY_PRESETS:
+        return list(PRICE_GRANULARITY_PRESETS[cleaned_granularity])
+
+    price_ranges = []
+    for price_range in cleaned_granularity.split(','):
+        bounds, _, step = price_range.strip().partition(':')
+        start, _, end = bounds.partition('-')
+        # int() raises ValueError for anything that is not a whole number of cents
+        price_ranges.append((int(start), int(end), int(step)))
+    return price_ranges
+
+
+def generate_price_buckets(price_ranges: list[tuple[int, int, int]]) -> list[int]:
+    """
+    Generates the price buckets of one or more price ranges with integer arithmetic.
+    Boundaries shared by adjacent ranges (e.g. 300 in 1-300:1 and 300-800:5) are only returned once.
+    Args:
+        price_ranges (list): A list of (start, end, step) tuples in cents.
+    Returns:
+        list: A sorted list of unique price buckets in cents.
+    """
+    price_buckets = set()
+
+    for start, end, step in price_ranges:
+        price_buckets.update(range(start, end + 1, step))
+        if (end - start) % step != 0:
+            logging.warning(f'Price range {start}-{end} is not divisible by step {step}, therefore {end} will be added in disregard of the step_size')
+            price_buckets.add(end)
+
+    return sorted(price_buckets)
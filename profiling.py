@@ -0,0 +1,124 @@
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+
+class RunProfiler():
+    """
+    Sampling cpu profiler and per-stage tracemalloc snapshots for a run.
+
+    Writes to output_dir:
+        - cpu.folded: collapsed stacks (stage;frame;frame count), e.g. for flamegraph.pl or speedscope
+        - allocations.txt: duration, memory and top allocations per stage
+
+    profiler = RunProfiler('profiles/run')
+    with profiler.profile():
+        with profiler.stage('bucket_generation'):
+            ...
+    """
+
+    output_dir: str = ''
+    interval: float = 0.005 # seconds between two cpu samples
+    top_n: int = 25 # allocations per stage in the report
+
+    def __init__(self, output_dir: str, interval: float = 0.005, top_n: int = 25):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top_n = top_n
+        self.current_stage = 'setup'
+        self.samples: Counter = Counter()
+        self.stages: list[dict] = []
+        self._stop_sampling = threading.Event()
+        self._sampler = None
+
+    def _sample(self):
+        sampler_id = threading.get_ident()
+        thread_names = {}
+        while not self._stop_sampling.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                if thread_id not in thread_names:
+                    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                stack.append(self.current_stage)
+                self.samples[';'.join(reversed(stack))] += 1
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Attributes cpu samples and allocations inside the block to the stage `name`.
+        """
+        previous_stage = self.current_stage
+        # snapshots are expensive, their samples must not be attributed to the stage
+        self.current_stage = 'profiler_overhead'
+        tracemalloc.reset_peak()
+        snapshot_before = tracemalloc.take_snapshot()
+        self.current_stage = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.current_stage = 'profiler_overhead'
+            current_memory, peak_memory = tracemalloc.get_traced_memory()
+            snapshot_after = tracemalloc.take_snapshot()
+            self.stages.append({
+                'name': name,
+                'seconds': duration,
+                'current_bytes': current_memory,
+                'peak_bytes': peak_memory,
+                'top_allocations': snapshot_after.compare_to(snapshot_before, 'lineno')[:self.top_n]
+            })
+            self.current_stage = previous_stage
+
+    @contextmanager
+    def profile(self):
+        """
+        Runs the sampler and tracemalloc for the duration of the block and writes the reports afterwards.
+        """
+        tracemalloc.start()
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+        try:
+            yield self
+        finally:
+            self._stop_sampling.set()
+            self._sampler.join()
+            tracemalloc.stop()
+            self.write_reports()
+
+    def write_reports(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        cpu_path = os.path.join(self.output_dir, 'cpu.folded')
+        with open(cpu_path, 'w') as cpu_file:
+            for stack, count in self.samples.most_common():
+                cpu_file.write(f'{stack} {count}\n')
+
+        allocations_path = os.path.join(self.output_dir, 'allocations.txt')
+        with open(allocations_path, 'w') as allocations_file:
+            for stage in self.stages:
+                allocations_file.write(f"== {stage['name']}: {stage['seconds']:.3f}s, {stage['current_bytes'] / 1024:.0f}KiB traced, {stage['peak_bytes'] / 1024:.0f}KiB peak\n")
+                for allocation in stage['top_allocations']:
+                    allocations_file.write(f'{allocation}\n')
+                allocations_file.write('\n')
+
+        logging.info(f'Profile written to {cpu_path} and {allocations_path}')
+
+
+def profile_stage(profiler: RunProfiler, name: str):
+    """
+    Returns profiler.stage(name), or a no-op context if the run is not profiled.
+    """
+    return profiler.stage(name) if profiler else nullcontext()
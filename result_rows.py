@@ -0,0 +1,55 @@
+from collections import namedtuple
+
+# lightweight rows for dfp_api lookups, only the requested fields of a zeep result object are kept
+
+# common projections
+ID_NAME = ('id', 'name')
+ORDER_FIELDS = ('id', 'name', 'status')
+LINE_ITEM_FIELDS = ('id', 'name', 'orderId', 'status')
+KEY_VALUE_FIELDS = ('id', 'name', 'customTargetingKeyId', 'status')
+LICA_FIELDS = ('lineItemId', 'creativeId', 'creativeSetId', 'status')
+AD_UNIT_FIELDS = ('id', 'parentId', 'name', 'adUnitCode', 'status')
+
+_row_types = {}
+
+
+def row_type(fields: tuple[str, ...]) -> type:
+    """
+    Returns the (cached) row type for the given fields. Rows are tuples whose values can be read
+    by attribute (row.name) and by key (row['name']), like the zeep objects they replace.
+    """
+    fields = tuple(fields)
+    if fields not in _row_types:
+        base = namedtuple('Row', fields)
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                try:
+                    return getattr(self, key)
+                except AttributeError:
+                    raise KeyError(key)
+            return tuple.__getitem__(self, key)
+
+        _row_types[fields] = type('Row', (base,), {'__slots__': (), '__getitem__': __getitem__, 'get': lambda self, key, default=None: getattr(self, key, default)})
+    return _row_types[fields]
+
+
+def project(results: list, fields: tuple[str, ...]) -> list[tuple]:
+    """
+    Extracts the given fields of zeep result objects (or dicts) into rows, see row_type.
+    Fields that are not set on a result are None.
+    """
+    row = row_type(fields)
+    rows = []
+    for result in results:
+        # zeep objects keep their values in an ordered dict, reading it directly skips zeep's attribute lookup
+        values = getattr(result, '__values__', result)
+        rows.append(row._make([values.get(field) for field in fields]))
+    return rows
+
+
+def to_dict(result) -> dict:
+    """
+    Shallow dict of a zeep result object, replaces the dir()/getattr reflection.
+    """
+    return dict(getattr(result, '__values__', result))
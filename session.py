@@ -0,0 +1,116 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from result_rows import project
+
+# name to id memo of one run, shared by Buckets and dfp_api
+# a run resolves the same keys, values, orders and creatives several times (e.g. the price-bucket key by
+# get_bucket_key, get_all_key_values and get_key_value_by_name). While a session is active, dfp_api reads them
+# once and keeps them up to date from its create responses. Entities changed outside of the run aren't seen,
+# so a session only lives as long as one run.
+
+_active_session: ContextVar['GamSession | None'] = ContextVar('gam_session', default=None)
+
+
+def get_session() -> 'GamSession | None':
+    """
+    Returns the session of the current run (thread or asyncio task), None outside of a run.
+    """
+    return _active_session.get()
+
+
+def record(kind: str, created_ids, skipped_ids=()):
+    """
+    Records created and skipped ids in the session of the current run, a no-op outside of a run.
+    """
+    session = get_session()
+    if session:
+        session.record(kind, created_ids, skipped_ids)
+
+
+class GamSession():
+    """
+    Memo of key ids, value sets, orders and creatives by name. Rows are kept with the fields of their projection
+    (see result_rows.py) and projected to the fields a caller asks for.
+    """
+
+    def __init__(self):
+        self.key_ids: dict[str, int] = {}
+        self.key_values: dict[tuple[int, bool], list] = {} # (key id, only active) -> all value rows of the key
+        self.orders: dict[str, tuple] = {}
+        self.creatives: dict[str, tuple] = {}
+        self.creative_sets: dict[str, tuple] = {}
+        self.line_items: dict[str, tuple] = {} # only kept after a prefix scan of the line items
+        # name prefix of a complete scan by kind, a name with the prefix that isn't known doesn't exist
+        self.scanned: dict[str, str] = {}
+        self.isolate_failures = False # bisect rejected line item and lica batches, see batching.AdaptiveBatcher
+        # items the api rejected by create operation, [{'item': name or line item id, 'errors': batching.error_paths}]
+        self.rejected: dict[str, list] = {}
+        self.prefix_scan = False # index the managed entities of the run by name prefix, see dfp_api.index_managed_entities
+        # ids of the entities the run created and of the ones that already existed, by kind (e.g. 'line_items')
+        self.created: dict[str, list] = {}
+        self.skipped: dict[str, list] = {}
+        self.leases: list = [] # leases the run holds, its create batches stop once one of them is lost (see locking.check_leases)
+
+    def fork(self) -> 'GamSession':
+        """
+        Returns a session for another run of the same network (e.g. the next job in service mode) that shares the memo
+        of keys, values, orders, creatives and creative sets. The recorded ids, rejected items and prefix index are the run's own.
+        """
+        session = GamSession()
+        session.key_ids = self.key_ids
+        session.key_values = self.key_values
+        session.orders = self.orders
+        session.creatives = self.creatives
+        session.creative_sets = self.creative_sets
+        return session
+
+    @contextmanager
+    def activate(self):
+        token = _active_session.set(self)
+        try:
+            yield self
+        finally:
+            _active_session.reset(token)
+
+    def get_key_values(self, key_id: int, only_active: bool, fields: tuple[str, ...]) -> list | None:
+        # the active values can be taken from all values of the key
+        for cached_key, active_filter in [((key_id, only_active), False), ((key_id, False), only_active)]:
+            if cached_key in self.key_values:
+                rows = self.key_values[cached_key]
+                return project([row for row in rows if row['status'] == 'ACTIVE'] if active_filter else rows, fields)
+        return None
+
+    def add_key_values(self, key_id: int, rows: list):
+        """
+        Adds created (active) values to the known value sets of the key.
+        """
+        for only_active in [True, False]:
+            known_values = self.key_values.get((key_id, only_active))
+            if known_values is not None:
+                known_names = {row['name'] for row in known_values}
+                known_values.extend(row for row in rows if row['name'] not in known_names)
+
+    def get_by_names(self, kind: str, names: list[str], fields: tuple[str, ...]) -> tuple[list, list[str]]:
+        """
+        Returns the known rows of the names projected to fields and the names that have to be looked up.
+        :param kind: orders, creatives, creative_sets or line_items
+        """
+        memo = getattr(self, kind)
+        prefix = self.scanned.get(kind)
+        known_rows = [memo[name] for name in names if name in memo]
+        return project(known_rows, fields), [name for name in names if name not in memo and not (prefix is not None and name.startswith(prefix))]
+
+    def index(self, kind: str, prefix: str, rows: list):
+        """
+        Keeps the rows of a complete scan of the names with the prefix, see dfp_api.index_managed_entities.
+        """
+        getattr(self, kind).update((row['name'], row) for row in rows)
+        self.scanned[kind] = prefix
+
+    def reject(self, operation: str, item: str, errors: list[dict]):
+        self.rejected.setdefault(operation, []).append({'item': item, 'errors': errors})
+
+    def record(self, kind: str, created_ids, skipped_ids=()):
+        self.created.setdefault(kind, []).extend(created_ids)
+        self.skipped.setdefault(kind, []).extend(skipped_ids)
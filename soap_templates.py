@@ -0,0 +1,261 @@
+import json
+import logging
+import re
+from xml.sax.saxutils import escape
+
+import googleads
+import zeep
+from zeep.wsdl.utils import etree_to_string
+
+# pre-serialized soap requests for createLineItems
+# the line items of a run only differ in their order, name, rate and price bucket value ids, zeep packs, type-checks
+# and serializes the complete nested structure (placeholders, companions, goal, targeting) of every line item anyway.
+# A template is serialized by zeep once per run with marker values in these fields, the line items are spliced into it.
+# The application name of the soap header changes between requests (googleads appends the utilities used since the
+# last request), it's spliced into every request as well.
+# tests/test_soap_templates.py compares rendered requests byte for byte with zeep's serialization for the line items
+# Buckets assembles. As a safeguard against zeep or wsdl versions the tests don't cover, the first request of every
+# template is compared with zeep's serialization once, on any difference the template is dropped and zeep serializes
+# the line items of the run.
+
+OPERATION = 'createLineItems'
+
+# marker values of the per-item fields, no real line item has negative ids or amounts
+ORDER_ID_MARKER = -9000000000000000001
+MICRO_AMOUNT_MARKER = -9000000000000000002
+VALUE_ID_MARKER = -9000000000000000003
+NAME_MARKER = 'soap-template-line-item-name'
+
+# lxml escapes carriage returns as character references and rejects other control characters
+UNSAFE_TEXT = re.compile('[\x00-\x1f]')
+
+
+def _price_bucket_criteria(line_item: dict) -> dict:
+    # the price bucket criteria is the first child of the custom targeting, see Buckets.assemble_line_item_jsons
+    return line_item['targeting']['customTargeting']['children'][0]
+
+
+def _mark_line_item(line_item: dict) -> dict | None:
+    """
+    Returns a copy of the line item with marker values in the per-item fields,
+    None if the line item doesn't have the structure of assembled line items.
+    """
+    if not isinstance(line_item, dict):
+        return None
+    try:
+        targeting = line_item['targeting']
+        custom_targeting = targeting['customTargeting']
+        children = list(custom_targeting['children'])
+        children[0] = dict(_price_bucket_criteria(line_item), valueIds=[VALUE_ID_MARKER])
+        return dict(
+            line_item,
+            orderId=ORDER_ID_MARKER,
+            name=NAME_MARKER,
+            costPerUnit=dict(line_item['costPerUnit'], microAmount=MICRO_AMOUNT_MARKER),
+            targeting=dict(targeting, customTargeting=dict(custom_targeting, children=children))
+        )
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def get_soap_headers(service) -> dict:
+    """
+    Returns the soap headers of the next request like googleads.common.ZeepServiceProxy does, their application name
+    lists the utilities used since the last request.
+    """
+    googleads.common.AddToUtilityRegistry('zeep')
+    return service._GetZeepFormattedSOAPHeaders()
+
+
+def _application_name(soap_headers: dict) -> str:
+    return soap_headers['RequestHeader'].applicationName
+
+
+def _create_envelope(service, line_items: list, soap_headers: dict):
+    """
+    Serializes the createLineItems request with zeep exactly like googleads.common.ZeepServiceProxy does.
+    :return: the envelope (after the egress plugins) and the http headers
+    """
+    packed_args = service._PackArguments(OPERATION, [line_items])
+    binding = service.zeep_client.service._binding
+    return binding._create(OPERATION, packed_args, {'_soapheaders': soap_headers}, client=service.zeep_client)
+
+
+class LineItemTemplate():
+    """
+    Serialized createLineItems request split into the envelope around the line items and the segments of one
+    line item between its per-item fields.
+    """
+
+    prefix: str = '' # xml declaration, envelope, soap headers and the opening operation element
+    suffix: str = ''
+    # the prefix before and after the application name of the soap header
+    prefix_head: str = ''
+    prefix_tail: str = ''
+    address: str = ''
+    verified: bool = False # True once a request was byte for byte equal to zeep's serialization
+
+    def __init__(self, prefix: str, item: str, suffix: str, http_headers: dict, address: str, application_name: str):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.http_headers = http_headers
+        self.address = address
+        self.segments: list[str] = []
+        self.fields: list[str] = []
+
+        application_name_marker = f'>{escape(application_name)}<'
+        if prefix.count(application_name_marker) != 1:
+            raise ValueError('application name not found exactly once in the soap header')
+        start = prefix.index(application_name_marker) + 1
+        self.prefix_head = prefix[:start]
+        self.prefix_tail = prefix[start + len(application_name_marker) - 2:]
+
+        markers = {'orderId': f'>{ORDER_ID_MARKER}<', 'name': f'>{NAME_MARKER}<', 'microAmount': f'>{MICRO_AMOUNT_MARKER}<'}
+        positions = []
+        for field, marker in markers.items():
+            if item.count(marker) != 1:
+                raise ValueError(f'marker of {field} not found exactly once in the serialized line item')
+            start = item.index(marker) + 1
+            positions.append((start, start + len(marker) - 2, field))
+        # repeated element, the complete marker element is replaced by one element per value id
+        value_ids = list(re.finditer(f'<([^<>\\s]+)>{VALUE_ID_MARKER}</\\1>', item))
+        if len(value_ids) != 1:
+            raise ValueError('marker of valueIds not found exactly once in the serialized line item')
+        self.value_id_tag = value_ids[0].group(1)
+        positions.append((value_ids[0].start(), value_ids[0].end(), 'valueIds'))
+
+        end = 0
+        for start, field_end, field in sorted(positions):
+            self.segments.append(item[end:start])
+            self.fields.append(field)
+            end = field_end
+        self.segments.append(item[end:])
+
+    def _field_values(self, line_item: dict) -> dict | None:
+        name = line_item['name']
+        order_id = line_item['orderId']
+        micro_amount = line_item['costPerUnit']['microAmount']
+        value_ids = _price_bucket_criteria(line_item)['valueIds']
+        if not isinstance(name, str) or UNSAFE_TEXT.search(name):
+            return None
+        # zeep writes longs with str(), only ints are spliced to rule out float formatting differences
+        if not all(type(value) is int for value in [order_id, micro_amount, *value_ids]):
+            return None
+        return {
+            'orderId': str(order_id),
+            'name': escape(name),
+            'microAmount': str(micro_amount),
+            'valueIds': ''.join(f'<{self.value_id_tag}>{value_id}</{self.value_id_tag}>' for value_id in value_ids),
+        }
+
+    def render(self, line_items: list[dict], application_name: str) -> bytes | None:
+        """
+        Returns the request for the line items with the application name of its soap header, None if a field value
+        can't be spliced.
+        """
+        if UNSAFE_TEXT.search(application_name):
+            return None
+        parts = [self.prefix_head, escape(application_name), self.prefix_tail]
+        for line_item in line_items:
+            values = self._field_values(line_item)
+            if values is None:
+                return None
+            parts.append(self.segments[0])
+            for field, segment in zip(self.fields, self.segments[1:]):
+                parts.append(values[field])
+                parts.append(segment)
+        parts.append(self.suffix)
+        return ''.join(parts).encode('utf-8')
+
+    @classmethod
+    def build(cls, service, marked_line_item: dict, soap_headers: dict) -> 'LineItemTemplate':
+        envelope, http_headers = _create_envelope(service, [marked_line_item], soap_headers)
+        xml = etree_to_string(envelope).decode('utf-8')
+        line_item_element = envelope.find('{*}Body')[0][0]
+        tag = f'{line_item_element.prefix}:lineItems' if line_item_element.prefix else 'lineItems'
+        start = xml.index(f'<{tag}')
+        end = xml.rindex(f'</{tag}>') + len(f'</{tag}>')
+        # the authorization is added to every request, it expires during long runs
+        for header in service._header_handler.GetHTTPHeaders():
+            http_headers.pop(header, None)
+        address = service.zeep_client.service._binding_options['address']
+        return cls(xml[:start], xml[start:end], xml[end:], http_headers, address, _application_name(soap_headers))
+
+
+def render_request(dfp_client, service, line_items: list[dict]) -> tuple[LineItemTemplate, bytes] | None:
+    """
+    Renders the createLineItems request of the line items from the client's template of their structure.
+    :return: template and request, None if the line items have to be serialized by zeep
+    """
+    templates = getattr(dfp_client, 'soap_templates', None)
+    if templates is None or not line_items:
+        return None
+    marked_line_items = [_mark_line_item(line_item) for line_item in line_items]
+    if None in marked_line_items:
+        return None
+    structures = {json.dumps(marked_line_item, sort_keys=True, default=str) for marked_line_item in marked_line_items}
+    if len(structures) != 1:
+        return None
+    key = (str(dfp_client.network_code), structures.pop())
+
+    soap_headers = get_soap_headers(service)
+    if key not in templates:
+        try:
+            templates[key] = LineItemTemplate.build(service, marked_line_items[0], soap_headers)
+        except Exception as e:
+            logging.warning(f'Could not build the {OPERATION} template, line items are serialized by zeep: {e}')
+            templates[key] = None
+    template = templates[key]
+    if template is None:
+        return None
+    request = template.render(line_items, _application_name(soap_headers))
+    if request is None:
+        return None
+
+    if not template.verified:
+        expected = etree_to_string(_create_envelope(service, line_items, soap_headers)[0])
+        if request != expected:
+            offset = next((index for index, (a, b) in enumerate(zip(request, expected)) if a != b), min(len(request), len(expected)))
+            logging.warning(f'{OPERATION} template differs from the zeep serialization at byte {offset}, line items are serialized by zeep')
+            templates[key] = None
+            return None
+        template.verified = True
+        logging.info(f'{OPERATION} template matches the zeep serialization, line items are spliced into it')
+    return template, request
+
+
+def server_fault(service, fault: zeep.exceptions.Fault) -> googleads.errors.GoogleAdsServerFault:
+    # same translation as googleads.common.ZeepServiceProxy
+    error_list = ()
+    if fault.detail is not None:
+        namespace = service._GetBindingNamespace()
+        underlying_exception = fault.detail.find('{%s}ApiExceptionFault' % namespace)
+        fault_type = service.zeep_client.get_element('{%s}ApiExceptionFault' % namespace)
+        error_list = fault_type.parse(underlying_exception, service.zeep_client.wsdl.types).errors or error_list
+    return googleads.errors.GoogleAdsServerFault(fault.detail, errors=error_list, message=fault.message)
+
+
+def get_http_headers(service, template: LineItemTemplate) -> dict:
+    http_headers = dict(template.http_headers)
+    http_headers.update(service._header_handler.GetHTTPHeaders())
+    return http_headers
+
+
+def process_reply(service, response) -> list:
+    binding = service.zeep_client.service._binding
+    try:
+        return binding.process_reply(service.zeep_client, binding.get(OPERATION), response)['body']['rval']
+    except zeep.exceptions.Fault as e:
+        raise server_fault(service, e)
+
+
+def create_line_items(dfp_client, service, line_items: list[dict]) -> list:
+    """
+    service.createLineItems(line_items) with the client's templates, see render_request.
+    """
+    rendered = render_request(dfp_client, service, line_items)
+    if rendered is None:
+        return service.createLineItems(line_items)
+    template, request = rendered
+    response = service.zeep_client.transport.post(template.address, request, get_http_headers(service, template))
+    return process_reply(service, response)
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the line item creator live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_bucket():
+    """
+    Returns a factory of Buckets for a wallpaper setup, keyword arguments override single options (see JobConfig).
+    """
+    from bucket import Buckets
+    from line_item_api import JobConfig
+
+    def _make_bucket(**options):
+        config = JobConfig(dfp_id=1234, format='wallpaper', line_item_type='price_priority', line_item_priority=12,
+                           master_size=[728, 90], companion_sizes=[[160, 600]], advertiser_id=1, trafficker_id=2,
+                           start_price_bucket=100, end_price_bucket=200, price_bucket_step=10, lease_backend='none')
+        for name, value in options.items():
+            setattr(config, name, value)
+        return Buckets(config.to_args())
+
+    return _make_bucket
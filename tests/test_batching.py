@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+import requests
+from googleads.errors import GoogleAdsServerFault
+
+import dfp_api_async
+from batching import SOAP_ENVELOPE_BYTES, AdaptiveBatcher, estimate_size, get_batcher, is_batch_size_error
+from session import GamSession
+from transport import TransportSettings
+
+
+class SizeLimitedCreate():
+    # fails like google admanager on batches above max_items, records the sizes of all calls
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self.calls = []
+
+    def __call__(self, batch):
+        self.calls.append(len(batch))
+        if len(batch) > self.max_items:
+            raise requests.exceptions.Timeout('read timed out')
+        return [{'id': item['id']} for item in batch]
+
+
+class RejectingCreate():
+    # fails like google admanager on batches that hold the bad item, records the sizes of all calls
+    def __init__(self, bad_id: int):
+        self.bad_id = bad_id
+        self.calls = []
+        self.created = []
+
+    def __call__(self, batch):
+        self.calls.append(len(batch))
+        for index, item in enumerate(batch):
+            if item['id'] == self.bad_id:
+                api_error = type('ApiError', (), {'fieldPath': f'lineItem[{index}].targeting', 'errorString': 'CommonError.NOT_FOUND', 'trigger': '123'})()
+                raise GoogleAdsServerFault(None, errors=[api_error], message='[CommonError.NOT_FOUND]')
+        self.created.extend(batch)
+        return [{'id': item['id']} for item in batch]
+
+
+def isolating_session() -> GamSession:
+    session = GamSession()
+    session.isolate_failures = True
+    return session
+
+
+def items(count: int) -> list:
+    return [{'id': i, 'name': f'item_{i}'} for i in range(count)]
+
+
+class AsyncClient():
+    def __init__(self, max_items: int):
+        self.dfp_client = type('DfpClient', (), {'transport_settings': TransportSettings(max_batch_items=max_items), 'batchers': {}})()
+
+
+def test_split_within_item_and_byte_budget():
+    batcher = AdaptiveBatcher('createLineItems', max_items=3)
+    assert [len(batch) for batch in batcher.split(items(8))] == [3, 3, 2]
+
+    small_bytes = AdaptiveBatcher('createLineItems', max_bytes=SOAP_ENVELOPE_BYTES + 2 * estimate_size(items(1)[0]), max_items=200)
+    assert [len(batch) for batch in small_bytes.split(items(8))] == [2, 2, 2, 2]
+
+
+def test_run_shrinks_on_size_errors():
+    batcher = AdaptiveBatcher('createLineItems', max_items=40)
+    create = SizeLimitedCreate(max_items=10)
+    results = batcher.run(items(45), create)
+
+    assert [result['id'] for result in results] == list(range(45))
+    assert create.calls[:3] == [40, 20, 10]
+    assert batcher.item_budget <= 20
+
+
+def test_run_raises_other_errors():
+    def create(batch):
+        raise ValueError('no')
+
+    with pytest.raises(ValueError):
+        AdaptiveBatcher('createLineItems').run(items(3), create)
+
+
+def test_run_raises_size_error_of_a_single_item():
+    with pytest.raises(requests.exceptions.Timeout):
+        AdaptiveBatcher('createLineItems').run(items(1), SizeLimitedCreate(max_items=0))
+
+
+def test_observe_shrinks_slow_and_grows_fast_batches():
+    batcher = AdaptiveBatcher('createLineItems', max_items=100, target_seconds=10)
+    batcher.observe(100, 20)
+    assert batcher.item_budget == 50
+    batcher.observe(50, 1)
+    assert batcher.item_budget == 62
+    batcher.observe(10, 1)
+    assert batcher.item_budget == 62
+
+
+def test_batch_size_errors():
+    assert is_batch_size_error(requests.exceptions.Timeout())
+    assert is_batch_size_error(Exception('(413) Request Entity Too Large'))
+    assert not is_batch_size_error(Exception('CommonError.NOT_FOUND'))
+
+
+def test_get_batcher_keeps_budgets_per_client():
+    client = AsyncClient(max_items=200).dfp_client
+    batcher = get_batcher(client, 'createOrders')
+    batcher.shrink(10)
+    assert get_batcher(client, 'createOrders') is batcher
+    assert get_batcher(client, 'createLineItems') is not batcher
+    assert get_batcher(object(), 'createOrders').item_budget == 200
+
+
+def test_create_batched_shrinks_on_size_errors():
+    create = SizeLimitedCreate(max_items=10)
+
+    async def create_batch(batch):
+        return create(batch)
+
+    client = AsyncClient(max_items=40)
+    results = asyncio.run(dfp_api_async.create_batched(client, 'createOrders', items(45), create_batch))
+
+    assert [result['id'] for result in results] == list(range(45))
+    assert max(size for size in create.calls if size <= 10) == 10
+    assert client.dfp_client.batchers['createOrders'].item_budget <= 20
+
+
+def test_run_bisects_rejected_batches_to_the_bad_item():
+    create = RejectingCreate(bad_id=123)
+    session = isolating_session()
+    with session.activate():
+        results = AdaptiveBatcher('createLineItems').run(items(200), create)
+
+    assert [result['id'] for result in results] == [i for i in range(200) if i != 123]
+    assert len(create.created) == 199
+    assert session.rejected == {'createLineItems': [{'item': 'item_123', 'errors': [{'fieldPath': 'lineItem[0].targeting', 'error': 'CommonError.NOT_FOUND', 'trigger': '123'}]}]}
+    # only the halves that hold the bad item are split again
+    assert sum(create.calls) - len(create.created) == 200 + 100 + 50 + 25 + 13 + 7 + 4 + 2 + 1
+
+
+def test_run_raises_item_errors_without_isolation():
+    with GamSession().activate():
+        with pytest.raises(GoogleAdsServerFault):
+            AdaptiveBatcher('createLineItems').run(items(200), RejectingCreate(bad_id=123))
+    # orders are needed by every line item, their errors still fail the run
+    with isolating_session().activate():
+        with pytest.raises(GoogleAdsServerFault):
+            AdaptiveBatcher('createOrders').run(items(200), RejectingCreate(bad_id=123))
+
+
+def test_create_isolating_failures_bisects_rejected_chunks():
+    create = RejectingCreate(bad_id=123)
+    session = isolating_session()
+
+    async def create_chunk(chunk):
+        return create(chunk)
+
+    async def run():
+        with session.activate():
+            return await dfp_api_async.create_isolating_failures('createLineItems', items(200), create_chunk)
+    results = asyncio.run(run())
+
+    assert [result['id'] for result in results] == [i for i in range(200) if i != 123]
+    assert sorted(item['id'] for item in create.created) == [i for i in range(200) if i != 123]
+    assert [rejected['item'] for rejected in session.rejected['createLineItems']] == ['item_123']
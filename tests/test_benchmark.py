@@ -0,0 +1,30 @@
+import json
+import os
+
+import benchmark
+
+
+def test_all_cases_run_on_small_inputs():
+    results = benchmark.run_benchmarks([100])
+    assert set(results) == {f'{case_name}[100]' for case_name in benchmark.create_cases(100)}
+    assert all(result['seconds'] >= 0 and result['peak_bytes'] >= 0 for result in results.values())
+
+
+def test_case_filter():
+    assert list(benchmark.run_benchmarks([100], 'group_price')) == ['group_price_buckets[100]']
+
+
+def test_baseline_covers_all_cases():
+    with open(os.path.join(os.path.dirname(benchmark.__file__), benchmark.BASELINE_PATH)) as baseline_file:
+        baseline = json.load(baseline_file)
+    assert {f'{case_name}[{size}]' for size in benchmark.SIZES for case_name in benchmark.create_cases(10)} <= set(baseline)
+
+
+def test_compare_to_baseline():
+    baseline = {'case[100]': {'seconds': 0.1, 'peak_bytes': 1024 * 1024}, 'fast[100]': {'seconds': 0.001, 'peak_bytes': 1024}}
+    assert benchmark.compare_to_baseline({'case[100]': {'seconds': 0.15, 'peak_bytes': 1024 * 1024}}, baseline) == []
+    assert len(benchmark.compare_to_baseline({'case[100]': {'seconds': 0.25, 'peak_bytes': 2 * 1024 * 1024}}, baseline)) == 2
+    # jitter of a few milliseconds and small allocations of fast cases are ignored
+    assert benchmark.compare_to_baseline({'fast[100]': {'seconds': 0.004, 'peak_bytes': 32 * 1024}}, baseline) == []
+    # cases without baseline are skipped
+    assert benchmark.compare_to_baseline({'new[100]': {'seconds': 1, 'peak_bytes': 1}}, baseline) == []
@@ -0,0 +1,155 @@
+from session import GamSession
+
+
+def test_group_price_buckets_one_per_line_item(make_bucket):
+    bucket = make_bucket()
+    assert bucket.group_price_buckets([100, 110, 120]) == [[100], [110], [120]]
+
+
+def test_group_price_buckets_consolidated(make_bucket):
+    bucket = make_bucket(price_buckets_per_line_item=3)
+    assert bucket.group_price_buckets([100, 110, 120, 130, 140, 150, 160]) == [[100, 110, 120], [130, 140, 150], [160]]
+
+
+def test_group_price_buckets_price_spread(make_bucket):
+    bucket = make_bucket(price_buckets_per_line_item=5, max_line_item_price_spread=20)
+    assert bucket.group_price_buckets([100, 110, 120, 130, 200, 205]) == [[100, 110, 120], [130], [200, 205]]
+
+
+def test_group_price_buckets_deduplicates_mapped_buckets(make_bucket):
+    bucket = make_bucket(price_buckets_per_line_item=2)
+    assert bucket.group_price_buckets([120, 100, 100, 110]) == [[100, 110], [120]]
+
+
+def test_line_item_cpm(make_bucket):
+    group = [100, 110, 125]
+    assert make_bucket().get_line_item_cpm(group) == 100
+    assert make_bucket(line_item_cpm='mid').get_line_item_cpm(group) == 112
+    assert make_bucket(line_item_cpm='max').get_line_item_cpm(group) == 125
+
+
+def test_line_item_name_and_price_range(make_bucket):
+    bucket = make_bucket()
+    assert bucket.get_line_item_name([500]) == 'stroeer_ssp_wallpaper_5.0'
+    assert bucket.get_line_item_name([500, 520]) == 'stroeer_ssp_wallpaper_5.0-5.2'
+    assert bucket.get_line_item_price_range('stroeer_ssp_wallpaper_5.0-5.2') == (500, 520)
+    assert bucket.get_line_item_price_range('stroeer_ssp_wallpaper_5.0') == (500, 500)
+    assert bucket.get_line_item_price_range('stroeer_ssp_fireplace_5.0') is None
+
+
+def line_item_names(bucket, groups):
+    return [bucket.get_line_item_name(group) for group in groups]
+
+
+def test_pack_without_existing_orders(make_bucket, monkeypatch):
+    monkeypatch.setattr('dfp_api.MAX_LINE_ITEMS_PER_ORDER', 2)
+    bucket = make_bucket()
+    orders = bucket.pack_line_items_into_orders([[100], [110], [120]], {})
+    assert orders == {'stroeer_ssp_wallpaper_1.0-1.1': [[100], [110]], 'stroeer_ssp_wallpaper_1.2-1.2': [[120]]}
+
+
+def test_pack_fills_spare_capacity_in_price_order(make_bucket, monkeypatch):
+    monkeypatch.setattr('dfp_api.MAX_LINE_ITEMS_PER_ORDER', 3)
+    bucket = make_bucket()
+    # the order of the higher prices sorts first by name
+    existing_orders = {
+        'stroeer_ssp_wallpaper_10.0-10.1': {'id': 2, 'line_item_names': line_item_names(bucket, [[1000], [1010]])},
+        'stroeer_ssp_wallpaper_5.0-5.1': {'id': 1, 'line_item_names': line_item_names(bucket, [[500], [510]])},
+    }
+    orders = bucket.pack_line_items_into_orders([[500], [510], [520], [1000], [1010], [1020], [1030]], existing_orders)
+    assert orders == {
+        'stroeer_ssp_wallpaper_5.0-5.1': [[500], [510], [520]],
+        'stroeer_ssp_wallpaper_10.0-10.1': [[1000], [1010], [1020]],
+        'stroeer_ssp_wallpaper_10.3-10.3': [[1030]],
+    }
+
+
+def test_pack_skips_full_orders(make_bucket, monkeypatch):
+    monkeypatch.setattr('dfp_api.MAX_LINE_ITEMS_PER_ORDER', 2)
+    bucket = make_bucket()
+    existing_orders = {'stroeer_ssp_wallpaper_1.0-1.1': {'id': 1, 'line_item_names': line_item_names(bucket, [[100], [110]])}}
+    orders = bucket.pack_line_items_into_orders([[120], [130]], existing_orders)
+    assert orders == {'stroeer_ssp_wallpaper_1.2-1.3': [[120], [130]]}
+
+
+def test_pack_suffixes_colliding_order_names(make_bucket, monkeypatch):
+    monkeypatch.setattr('dfp_api.MAX_LINE_ITEMS_PER_ORDER', 2)
+    bucket = make_bucket()
+    # a full order holding other line items than its name says, e.g. after a --price-buckets-per-line-item change
+    existing_orders = {
+        'stroeer_ssp_wallpaper_1.0-1.1': {'id': 1, 'line_item_names': line_item_names(bucket, [[100, 105], [110, 115]])},
+        'stroeer_ssp_wallpaper_1.0-1.1_2': {'id': 2, 'line_item_names': line_item_names(bucket, [[120, 125], [130, 135]])},
+    }
+    orders = bucket.pack_line_items_into_orders([[100], [110]], existing_orders)
+    assert orders == {'stroeer_ssp_wallpaper_1.0-1.1_3': [[100], [110]]}
+
+
+def test_missing_price_buckets_without_ladder(make_bucket):
+    assert make_bucket().get_missing_price_buckets([100, 110], {}) == [100, 110]
+
+
+def test_missing_price_buckets_with_consolidated_line_items(make_bucket):
+    bucket = make_bucket()
+    existing_orders = {
+        'stroeer_ssp_wallpaper_1.0-1.4': {'id': 1, 'line_item_names': ['stroeer_ssp_wallpaper_1.0-1.2', 'stroeer_ssp_wallpaper_1.3', 'not_managed']},
+        'stroeer_ssp_wallpaper_2.0-2.0': {'id': 2, 'line_item_names': ['stroeer_ssp_wallpaper_2.0']},
+    }
+    price_buckets = [100, 105, 110, 120, 130, 140, 200, 210]
+    assert bucket.get_missing_price_buckets(price_buckets, existing_orders) == [140, 210]
+
+
+def test_missing_price_buckets_with_overlapping_ranges(make_bucket):
+    bucket = make_bucket()
+    existing_orders = {'order': {'id': 1, 'line_item_names': ['stroeer_ssp_wallpaper_1.0-1.5', 'stroeer_ssp_wallpaper_1.2-1.3', 'stroeer_ssp_wallpaper_1.4-2.0']}}
+    assert bucket.get_missing_price_buckets([90, 100, 140, 160, 200, 210], existing_orders) == [90, 210]
+
+
+class ExistingSetupClient():
+    """
+    DfpClient of a network where the creatives and the creative set of the ladder exist, creates are recorded.
+    """
+
+    network_code = '1234'
+
+    def __init__(self):
+        self.created = []
+
+    def GetService(self, service_name, version=None):
+        def by_name(statement):
+            names = [value['value']['value'] for value in statement['values']]
+            return {'totalResultSetSize': len(names), 'results': [{'id': 50 + index, 'name': name} for index, name in enumerate(names)]}
+
+        def create(items):
+            self.created.append(service_name)
+            raise AssertionError(f'{service_name} created an existing entity')
+
+        return type(service_name, (), {
+            'getCreativesByStatement': staticmethod(by_name),
+            'getCreativeSetsByStatement': staticmethod(by_name),
+            'createCreatives': staticmethod(create),
+            'createCreativeSet': staticmethod(create),
+        })()
+
+
+def test_extend_run_reuses_the_existing_creative_set(make_bucket, monkeypatch):
+    bucket = make_bucket()
+    bucket.dfp_client = ExistingSetupClient()
+    bucket.resolve_target_ad_units = lambda: ['1']
+    # the ladder holds 1.00-1.50, the extension adds 1.60-2.00
+    existing_orders = {'stroeer_ssp_wallpaper_1.0-1.5': {'id': 1, 'line_item_names': line_item_names(bucket, [[pb] for pb in range(100, 151, 10)])}}
+    licas = []
+    monkeypatch.setattr('dfp_api.get_bucket_key', lambda dfp_client, key_name, key_type: 11)
+    monkeypatch.setattr('dfp_api.get_orders_with_line_item_names', lambda dfp_client, prefix: existing_orders)
+    monkeypatch.setattr('dfp_api.create_missing_key_values', lambda dfp_client, key_id, key_name, values: [{'name': f'{pb / 100:.2f}', 'id': pb} for pb in values])
+    monkeypatch.setattr('dfp_api.create_targeting_key_values', lambda dfp_client, key_id, key_name, values: [{'name': value, 'id': 5} for value in values])
+    monkeypatch.setattr('dfp_api.create_orders_buckets', lambda dfp_client, orders, trafficker_id, advertiser_id: {order: 2 for order in orders})
+    monkeypatch.setattr('dfp_api.create_line_item_bulk', lambda dfp_client, line_items: [{'id': 1000 + index} for index in range(len(line_items))])
+    monkeypatch.setattr('dfp_api.create_licas_buckets_creative_set', lambda dfp_client, creative_set_id, creative_id, li_ids: licas.append((creative_set_id, creative_id, li_ids)))
+
+    with GamSession().activate() as session:
+        bucket.extend_run()
+
+    assert bucket.dfp_client.created == []
+    assert licas == [(50, 50, [1000, 1001, 1002, 1003, 1004])]
+    assert session.skipped['creative_sets'] == [50]
+    assert session.creative_sets['stroeer_ssp_wallpaper_creative_set']['id'] == 50
@@ -0,0 +1,35 @@
+import importlib
+
+import pytest
+
+import validation_helper
+from line_item_api import JobConfig
+
+line_item_creator = importlib.import_module('line-item-creator')
+
+REQUIRED_ARGS = ['--dfp-id', '1234', '--format', 'wallpaper', '--line-item-type', 'price-priority', '--line-item-priority', '12',
+                 '--master-size', '728x90', '--companion-sizes', '160x600', '--advertiser-id', '1', '--trafficker-id', '2']
+
+
+def test_cli_accepts_one_run_mode():
+    for mode in ['--verify', '--preflight', '--extend', '--prune-delivery']:
+        args = vars(line_item_creator.parse_cli_args(REQUIRED_ARGS + [mode]))
+        assert args[mode[2:].replace('-', '_')]
+
+
+@pytest.mark.parametrize('modes', [['--verify', '--preflight'], ['--extend', '--prune-delivery'], ['--preflight', '--extend']])
+def test_cli_rejects_combined_run_modes(modes, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        line_item_creator.parse_cli_args(REQUIRED_ARGS + modes)
+    assert exit_info.value.code == 2
+    assert f'argument {modes[1]}: not allowed with argument {modes[0]}' in capsys.readouterr().err
+
+
+def test_job_config_rejects_combined_run_modes():
+    with pytest.raises(ValueError):
+        validation_helper.validate_run_modes({'verify': True, 'preflight': True})
+    config = JobConfig(dfp_id=1234, format='wallpaper', line_item_type='price_priority', line_item_priority=12,
+                       master_size=[728, 90], companion_sizes=[[160, 600]], advertiser_id=1, trafficker_id=2,
+                       start_price_bucket=100, end_price_bucket=200, price_bucket_step=10, verify=True, preflight=True)
+    with pytest.raises(ValueError):
+        config.validate()
@@ -0,0 +1,79 @@
+import datetime
+
+from delivery import plan_pruning, read_delivery, run_delivery_report
+
+
+def ladder(impressions: list[int], start: int = 100, step: int = 10) -> list[dict]:
+    return [{'id': index, 'name': f'li_{index}', 'price_buckets': [start + index * step], 'impressions': count}
+            for index, count in enumerate(impressions)]
+
+
+def ids(line_items: list[dict]) -> list[int]:
+    return [line_item['id'] for line_item in line_items]
+
+
+def test_plan_pruning_merges_low_delivery():
+    plan = plan_pruning(ladder([500, 10, 20, 80, 600, 30]), min_impressions=100)
+    assert ids(plan['keep']) == [0, 4, 5]
+    assert [ids(merge['replaces']) for merge in plan['merge']] == [[1, 2, 3]]
+    assert plan['merge'][0]['price_buckets'] == [110, 120, 130]
+    assert plan['merge'][0]['impressions'] == 110
+    assert plan['archive'] == []
+
+
+def test_plan_pruning_archives_above_highest_delivery():
+    plan = plan_pruning(ladder([500, 200, 0, 300, 0, 0]), min_impressions=100, max_archived=2)
+    assert ids(plan['keep']) == [0, 1, 2, 3]
+    assert ids(plan['archive']) == [4, 5]
+
+
+def test_plan_pruning_caps_the_archived_top():
+    # nothing is archived by default
+    plan = plan_pruning(ladder([500, 300, 0, 0, 0]), min_impressions=100)
+    assert ids(plan['keep']) == [0, 1, 2, 3, 4]
+    assert plan['archive'] == []
+
+    # the highest prices are archived first
+    plan = plan_pruning(ladder([500, 300, 0, 0, 0]), min_impressions=100, max_archived=2)
+    assert ids(plan['keep']) == [0, 1, 2]
+    assert ids(plan['archive']) == [3, 4]
+
+
+def test_plan_pruning_keeps_ladder_without_delivery():
+    line_items = ladder([0, 0, 0])
+    assert plan_pruning(line_items, min_impressions=100) == {'keep': line_items, 'merge': [], 'archive': []}
+
+
+def test_plan_pruning_price_spread_and_bucket_limits():
+    line_items = ladder([1, 1, 1, 1, 1, 1000])
+    spread = plan_pruning(line_items, min_impressions=100, max_price_spread=20)
+    assert [ids(merge['replaces']) for merge in spread['merge']] == [[0, 1, 2], [3, 4]]
+
+    buckets = plan_pruning(line_items, min_impressions=100, max_price_buckets=2)
+    assert [ids(merge['replaces']) for merge in buckets['merge']] == [[0, 1], [2, 3]]
+    assert ids(buckets['keep']) == [4, 5]
+
+
+def test_read_delivery_sums_rows_per_line_item():
+    rows = [
+        {'Dimension.LINE_ITEM_ID': '1', 'Column.AD_SERVER_IMPRESSIONS': '10', 'Column.AD_SERVER_CPM_AND_CPC_REVENUE': '5000'},
+        {'Dimension.LINE_ITEM_ID': '1', 'Column.AD_SERVER_IMPRESSIONS': '5', 'Column.AD_SERVER_CPM_AND_CPC_REVENUE': ''},
+        {'Dimension.LINE_ITEM_ID': '2', 'Column.AD_SERVER_IMPRESSIONS': '', 'Column.AD_SERVER_CPM_AND_CPC_REVENUE': '0'},
+    ]
+    assert read_delivery(rows) == {1: {'impressions': 15, 'revenue_micros': 5000}, 2: {'impressions': 0, 'revenue_micros': 0}}
+
+
+def test_delivery_report_has_the_filtered_order_dimension():
+    report_jobs = []
+
+    class DataDownloader():
+        def WaitForReport(self, report_job, poll_time_seconds):
+            report_jobs.append(report_job)
+            return 1
+
+    dfp_client = type('DfpClient', (), {'GetDataDownloader': lambda self, version: DataDownloader()})()
+    assert run_delivery_report(dfp_client, [11, 12], datetime.date(2026, 1, 1), datetime.date(2026, 1, 31)) == 1
+
+    report_query = report_jobs[0]['reportQuery']
+    assert report_query['statement']['query'].startswith('WHERE ORDER_ID IN (11, 12)')
+    assert 'ORDER_ID' in report_query['dimensions'] and 'LINE_ITEM_ID' in report_query['dimensions']
@@ -0,0 +1,43 @@
+import re
+
+import dfp_api
+from session import GamSession
+
+
+class ConcurrentValuesClient():
+    """
+    DfpClient of a network where a concurrent run creates the values between the existence check and the create.
+    """
+
+    network_code = '1234'
+
+    def __init__(self, existing_names: list[str]):
+        self.values = {name: {'id': 100 + index, 'name': name, 'customTargetingKeyId': 7, 'status': 'ACTIVE'} for index, name in enumerate(existing_names)}
+        self.created = False
+
+    def GetService(self, service_name, version=None):
+        return self
+
+    def getCustomTargetingValuesByStatement(self, statement):
+        names = re.findall(r"'([^']+)'", statement['query'].split('IN', 1)[1])
+        results = [self.values[name] for name in names if name in self.values]
+        return {'totalResultSetSize': len(results), 'results': results}
+
+    def createCustomTargetingValues(self, key_values):
+        for index, value in enumerate(key_values):
+            self.values[value['name']] = dict(value, id=200 + index, status='ACTIVE')
+        self.created = True
+        raise Exception('[CustomTargetingError.VALUE_NAME_DUPLICATE @ [0].name]')
+
+
+def test_create_missing_key_values_reads_values_after_a_duplicate_error():
+    client = ConcurrentValuesClient(['1.00'])
+    session = GamSession()
+    session.key_ids['stroeer_ssp_hb_pb'] = 7
+    with session.activate():
+        values = dfp_api.create_missing_key_values(client, 7, 'stroeer_ssp_hb_pb', [100, 110, 120])
+
+    assert client.created
+    assert [(value['id'], value['name']) for value in values] == [(200, '1.10'), (201, '1.20'), (100, '1.00')]
+    assert {type(value) for value in values} == {type(values[-1])}
+    assert session.created['key_values'] == [200, 201] and session.skipped['key_values'] == [100]
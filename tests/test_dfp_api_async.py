@@ -0,0 +1,125 @@
+import asyncio
+
+import requests
+
+import dfp_api_async
+from session import GamSession
+from transport import TransportSettings
+
+
+class FakeAsyncService():
+    """
+    AsyncDfpService with canned responses, every call is recorded as (method name, argument).
+    """
+
+    def __init__(self, calls: list, **responses):
+        self.calls = calls
+        self.responses = responses
+
+    def __getattr__(self, method_name):
+        respond = self.responses[method_name]
+
+        # create_line_items is also passed the dfp client
+        async def call(*arguments):
+            self.calls.append((method_name, arguments[-1]))
+            return respond(arguments[-1])
+        return call
+
+
+class FakeAsyncClient():
+
+    def __init__(self, max_batch_items: int = 200, **services):
+        self.network_code = '1234'
+        self.dfp_client = type('DfpClient', (), {'transport_settings': TransportSettings(max_batch_items=max_batch_items), 'batchers': {}})()
+        self.calls = []
+        self.services = {name: FakeAsyncService(self.calls, **responses) for name, responses in services.items()}
+
+    def GetService(self, service_name, version=None):
+        return self.services[service_name]
+
+
+def with_ids(items: list, first_id: int, **fields) -> list:
+    return [dict(item, id=first_id + index, **fields) for index, item in enumerate(items)]
+
+
+async def run_in_session(session: GamSession, coroutine):
+    with session.activate():
+        return await coroutine
+
+
+def test_async_creates_write_back_into_session():
+    client = FakeAsyncClient(
+        OrderService={
+            'getOrdersByStatement': lambda statement: {},
+            'createOrders': lambda orders: with_ids(orders, 100, status='DRAFT'),
+        },
+        CustomTargetingService={
+            'createCustomTargetingKeys': lambda keys: with_ids(keys, 7),
+            'getCustomTargetingValuesByStatement': lambda statement: {'totalResultSetSize': 0},
+            'createCustomTargetingValues': lambda values: with_ids(values, 200, status='ACTIVE'),
+        },
+        CreativeService={
+            'createCreatives': lambda creatives: with_ids(creatives, 300),
+        },
+    )
+    session = GamSession()
+    session.key_values[(7, True)] = []
+
+    async def run():
+        with session.activate():
+            key_id = await dfp_api_async.create_targeting_key(client, 'stroeer_ssp_hb_pb', 'PREDEFINED')
+            await dfp_api_async.create_key_values(client, key_id, [100, 110], 'stroeer_ssp_hb_pb')
+            await dfp_api_async.create_orders_buckets(client, ['stroeer_ssp_wallpaper_1.0-1.1'], '2', '1')
+            await dfp_api_async.create_third_party_creative(client, 'stroeer_ssp_wallpaper_master', {'width': 1, 'height': 1}, 'snippet', 1)
+    asyncio.run(run())
+
+    assert session.key_ids == {'stroeer_ssp_hb_pb': 7}
+    assert [(value['id'], value['name']) for value in session.key_values[(7, True)]] == [(200, '1.00'), (201, '1.10')]
+    assert session.orders['stroeer_ssp_wallpaper_1.0-1.1']['id'] == 100
+    assert session.creatives['stroeer_ssp_wallpaper_master']['id'] == 300
+    assert session.created == {'keys': [7], 'key_values': [200, 201], 'orders': [100]}
+
+    # the memo answers the key lookup of a later call
+    calls = len(client.calls)
+    assert asyncio.run(run_in_session(session, dfp_api_async._get_key_id(client, 'stroeer_ssp_hb_pb'))) == 7
+    assert len(client.calls) == calls
+
+
+def create_within(max_items: int, item_id):
+    # fails like google admanager on requests above max_items
+    def create(items: list) -> list:
+        if len(items) > max_items:
+            raise requests.exceptions.Timeout('read timed out')
+        return [dict(item, id=item_id(item)) for item in items]
+    return create
+
+
+def test_line_items_and_licas_shrink_oversized_batches():
+    client = FakeAsyncClient(
+        max_batch_items=40,
+        LineItemService={'create_line_items': create_within(10, lambda line_item: 1000 + int(line_item['name'][3:]))},
+        LineItemCreativeAssociationService={
+            'getLineItemCreativeAssociationsByStatement': lambda statement: {'totalResultSetSize': 0},
+            'createLineItemCreativeAssociations': create_within(10, lambda lica: lica['lineItemId']),
+        },
+    )
+    session = GamSession()
+    # a complete scan of the prefix found no line items, the existence checks are answered by the session
+    session.index('line_items', 'li_', [])
+    line_items = [{'name': f'li_{index}'} for index in range(45)]
+
+    async def run():
+        with session.activate():
+            created = await dfp_api_async.create_line_item_bulk(client, line_items)
+            licas = await dfp_api_async.create_licas_buckets_creative_set(client, 5, 6, [line_item['id'] for line_item in created])
+            return created, licas
+    created, licas = asyncio.run(run())
+
+    assert [line_item['id'] for line_item in created] == list(range(1000, 1045))
+    assert [lica['lineItemId'] for lica in licas] == list(range(1000, 1045))
+    for operation in ['create_line_items', 'createLineItemCreativeAssociations']:
+        sizes = [len(argument) for method_name, argument in client.calls if method_name == operation]
+        # the first batches of 40 failed and were sent again in batches of at most 10
+        assert sizes[0] == 40 and max(sizes[1:]) <= 20 and sum(size for size in sizes if size <= 10) == 45
+    assert client.dfp_client.batchers['createLineItems'].item_budget <= 20
+    assert client.dfp_client.batchers['createLineItemCreativeAssociations'].item_budget <= 20
@@ -0,0 +1,31 @@
+import line_item_api
+from line_item_api import JobConfig, run_job
+from session import GamSession
+
+
+def test_jobs_of_a_shared_session_report_their_own_ids(monkeypatch):
+    def run_bucket(bucket, args):
+        # the first job creates an order and has a rejected line item, the second one finds the order
+        if 'order' in bucket.session.orders:
+            bucket.session.record('orders', [], [bucket.session.orders['order']['id']])
+        else:
+            bucket.session.orders['order'] = {'id': 1, 'name': 'order'}
+            bucket.session.record('orders', [1])
+            bucket.session.reject('createLineItems', 'line_item', [])
+        return {'rejected': bucket.session.rejected}
+
+    monkeypatch.setattr(line_item_api.line_item_creator, 'run_bucket', run_bucket)
+    config = JobConfig(dfp_id=1234, format='wallpaper', line_item_type='price_priority', line_item_priority=12,
+                       master_size=[728, 90], companion_sizes=[[160, 600]], advertiser_id=1, trafficker_id=2,
+                       start_price_bucket=100, end_price_bucket=200, price_bucket_step=10, lease_backend='none')
+    session = GamSession()
+
+    first = run_job(config, dfp_client=object(), session=session)
+    second = run_job(config, dfp_client=object(), session=session)
+
+    assert first.created == {'orders': [1]} and first.report['rejected'] == {'createLineItems': [{'item': 'line_item', 'errors': []}]}
+    assert second.created == {'orders': []} and second.skipped == {'orders': [1]}
+    assert second.report['rejected'] == {}
+    # the passed session only keeps the shared lookups
+    assert session.orders == {'order': {'id': 1, 'name': 'order'}}
+    assert session.created == {} and session.rejected == {}
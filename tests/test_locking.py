@@ -0,0 +1,96 @@
+import json
+import os
+import time
+
+import pytest
+
+from batching import AdaptiveBatcher
+from locking import FileLeaseBackend, Lease, LeaseBackend, LeaseLostError, check_leases, get_lease_backend, new_lease
+from session import GamSession
+
+
+def test_lease_backend_is_abstract():
+    with pytest.raises(TypeError):
+        LeaseBackend()
+
+    class ReadOnlyBackend(LeaseBackend):
+        def read(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnlyBackend()
+
+
+def test_get_lease_backend():
+    assert get_lease_backend('none') is None
+    assert isinstance(get_lease_backend('file'), FileLeaseBackend)
+    assert isinstance(get_lease_backend('locking:FileLeaseBackend'), FileLeaseBackend)
+    with pytest.raises(ValueError):
+        get_lease_backend('locking')
+
+
+def test_file_backend_acquire_renew_release(tmp_path):
+    backend = FileLeaseBackend(str(tmp_path))
+    assert backend.acquire('1234_wallpaper', 'a', 60)
+    assert backend.acquire('1234_wallpaper', 'a', 60)
+    assert not backend.acquire('1234_wallpaper', 'b', 60)
+    assert backend.acquire('1234_fireplace', 'b', 60)
+
+    assert backend.renew('1234_wallpaper', 'a', 60)
+    assert not backend.renew('1234_wallpaper', 'b', 60)
+
+    backend.release('1234_wallpaper', 'b')
+    assert backend.read('1234_wallpaper')['owner'] == 'a'
+    backend.release('1234_wallpaper', 'a')
+    assert backend.read('1234_wallpaper') is None
+    assert backend.acquire('1234_wallpaper', 'b', 60)
+
+
+def test_file_backend_takes_over_stale_leases(tmp_path):
+    backend = FileLeaseBackend(str(tmp_path))
+    expired = dict(new_lease('a', 60), expires_at=time.time() - 1)
+    with open(os.path.join(str(tmp_path), '1234_wallpaper.lease'), 'w') as lease_file:
+        json.dump(expired, lease_file)
+    assert backend.acquire('1234_wallpaper', 'b', 60)
+    assert not backend.renew('1234_wallpaper', 'a', 60)
+
+    # a lease of a process on this host that's gone
+    dead_process = dict(new_lease('c', 60), pid=2 ** 22 + 1)
+    with open(os.path.join(str(tmp_path), '1234_fireplace.lease'), 'w') as lease_file:
+        json.dump(dead_process, lease_file)
+    assert backend.acquire('1234_fireplace', 'b', 60)
+
+
+def test_lease_fails_fast_while_held(tmp_path):
+    backend = FileLeaseBackend(str(tmp_path))
+    with Lease(backend, '1234_wallpaper'):
+        with pytest.raises(TimeoutError):
+            Lease(backend, '1234_wallpaper').acquire()
+    with Lease(backend, '1234_wallpaper'):
+        pass
+
+
+def test_lease_is_registered_in_the_session(tmp_path):
+    backend = FileLeaseBackend(str(tmp_path))
+    with GamSession().activate() as session:
+        with Lease(backend, '1234_wallpaper') as lease:
+            assert session.leases == [lease]
+        assert session.leases == []
+
+
+def test_lost_lease_stops_create_batches(tmp_path):
+    backend = FileLeaseBackend(str(tmp_path))
+    created = []
+    with GamSession().activate():
+        with Lease(backend, '1234_wallpaper', ttl=0.3) as lease:
+            check_leases('createLineItems')
+            # another run takes the lease over, the next renewal fails
+            backend._write('1234_wallpaper', new_lease('other', 60))
+            deadline = time.monotonic() + 5
+            while not lease.lost and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert lease.lost
+
+            with pytest.raises(LeaseLostError):
+                AdaptiveBatcher('createLineItems').run([{'name': 'a'}], created.extend)
+    assert created == []
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+import pql
+
+
+class FakePqlService():
+
+    def __init__(self, rows: list[list], asynchronous: bool = False):
+        self.rows = rows
+        self.queries = []
+        self.asynchronous = asynchronous
+
+    def _select(self, statement):
+        self.queries.append(statement['query'])
+        offset = int(statement['query'].rsplit('OFFSET ', 1)[1])
+        limit = int(statement['query'].split('LIMIT ')[1].split(' ')[0])
+        return {'rows': [{'values': [{'value': value} for value in row]} for row in self.rows[offset:offset + limit]]}
+
+    def select(self, statement):
+        if not self.asynchronous:
+            return self._select(statement)
+
+        async def select_async():
+            return self._select(statement)
+        return select_async()
+
+
+ROWS = [[str(line_item_id), f'line_item_{line_item_id}', '7'] for line_item_id in range(5)]
+
+
+def test_select_pages():
+    service = FakePqlService(ROWS)
+    pages = list(pql.select_pages(service, 'Line_Item', ('id', 'name', 'orderId'), 'WHERE OrderId IN (7)', limit=2))
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert pages[0][1] == (1, 'line_item_1', 7)
+    assert pages[0][1]['name'] == 'line_item_1'
+    assert service.queries[0] == 'SELECT Id, Name, OrderId FROM Line_Item WHERE OrderId IN (7) ORDER BY Id ASC LIMIT 2 OFFSET 0'
+
+
+def test_select_pages_async():
+    service = FakePqlService(ROWS, asynchronous=True)
+
+    async def read():
+        return [page async for page in pql.select_pages_async(service, 'Line_Item', ('orderId', 'name'), limit=3)]
+    pages = asyncio.run(read())
+    assert [[line_item['name'] for line_item in page] for page in pages] == [['line_item_0', 'line_item_1', 'line_item_2'], ['line_item_3', 'line_item_4']]
+
+
+def test_select_converts_types():
+    service = FakePqlService([['1', 'true', None]])
+    assert pql.select(service, 'Line_Item', ('id', 'isArchived', 'status')) == [(1, True, None)]
+
+
+def test_unsupported_fields():
+    with pytest.raises(ValueError):
+        pql.select(FakePqlService([]), 'Line_Item', ('id', 'targeting'))
@@ -0,0 +1,38 @@
+import pytest
+
+import preflight
+import validation_helper
+from validation_helper import MAX_LINE_ITEM_PRIORITY, MIN_LINE_ITEM_PRIORITY
+
+
+def test_cli_and_preflight_share_the_priority_range():
+    assert preflight.NETWORK_LIMITS['min_priority'] == MIN_LINE_ITEM_PRIORITY
+    assert preflight.NETWORK_LIMITS['max_priority'] == MAX_LINE_ITEM_PRIORITY
+    assert validation_helper.validate_line_item_priority(str(MIN_LINE_ITEM_PRIORITY)) == MIN_LINE_ITEM_PRIORITY
+    assert validation_helper.validate_line_item_priority(str(MAX_LINE_ITEM_PRIORITY)) == MAX_LINE_ITEM_PRIORITY
+    for priority in [MIN_LINE_ITEM_PRIORITY - 1, MAX_LINE_ITEM_PRIORITY + 1]:
+        with pytest.raises(ValueError):
+            validation_helper.validate_line_item_priority(str(priority))
+
+
+def test_check_plan_accepts_a_valid_plan(make_bucket):
+    plan = make_bucket(end_time='2099-01-31 23:59:00').plan_run()
+    assert preflight.check_plan(plan, preflight.NETWORK_LIMITS, 1024 * 1024) == []
+
+
+def test_check_plan_checks_every_line_item(make_bucket):
+    plan = make_bucket().plan_run()
+    line_items = plan['line_items']
+    assert len(line_items) > 3
+    line_items[1]['priority'] = 0
+    line_items[2]['priority'] = 17
+    line_items[3]['priority'] = 17
+    line_items[1].update(startDateTimeType='USE_START_DATE_TIME', startDateTime='2020-01-01 00:00:00')
+    line_items[2].update(unlimitedEndDateTime=False, endDateTime='2020-01-31 23:59:00')
+    line_items[3].update(unlimitedEndDateTime=False, endDateTime='2020-01-31 23:59:00')
+
+    assert preflight.check_plan(plan, preflight.NETWORK_LIMITS, 1024 * 1024) == [
+        f'Line item priority 0, 17 is outside of {MIN_LINE_ITEM_PRIORITY}-{MAX_LINE_ITEM_PRIORITY}',
+        'Start time 2020-01-01 00:00:00 is in the past',
+        'End time 2020-01-31 23:59:00 is in the past',
+    ]
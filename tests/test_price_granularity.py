@@ -0,0 +1,39 @@
+import pytest
+
+from price_granularity import PRICE_GRANULARITY_PRESETS, generate_price_buckets, parse_price_granularity
+
+
+def test_parse_preset():
+    assert parse_price_granularity(' Dense ') == PRICE_GRANULARITY_PRESETS['dense']
+
+
+def test_parse_custom_ranges():
+    assert parse_price_granularity('1-300:1, 300-800:5') == [(1, 300, 1), (300, 800, 5)]
+
+
+def test_parse_invalid_range():
+    with pytest.raises(ValueError):
+        parse_price_granularity('1-3.5:1')
+
+
+def test_generate_single_range():
+    assert generate_price_buckets([(500, 550, 25)]) == [500, 525, 550]
+
+
+def test_generate_shared_boundary_once():
+    price_buckets = generate_price_buckets([(1, 300, 1), (300, 800, 5)])
+    assert price_buckets.count(300) == 1
+    assert price_buckets[:3] == [1, 2, 3]
+    assert price_buckets[-2:] == [795, 800]
+    assert len(price_buckets) == 300 + 100
+
+
+def test_generate_adds_end_of_uneven_range():
+    assert generate_price_buckets([(10, 25, 10)]) == [10, 20, 25]
+
+
+def test_generate_dense_preset():
+    price_buckets = generate_price_buckets(PRICE_GRANULARITY_PRESETS['dense'])
+    assert price_buckets == sorted(set(price_buckets))
+    assert price_buckets[0] == 1 and price_buckets[-1] == 2000
+    assert len(price_buckets) == 300 + 100 + 24
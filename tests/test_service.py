@@ -0,0 +1,47 @@
+import importlib
+
+import pytest
+
+line_item_service = importlib.import_module('line-item-service')
+
+
+@pytest.fixture
+def runner():
+    # without worker threads, jobs are only scheduled
+    return line_item_service.JobRunner(0, 'googleads.yaml')
+
+
+def create_job(dfp_id: int, format: str):
+    return line_item_service.Job({}, {'dfp_id': dfp_id, 'format': format, 'write': True})
+
+
+def test_next_job_skips_running_ladders(runner):
+    first, second, third = create_job(1, 'wallpaper'), create_job(1, 'wallpaper'), create_job(1, 'fireplace')
+    runner.pending = [first, second, third]
+    assert runner._next_job() is first
+    # the second job of the wallpaper ladder waits, the fireplace job runs next to the first one
+    assert runner._next_job() is third
+    assert runner.pending == [second]
+    runner.running_keys.discard(runner._run_key(first))
+    assert runner._next_job() is second
+
+
+def test_sessions_share_lookups_per_network(runner):
+    session = runner.get_session({'dfp_id': 1})
+    session.orders['order'] = ('row',)
+    session.record('orders', [1])
+    next_session = runner.get_session({'dfp_id': 1})
+    assert next_session.orders == {'order': ('row',)}
+    # the recorded ids stay with the job
+    assert next_session.created == {}
+    assert runner.get_session({'dfp_id': 2}).orders == {}
+
+
+def test_sessions_expire_and_are_dropped_after_failures(runner, monkeypatch):
+    runner.get_session({'dfp_id': 1}).orders['order'] = ('row',)
+    runner.invalidate_session({'dfp_id': 1})
+    assert runner.get_session({'dfp_id': 1}).orders == {}
+
+    runner.get_session({'dfp_id': 1}).orders['order'] = ('row',)
+    monkeypatch.setattr(line_item_service, 'SESSION_TTL', -1)
+    assert runner.get_session({'dfp_id': 1}).orders == {}
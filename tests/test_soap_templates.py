@@ -0,0 +1,163 @@
+import os
+
+import googleads.common
+import pytest
+from googleads import ad_manager
+
+import soap_templates
+from dfp_api import VERSION_NB
+from soap_templates import LineItemTemplate
+
+# reduced LineItemService wsdl with the fields of assembled line items, the tests run offline
+WSDL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', f'LineItemService_{VERSION_NB}.wsdl')
+
+
+class OAuth2Client():
+    def CreateHttpHeader(self):
+        return {'authorization': 'Bearer test'}
+
+
+class TemplateClient():
+    network_code = '1234'
+
+    def __init__(self):
+        self.soap_templates = {}
+
+
+@pytest.fixture(scope='module')
+def line_item_service():
+    """
+    LineItemService proxy built by googleads like AdManagerClient.GetService does, with the bundled wsdl.
+    """
+    no_cache = googleads.common.ZeepServiceProxy.NO_CACHE
+    client = ad_manager.AdManagerClient(OAuth2Client(), 'buckets-tests', network_code='1234', cache=no_cache)
+    return googleads.common.ZeepServiceProxy(WSDL_PATH, client._header_handler, ad_manager._AdManagerPacker, client.proxy_config, client.timeout, VERSION_NB, cache=no_cache)
+
+
+@pytest.fixture(autouse=True)
+def clear_utility_registry():
+    # the utilities used by earlier tests would be reported in the next request, generating a signature clears them
+    googleads.common.GenerateLibSig('DfpApi-Python')
+
+
+def make_line_item_bucket(make_bucket, **options):
+    # the root ad unit is resolved during a run
+    return make_bucket(**{'target_ad_units': ['1'], **options})
+
+
+def assemble(bucket, price_buckets: list[int], order_id: int = 77) -> list[dict]:
+    groups = bucket.group_price_buckets(price_buckets)
+    orders = bucket.assemble_orders(bucket.create_price_buckets_per_order(groups))
+    pb_values = [{'name': f'{pb / 100:.2f}', 'id': 100000 + pb} for pb in price_buckets]
+    format_values = [{'name': bucket.format, 'id': 5}]
+    return bucket.assemble_line_item_jsons(orders, 11, pb_values, 12, format_values, {order: order_id + index for index, order in enumerate(orders)})
+
+
+class RequestCaptured(Exception):
+    pass
+
+
+def googleads_request(service, line_items: list[dict], monkeypatch) -> bytes:
+    """
+    Request body that service.createLineItems(line_items) sends, serialized by googleads and zeep.
+    """
+    requests = []
+
+    def post(address, message, headers):
+        requests.append(message)
+        raise RequestCaptured
+
+    with monkeypatch.context() as patch:
+        patch.setattr(service.zeep_client.transport, 'post', post)
+        with pytest.raises(RequestCaptured):
+            service.createLineItems(line_items)
+    return requests[0]
+
+
+def build_template(service, line_item: dict) -> LineItemTemplate:
+    return LineItemTemplate.build(service, soap_templates._mark_line_item(line_item), soap_templates.get_soap_headers(service))
+
+
+def render(template: LineItemTemplate, service, line_items: list[dict]) -> bytes:
+    return template.render(line_items, soap_templates.get_soap_headers(service)['RequestHeader'].applicationName)
+
+
+SETUPS = {
+    'one companion, unlimited end date': {},
+    'no companions': {'companion_sizes': []},
+    'several companions': {'master_size': [300, 250], 'companion_sizes': [[300, 600], [160, 600], [120, 600]]},
+    'ad units': {'target_ad_units': ['21', '22', '23']},
+    'several price buckets per line item': {'price_buckets_per_line_item': 3, 'line_item_cpm': 'max'},
+    'end date and goal': {'line_item_type': 'standard', 'line_item_priority': 8, 'end_time': '2030-01-31 23:59:00'},
+    'cost': {'currency': 'USD', 'line_item_cpm': 'mid', 'price_buckets_per_line_item': 2},
+}
+
+
+@pytest.mark.parametrize('options', SETUPS.values(), ids=SETUPS.keys())
+def test_render_equals_googleads_request(make_bucket, line_item_service, monkeypatch, options):
+    client = TemplateClient()
+    line_items = assemble(make_line_item_bucket(make_bucket, **options), list(range(100, 2001, 5)))
+
+    # the first request is checked against zeep, the next ones are only rendered
+    for batch in [line_items[:100], line_items[100:], line_items[:1]]:
+        _, request = soap_templates.render_request(client, line_item_service, batch)
+        assert request == googleads_request(line_item_service, batch, monkeypatch)
+
+
+def test_render_reports_utilities_like_googleads(make_bucket, line_item_service, monkeypatch):
+    # googleads lists the utilities used since the last request (e.g. the FilterStatement of an existence check)
+    # in the application name of the soap header
+    client = TemplateClient()
+    line_items = assemble(make_line_item_bucket(make_bucket), [100, 110])
+    soap_templates.render_request(client, line_item_service, line_items)
+
+    googleads.common.AddToUtilityRegistry('FilterStatement')
+    template, request = soap_templates.render_request(client, line_item_service, line_items)
+    assert template.verified
+    googleads.common.AddToUtilityRegistry('FilterStatement')
+    assert request == googleads_request(line_item_service, line_items, monkeypatch)
+    assert b'FilterStatement, zeep)' in request
+
+
+def test_render_escapes_names(make_bucket, line_item_service, monkeypatch):
+    line_items = [dict(line_item, name=f'{line_item["name"]} & <ü>') for line_item in assemble(make_line_item_bucket(make_bucket), [100, 110])]
+    template = build_template(line_item_service, line_items[0])
+    assert render(template, line_item_service, line_items) == googleads_request(line_item_service, line_items, monkeypatch)
+
+
+def test_render_rejects_unsafe_values(make_bucket, line_item_service):
+    line_items = assemble(make_line_item_bucket(make_bucket), [100, 110])
+    template = build_template(line_item_service, line_items[0])
+    assert render(template, line_item_service, [dict(line_items[0], name='a\rb')]) is None
+    assert render(template, line_item_service, [dict(line_items[0], orderId=77.0)]) is None
+    assert template.render(line_items, 'a\x00b') is None
+
+
+def test_template_leaves_out_the_authorization(make_bucket, line_item_service):
+    template = build_template(line_item_service, assemble(make_line_item_bucket(make_bucket), [100])[0])
+    assert 'authorization' not in template.http_headers
+    assert soap_templates.get_http_headers(line_item_service, template)['authorization'] == 'Bearer test'
+    assert template.address == f'https://ads.google.com/apis/ads/publisher/{VERSION_NB}/LineItemService'
+
+
+def test_render_request_per_structure(make_bucket, line_item_service):
+    client = TemplateClient()
+    line_items = assemble(make_line_item_bucket(make_bucket), list(range(100, 300, 10)))
+    template, _ = soap_templates.render_request(client, line_item_service, line_items)
+    assert template.verified
+
+    # another structure gets its own template, mixed structures are serialized by zeep
+    other_line_items = assemble(make_line_item_bucket(make_bucket, companion_sizes=[]), [100])
+    assert soap_templates.render_request(client, line_item_service, other_line_items)[0] is not template
+    assert soap_templates.render_request(client, line_item_service, line_items[:1] + other_line_items) is None
+    assert len(client.soap_templates) == 2
+
+
+def test_render_request_drops_differing_templates(make_bucket, line_item_service):
+    client = TemplateClient()
+    line_items = assemble(make_line_item_bucket(make_bucket), [100, 110])
+    template, _ = soap_templates.render_request(client, line_item_service, line_items)
+    template.verified = False
+    template.prefix_tail += ' '
+    assert soap_templates.render_request(client, line_item_service, line_items) is None
+    assert list(client.soap_templates.values()) == [None]
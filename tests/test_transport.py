@@ -0,0 +1,35 @@
+import googleads.common
+import requests
+from googleads import ad_manager
+
+from dfp_api import VERSION_NB
+from transport import TransportSettings, TunedDfpClient
+
+
+class OAuth2Client():
+    def CreateHttpHeader(self):
+        return {'authorization': 'Bearer test'}
+
+
+def test_tuned_client_keeps_the_googleads_session_settings(monkeypatch):
+    def get_service(client, service_name, version=None, server=None):
+        # the transport session as googleads configures it from googleads.yaml
+        session = requests.Session()
+        session.verify = '/etc/ssl/company-ca.pem'
+        session.cert = ('/etc/ssl/client.pem', '/etc/ssl/client.key')
+        session.proxies = dict(client.proxy_config.proxies)
+        transport = type('Transport', (), {'session': session, 'operation_timeout': None})()
+        return type('Service', (), {'zeep_client': type('ZeepClient', (), {'transport': transport})()})()
+
+    monkeypatch.setattr(ad_manager.AdManagerClient, 'GetService', get_service)
+    proxy_config = googleads.common.ProxyConfig(https_proxy='http://proxy:3128')
+    client = TunedDfpClient(TransportSettings(read_timeout=60), oauth2_client=OAuth2Client(), application_name='buckets-tests', network_code='1234', proxy_config=proxy_config)
+
+    service = client.GetService('LineItemService', version=VERSION_NB)
+    session = service.zeep_client.transport.session
+    assert session is client.http_session
+    assert session.verify == '/etc/ssl/company-ca.pem'
+    assert session.cert == ('/etc/ssl/client.pem', '/etc/ssl/client.key')
+    assert session.proxies == {'https': 'http://proxy:3128'}
+    assert service.zeep_client.transport.operation_timeout == (10, 60)
+    assert client.GetService('LineItemService', version=VERSION_NB) is service
@@ -0,0 +1,102 @@
+from verify import VerifyManifest, canonical_line_item, chunk_hash, content_hash, diff_fields
+
+
+class ZeepLike():
+    # google admanager responses are zeep objects, their fields are read through __values__
+    def __init__(self, **values):
+        self.__values__ = values
+
+
+def desired_line_item(**overrides) -> dict:
+    line_item = {
+        'name': 'stroeer_ssp_wallpaper_1.0',
+        'lineItemType': 'price_priority',
+        'priority': 12,
+        'costType': 'CPM',
+        'costPerUnit': {'currencyCode': 'EUR', 'microAmount': 1000000},
+        'startDateTime': '2024-05-01 00:00:00',
+        'unlimitedEndDateTime': True,
+        'creativePlaceholders': [
+            {'size': {'width': 728, 'height': 90}, 'companions': [{'size': {'width': 300, 'height': 600}}, {'size': {'width': 160, 'height': 600}}]},
+        ],
+        'targeting': {
+            'inventoryTargeting': {'targetedAdUnits': [{'adUnitId': 2}, {'adUnitId': 1}]},
+            'customTargeting': {'logicalOperator': 'AND', 'children': [
+                {'keyId': 20, 'operator': 'IS', 'valueIds': [202, 201]},
+                {'keyId': 10, 'operator': 'IS', 'valueIds': [101]},
+            ]},
+        },
+    }
+    line_item.update(overrides)
+    return line_item
+
+
+def actual_line_item(**overrides) -> ZeepLike:
+    # same line item as google admanager returns it: zeep objects, dates as DateTime, targeting as OR of AND sets
+    values = {
+        'name': 'stroeer_ssp_wallpaper_1.0',
+        'lineItemType': 'PRICE_PRIORITY',
+        'priority': 12,
+        'costType': 'CPM',
+        'costPerUnit': ZeepLike(currencyCode='EUR', microAmount=1000000),
+        'startDateTime': ZeepLike(date=ZeepLike(year=2024, month=5, day=1), hour=0, minute=0, second=0),
+        'endDateTime': ZeepLike(date=ZeepLike(year=2034, month=5, day=1), hour=0, minute=0, second=0),
+        'unlimitedEndDateTime': True,
+        'isArchived': False,
+        'creativePlaceholders': [
+            ZeepLike(size=ZeepLike(width=728, height=90), companions=[ZeepLike(size=ZeepLike(width=160, height=600)), ZeepLike(size=ZeepLike(width=300, height=600))]),
+        ],
+        'targeting': ZeepLike(
+            inventoryTargeting=ZeepLike(targetedAdUnits=[ZeepLike(adUnitId='1'), ZeepLike(adUnitId='2')]),
+            customTargeting=ZeepLike(logicalOperator='OR', children=[ZeepLike(logicalOperator='AND', children=[
+                ZeepLike(keyId=10, operator='IS', valueIds=[101]),
+                ZeepLike(keyId=20, operator='IS', valueIds=[201, 202]),
+            ])]),
+        ),
+    }
+    values.update(overrides)
+    return ZeepLike(**values)
+
+
+def test_canonical_line_item_matches_desired_and_actual():
+    desired = canonical_line_item(desired_line_item())
+    assert desired == canonical_line_item(actual_line_item())
+    assert desired['sizes'] == [['728x90', ['160x600', '300x600']]]
+    assert desired['targetedAdUnits'] == ['1', '2']
+    assert desired['customTargeting'] == [['10', 'IS', ['101']], ['20', 'IS', ['201', '202']]]
+    assert desired['endDateTime'] is None
+
+
+def test_canonical_line_item_drift():
+    desired = canonical_line_item(desired_line_item())
+    actual = canonical_line_item(actual_line_item(priority=8, costPerUnit=ZeepLike(currencyCode='EUR', microAmount=1100000)))
+    assert diff_fields(desired, actual) == ['priority', 'costPerUnit']
+    assert content_hash(desired) != content_hash(actual)
+
+
+def test_canonical_line_item_relative_dates():
+    desired = desired_line_item(startDateTime='2024-06-01 12:00:00', unlimitedEndDateTime=False, endDateTime='2025-01-01 00:00:00')
+    actual = actual_line_item(unlimitedEndDateTime=False)
+    assert diff_fields(canonical_line_item(desired), canonical_line_item(actual)) == ['startDateTime', 'endDateTime']
+    assert canonical_line_item(desired, compare_start_date=False, compare_end_date=False) == canonical_line_item(actual, compare_start_date=False, compare_end_date=False)
+
+
+def test_chunk_hash_is_independent_of_order():
+    hashes = {'stroeer_ssp_wallpaper_1.0': 'a', 'stroeer_ssp_wallpaper_1.1': 'b'}
+    assert chunk_hash(hashes) == chunk_hash(dict(reversed(list(hashes.items()))))
+    assert chunk_hash(hashes) != chunk_hash({**hashes, 'stroeer_ssp_wallpaper_1.1': 'c'})
+    assert chunk_hash(hashes) != chunk_hash({'stroeer_ssp_wallpaper_1.0': 'a'})
+
+
+def test_verify_manifest_round_trip(tmp_path):
+    manifest = VerifyManifest.load('1234', 'wallpaper', str(tmp_path))
+    assert manifest.orders == {}
+    manifest.record('stroeer_ssp_wallpaper_1.0-2.0', 1, 'hash', 1000)
+    manifest.save()
+
+    loaded = VerifyManifest.load('1234', 'wallpaper', str(tmp_path))
+    assert loaded.is_unchanged('stroeer_ssp_wallpaper_1.0-2.0', 'hash')
+    assert not loaded.is_unchanged('stroeer_ssp_wallpaper_1.0-2.0', 'other')
+    assert loaded.modified_since(['stroeer_ssp_wallpaper_1.0-2.0']) == 1000 - 5 * 60
+    loaded.forget('stroeer_ssp_wallpaper_1.0-2.0')
+    assert not loaded.is_unchanged('stroeer_ssp_wallpaper_1.0-2.0', 'hash')
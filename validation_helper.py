@@ -3,9 +3,15 @@ from enum import Enum
 import logging
 from typing import Union
 
+from price_granularity import PRICE_GRANULARITY_PRESETS, parse_price_granularity
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
+# line item priorities google admanager accepts, also the defaults of the preflight limits (see preflight.NETWORK_LIMITS)
+MIN_LINE_ITEM_PRIORITY = 1
+MAX_LINE_ITEM_PRIORITY = 16
+
 
 # allowed formats (can be expanded)
 class Formats(Enum):
@@ -48,8 +54,8 @@ def validate_line_item_priority(priority) -> int:
         logging.error(f"Given priority is not an integer: {priority}.")
         raise TypeError
     
-    if priority < 0 or priority > 14:
-        logging.error(f"Invalid line item priority: {priority}. Allowed values are between 0 and 14.")
+    if priority < MIN_LINE_ITEM_PRIORITY or priority > MAX_LINE_ITEM_PRIORITY:
+        logging.error(f"Invalid line item priority: {priority}. Allowed values are between {MIN_LINE_ITEM_PRIORITY} and {MAX_LINE_ITEM_PRIORITY}.")
         raise ValueError
     return int(priority)
 
@@ -234,6 +240,178 @@ def validate_price_bucket(start_price: float, end_price: float, step: float):
     if (end_price - start_price) % step != 0:
         logging.warning(f"Problematic price bucket step: {step}. It should be a partial of the difference between end price ({end_price}) and  ({start_price}) (currently: {end_price - start_price}).")
 
+def validate_price_granularity(granularity: str) -> list[tuple[int, int, int]]:
+    """Validate the price granularity.
+    The expected format is either a preset name or comma-separated ranges in cents following 'start-end:step'.
+
+    Args:
+        granularity (str): The price granularity string to validate.
+
+    Returns:
+        list[tuple[int, int, int]]: A list of validated (start, end, step) price ranges.
+    """
+    try:
+        price_ranges = parse_price_granularity(granularity)
+    except ValueError:
+        logging.error(f"Invalid price granularity: {granularity}. Allowed values are {list(PRICE_GRANULARITY_PRESETS.keys())} or ranges in cents like '1-300:1, 300-800:5'.")
+        raise ValueError
+    for start, end, step in price_ranges:
+        if step <= 0:
+            logging.error(f"Invalid price bucket step ({step}) in price granularity: {granularity}. Allowed values are greater than 0.")
+            raise ValueError
+        validate_price_bucket(start, end, step)
+    return price_ranges
+
+def validate_price_buckets_or_granularity(start_price, end_price, step, price_granularity):
+    if price_granularity:
+        if start_price is not None or end_price is not None or step is not None:
+            logging.warning("--price-granularity is set, therefore --start-price-bucket, --end-price-bucket and --price-bucket-step will be ignored.")
+        return
+    if start_price is None or end_price is None or step is None:
+        logging.error("Either --price-granularity or all of --start-price-bucket, --end-price-bucket and --price-bucket-step are required.")
+        raise ValueError
+    validate_price_bucket(start_price, end_price, step)
+
+def validate_price_buckets_per_line_item(price_buckets_per_line_item) -> int:
+    try:
+        price_buckets_per_line_item = int(price_buckets_per_line_item)
+    except (ValueError, TypeError):
+        logging.error(f"Price buckets per line item must be an integer, got {price_buckets_per_line_item}")
+        raise TypeError
+    if price_buckets_per_line_item < 1:
+        logging.error(f"Invalid price buckets per line item: {price_buckets_per_line_item}. Allowed values are greater than 0.")
+        raise ValueError
+    return price_buckets_per_line_item
+
+def validate_max_line_item_price_spread(max_line_item_price_spread) -> int:
+    try:
+        max_line_item_price_spread = int(max_line_item_price_spread)
+    except (ValueError, TypeError):
+        logging.error(f"Max line item price spread must be an integer (cents), got {max_line_item_price_spread}")
+        raise TypeError
+    if max_line_item_price_spread < 0:
+        logging.error(f"Invalid max line item price spread: {max_line_item_price_spread}. Allowed values are greater than or equal to 0.")
+        raise ValueError
+    return max_line_item_price_spread
+
+def validate_concurrency(concurrency) -> int:
+    try:
+        concurrency = int(concurrency)
+    except (ValueError, TypeError):
+        logging.error(f"Concurrency must be an integer, got {concurrency}")
+        raise TypeError
+    if concurrency < 1 or concurrency > 64:
+        logging.error(f"Invalid concurrency: {concurrency}. Allowed values are between 1 and 64.")
+        raise ValueError
+    return concurrency
+
+def validate_timeout(timeout) -> float:
+    try:
+        timeout = float(timeout)
+    except (ValueError, TypeError):
+        logging.error(f"Timeout must be a number of seconds, got {timeout}")
+        raise TypeError
+    if timeout <= 0:
+        logging.error(f"Invalid timeout: {timeout}. Allowed values are greater than 0.")
+        raise ValueError
+    return timeout
+
+def validate_lease_wait(lease_wait) -> float:
+    try:
+        lease_wait = float(lease_wait)
+    except (ValueError, TypeError):
+        logging.error(f"Lease wait must be a number of seconds, got {lease_wait}")
+        raise TypeError
+    if lease_wait < 0:
+        logging.error(f"Invalid lease wait: {lease_wait}. Allowed values are 0 (fail fast) and above.")
+        raise ValueError
+    return lease_wait
+
+def validate_max_batch_items(max_batch_items) -> int:
+    try:
+        max_batch_items = int(max_batch_items)
+    except (ValueError, TypeError):
+        logging.error(f"Max. batch items must be an integer, got {max_batch_items}")
+        raise TypeError
+    if max_batch_items < 1 or max_batch_items > 1000:
+        logging.error(f"Invalid max. batch items: {max_batch_items}. Allowed values are between 1 and 1000.")
+        raise ValueError
+    return max_batch_items
+
+def validate_max_request_kib(max_request_kib) -> int:
+    try:
+        max_request_kib = int(max_request_kib)
+    except (ValueError, TypeError):
+        logging.error(f"Max. request size must be an integer in KiB, got {max_request_kib}")
+        raise TypeError
+    if max_request_kib < 16:
+        logging.error(f"Invalid max. request size: {max_request_kib}KiB. Allowed values are 16KiB and above.")
+        raise ValueError
+    return max_request_kib
+
+def validate_report_date(report_date) -> datetime.date:
+    try:
+        return datetime.datetime.strptime(report_date, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        logging.error(f"Invalid report date: {report_date}. The expected format is YYYY-MM-DD.")
+        raise ValueError
+
+def validate_run_modes(args: dict):
+    # --verify, --preflight, --extend and --prune-delivery return different reports, a run does one of them
+    run_modes = [f"--{mode.replace('_', '-')}" for mode in ['verify', 'preflight', 'extend', 'prune_delivery'] if args.get(mode)]
+    if len(run_modes) > 1:
+        logging.error(f"Invalid combination of {', '.join(run_modes)}. Only one of them can be used per run.")
+        raise ValueError
+
+def validate_report_date_range(start_date: datetime.date, end_date: datetime.date):
+    if start_date > end_date:
+        logging.error(f"Invalid report date range: start date {start_date} must not be after end date {end_date}.")
+        raise ValueError
+
+def validate_min_impressions(min_impressions) -> int:
+    try:
+        min_impressions = int(min_impressions)
+    except (ValueError, TypeError):
+        logging.error(f"Min. impressions must be an integer, got {min_impressions}")
+        raise TypeError
+    if min_impressions < 1:
+        logging.error(f"Invalid min. impressions: {min_impressions}. Allowed values are greater than 0.")
+        raise ValueError
+    return min_impressions
+
+def validate_max_archived_line_items(max_archived) -> int:
+    try:
+        max_archived = int(max_archived)
+    except (ValueError, TypeError):
+        logging.error(f"Max. archived line items must be an integer, got {max_archived}")
+        raise TypeError
+    if max_archived < 0:
+        logging.error(f"Invalid max. archived line items: {max_archived}. Allowed values are 0 or greater.")
+        raise ValueError
+    return max_archived
+
+def validate_payload_max_mib(payload_max_mib) -> int:
+    try:
+        payload_max_mib = int(payload_max_mib)
+    except (ValueError, TypeError):
+        logging.error(f"Max. payload archive size must be an integer in MiB, got {payload_max_mib}")
+        raise TypeError
+    if payload_max_mib < 1:
+        logging.error(f"Invalid max. payload archive size: {payload_max_mib}MiB. Allowed values are 1MiB and above.")
+        raise ValueError
+    return payload_max_mib
+
+def validate_payload_sample_rate(payload_sample_rate) -> float:
+    try:
+        payload_sample_rate = float(payload_sample_rate)
+    except (ValueError, TypeError):
+        logging.error(f"Payload sample rate must be a number, got {payload_sample_rate}")
+        raise TypeError
+    if payload_sample_rate <= 0 or payload_sample_rate > 1:
+        logging.error(f"Invalid payload sample rate: {payload_sample_rate}. Allowed values are greater than 0 and at most 1.")
+        raise ValueError
+    return payload_sample_rate
+
 def validate_format(format: str, creatives_size: str, companion_sizes: list[str]): 
     logging.info(f"Validating format: {format} with creatives size: {creatives_size} and companion sizes: {companion_sizes}")
     if format == Formats.WALLPAPER.value:
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+# drift detection of managed line items: desired (assemble_line_item_jsons) and actual (google admanager) line items
+# are reduced to the same canonical form and compared by content hash
+
+VERIFY_MANIFEST_DIR = '.cache'
+MODIFIED_SINCE_MARGIN = 5 * 60 # seconds subtracted from the last verification, covers clock skew to google admanager
+
+
+def _get(obj, key):
+    # zeep objects and dicts, unset fields are None
+    if obj is None:
+        return None
+    return getattr(obj, '__values__', obj).get(key)
+
+
+def _format_date_time(date_time) -> str | None:
+    if date_time is None or isinstance(date_time, str):
+        return date_time
+    date = _get(date_time, 'date')
+    return f"{_get(date, 'year'):04d}-{_get(date, 'month'):02d}-{_get(date, 'day'):02d} {_get(date_time, 'hour'):02d}:{_get(date_time, 'minute'):02d}:{_get(date_time, 'second'):02d}"
+
+
+def _format_size(size) -> str:
+    return f"{_get(size, 'width')}x{_get(size, 'height')}"
+
+
+def _custom_criteria(criteria_set) -> list:
+    # google admanager returns the targeting as OR of AND sets, only the criteria themselves are compared
+    if criteria_set is None:
+        return []
+    children = _get(criteria_set, 'children')
+    if children is None:
+        return [[str(_get(criteria_set, 'keyId')), _get(criteria_set, 'operator'), sorted(str(value_id) for value_id in _get(criteria_set, 'valueIds') or [])]]
+    return sorted(criteria for child in children for criteria in _custom_criteria(child))
+
+
+def canonical_line_item(line_item, compare_start_date: bool = True, compare_end_date: bool = True) -> dict:
+    """
+    Reduces a line item (assembled dict or zeep object) to the fields managed by Buckets: type, priority, cost,
+    dates, sizes and targeting.
+    :param compare_start_date: False if the start date is relative to the run (immediately, one hour from now)
+    :param compare_end_date: False if the end date is relative to the run (unlimited, mapped to ten years from now)
+    """
+    cost_per_unit = _get(line_item, 'costPerUnit')
+    targeting = _get(line_item, 'targeting')
+    inventory_targeting = _get(targeting, 'inventoryTargeting')
+    unlimited_end_date_time = bool(_get(line_item, 'unlimitedEndDateTime'))
+    return {
+        'lineItemType': str(_get(line_item, 'lineItemType')).upper(),
+        'priority': int(_get(line_item, 'priority') or 0),
+        'costType': _get(line_item, 'costType'),
+        'costPerUnit': [_get(cost_per_unit, 'currencyCode'), int(_get(cost_per_unit, 'microAmount') or 0)],
+        'startDateTime': _format_date_time(_get(line_item, 'startDateTime')) if compare_start_date else None,
+        'endDateTime': _format_date_time(_get(line_item, 'endDateTime')) if compare_end_date and not unlimited_end_date_time else None,
+        'unlimitedEndDateTime': unlimited_end_date_time,
+        'isArchived': bool(_get(line_item, 'isArchived')),
+        'sizes': sorted(
+            [_format_size(_get(placeholder, 'size')), sorted(_format_size(_get(companion, 'size')) for companion in _get(placeholder, 'companions') or [])]
+            for placeholder in _get(line_item, 'creativePlaceholders') or []
+        ),
+        'targetedAdUnits': sorted(str(_get(ad_unit, 'adUnitId')) for ad_unit in _get(inventory_targeting, 'targetedAdUnits') or []),
+        'customTargeting': _custom_criteria(_get(targeting, 'customTargeting')),
+    }
+
+
+def content_hash(canonical: dict) -> str:
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def chunk_hash(line_item_hashes: dict[str, str]) -> str:
+    """
+    Hash of an order chunk, from the names and content hashes of its line items.
+    """
+    return hashlib.sha256('\n'.join(f'{name}:{line_item_hashes[name]}' for name in sorted(line_item_hashes)).encode('utf-8')).hexdigest()
+
+
+def diff_fields(desired: dict, actual: dict) -> list[str]:
+    return [field for field in desired if desired[field] != actual.get(field)]
+
+
+class VerifyManifest():
+    """
+    Local record of the order chunks that matched the desired setup, keyed by order name.
+    An order is skipped by the next verification if its desired chunk hash is unchanged
+    and none of its line items was modified since it was verified.
+    """
+
+    path: str = ''
+
+    def __init__(self, path: str, orders: dict[str, dict] = None):
+        self.path = path
+        self.orders: dict[str, dict] = orders or {} # order name -> {'id', 'chunk_hash', 'verified_at'}
+
+    def is_unchanged(self, order_name: str, desired_chunk_hash: str) -> bool:
+        return self.orders.get(order_name, {}).get('chunk_hash') == desired_chunk_hash
+
+    def modified_since(self, order_names: list[str]) -> float:
+        """
+        Returns the time from which on modified line items of the orders have to be verified again.
+        """
+        return min(self.orders[order_name]['verified_at'] for order_name in order_names) - MODIFIED_SINCE_MARGIN
+
+    def record(self, order_name: str, order_id: int, desired_chunk_hash: str, verified_at: float):
+        self.orders[order_name] = {'id': order_id, 'chunk_hash': desired_chunk_hash, 'verified_at': verified_at}
+
+    def forget(self, order_name: str):
+        self.orders.pop(order_name, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as manifest_file:
+            json.dump({'saved_at': time.time(), 'orders': self.orders}, manifest_file, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, network_code: str, format: str, manifest_dir: str = VERIFY_MANIFEST_DIR) -> 'VerifyManifest':
+        path = os.path.join(manifest_dir, f'verify_{network_code}_{format}.json')
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        logging.info(f"Loaded verification manifest with {len(manifest['orders'])} orders from {path}")
+        return cls(path, manifest['orders'])